@@ -1,6 +1,5 @@
 import logging
 import os
-from colorama import init
 
 __author__ = """Luca Fabbri"""
 __email__ = "l.fabbri@bopen.eu"
@@ -10,5 +9,3 @@ LOGGER = logging.getLogger("haunts")
 
 if os.environ.get("DEBUG"):
     LOGGER.setLevel(logging.DEBUG)
-
-init()
@@ -0,0 +1,120 @@
+"""Local cache of sheet values, validated against the revision of the spreadsheet"""
+
+import hashlib
+import json
+import os
+import time
+
+from . import LOGGER
+from .ini import get
+from .retry import execute
+from .services import get_service as get_api_service
+
+# If scopes are modified, delete the drive-token file.
+SCOPES = ["https://www.googleapis.com/auth/drive.metadata.readonly"]
+
+# Revision of documents, read once per run
+revisions = {}
+
+
+def get_service(config_dir):
+    return get_api_service(config_dir, "drive", "v3", SCOPES, "drive-token.json")
+
+
+def enabled():
+    return float(get("CACHE_TTL", 0)) > 0
+
+
+def get_revision(config_dir, document_id, refresh=False):
+    """Return the revision of a document, with a single metadata request per run.
+
+    When refresh is True the revision is read again, like when polling for changes.
+    """
+    if refresh or document_id not in revisions:
+        metadata = execute(
+            get_service(config_dir)
+            .files()
+            .get(fileId=document_id, fields="modifiedTime,version")
+        )
+        revisions[document_id] = f"{metadata.get('version')}:{metadata['modifiedTime']}"
+    return revisions[document_id]
+
+
+def entry_path(config_dir, document_id, sheet_name):
+    key = hashlib.sha1(f"{document_id}\0{sheet_name}".encode("utf-8")).hexdigest()
+    return config_dir / "cache" / f"{key}.json"
+
+
+def load(config_dir, sheet_name):
+    """Return the cached value of a sheet, or None if missing, expired or outdated."""
+    document_id = get("CONTROLLER_SHEET_DOCUMENT_ID")
+    path = entry_path(config_dir, document_id, sheet_name)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if time.time() - entry["stored"] > float(get("CACHE_TTL", 0)):
+        LOGGER.debug(f'Cache entry of sheet "{sheet_name}" is expired')
+        return None
+    if entry["revision"] != get_revision(config_dir, document_id):
+        LOGGER.debug(f'Cache entry of sheet "{sheet_name}" is outdated')
+        return None
+    LOGGER.debug(f'Sheet "{sheet_name}" read from cache')
+    return entry["value"]
+
+
+def store(config_dir, sheet_name, value):
+    """Save the value of a sheet to the cache, then evict old entries."""
+    document_id = get("CONTROLLER_SHEET_DOCUMENT_ID")
+    path = entry_path(config_dir, document_id, sheet_name)
+    path.parent.mkdir(exist_ok=True)
+    entry = {
+        "document": document_id,
+        "sheet": sheet_name,
+        "revision": get_revision(config_dir, document_id),
+        "stored": time.time(),
+        "value": value,
+    }
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+    evict(config_dir)
+
+
+def evict(config_dir):
+    """Remove expired entries, then oldest ones until the cache fits in CACHE_MAX_SIZE."""
+    ttl = float(get("CACHE_TTL", 0))
+    max_size = float(get("CACHE_MAX_SIZE", 50)) * 1024 * 1024
+    now = time.time()
+    entries = []
+    for path in (config_dir / "cache").glob("*.json"):
+        stat = path.stat()
+        if now - stat.st_mtime > ttl:
+            path.unlink(missing_ok=True)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+    size = sum(entry[1] for entry in entries)
+    for _, entry_size, path in sorted(entries):
+        if size <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        size -= entry_size
+
+
+def cached(config_dir, sheet_name, read):
+    """Return the value of a sheet from the cache, or from read() when not available.
+
+    Values returned by read() must be JSON serializable.
+    When the cache is not enabled (CACHE_TTL is 0), read() is always used.
+    """
+    if not enabled():
+        return read()
+    # The revision is read before the sheet, so changes done while reading are detected
+    get_revision(config_dir, get("CONTROLLER_SHEET_DOCUMENT_ID"))
+    value = load(config_dir, sheet_name)
+    if value is None:
+        value = read()
+        store(config_dir, sheet_name, value)
+    return value
@@ -1,49 +1,87 @@
-import time
+import bisect
 import datetime
+import functools
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import click
-from dateutil import parser
 
 from googleapiclient.errors import HttpError
-from googleapiclient.discovery import build
 
 from . import LOGGER
 from .ini import get
-from .credentials import get_credentials
+from .retry import call, execute, get_deadline, is_retryable, pause, retry_delay
+from .services import get_service as get_api_service
 
-LOCAL_TIMEZONE = datetime.datetime.utcnow().astimezone().strftime("%z")
-# Weird google spreadsheet date management
-ORIGIN_TIME = datetime.datetime.strptime(
-    f"1899-12-30T00:00:00{LOCAL_TIMEZONE}", "%Y-%m-%dT%H:%M:%S%z"
-)
 # If scopes are modified, delete the calendars-token file.
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
+# Max number of calls allowed by Google in a single batch request
+BATCH_SIZE = 50
+# Max number of calendars in a single freebusy query
+FREEBUSY_MAX_CALENDARS = 50
+# Private extended property set on events created by haunts
+HAUNTS_PROPERTY = "haunts"
+# Only fields of events read by haunts are requested
+EVENT_FIELDS = "id,htmlLink,start,end,organizer/displayName"
+
+
+@functools.lru_cache(maxsize=None)
+def local_timezone():
+    return datetime.datetime.utcnow().astimezone().strftime("%z")
+
+
+@functools.lru_cache(maxsize=None)
+def origin_time():
+    # Weird google spreadsheet date management
+    return datetime.datetime.strptime(
+        f"1899-12-30T00:00:00{local_timezone()}", "%Y-%m-%dT%H:%M:%S%z"
+    )
+
+
+def __getattr__(name):
+    """LOCAL_TIMEZONE and ORIGIN_TIME are only computed when used."""
+    if name == "LOCAL_TIMEZONE":
+        return local_timezone()
+    if name == "ORIGIN_TIME":
+        return origin_time()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def formatDate(date, format):
+    from dateutil import parser
+
     return parser.isoparse(date).strftime(format)
 
 
+def get_service(config_dir):
+    return get_api_service(config_dir, "calendar", "v3", SCOPES, "calendars-token.json")
+
+
 def init(config_dir):
-    get_credentials(config_dir, SCOPES, "calendars-token.json")
+    get_service(config_dir)
 
 
-def create_event(config_dir, calendar, date, summary, details, length, from_time=None):
-    creds = get_credentials(config_dir, SCOPES, "calendars-token.json")
-    service = build("calendar", "v3", credentials=creds)
+def event_owner(month):
+    """Value of HAUNTS_PROPERTY for events of a sheet: spreadsheet id and sheet name."""
+    return f'{get("CONTROLLER_SHEET_DOCUMENT_ID")}:{month}'
 
+
+def build_event(date, summary, details, length, from_time=None, month=None):
+    """Prepare the body of a new event, without sending it to Google Calendar.
+
+    The event is marked as owned by the sheet month (see event_owner).
+    Return the event body and the time slot where the next event should start.
+    """
     from_time = from_time or get("START_TIME", "09:00")
     start = datetime.datetime.strptime(
-        f"{date.strftime('%Y-%m-%d')}T{from_time}:00{LOCAL_TIMEZONE}",
+        f"{date.strftime('%Y-%m-%d')}T{from_time}:00{local_timezone()}",
         f"%Y-%m-%dT%H:%M:%S%z",
     )
 
     startParams = None
     endParams = None
     haveLength = length is not None and type(length) is not str
-    duration = None
     if haveLength:
-        duration = float(length)
-        delta = datetime.timedelta(hours=duration)
+        delta = datetime.timedelta(hours=float(length))
     else:
         delta = datetime.timedelta(hours=0)
     end = start + delta
@@ -68,57 +106,367 @@ def create_event(config_dir, calendar, date, summary, details, length, from_time
         "description": details,
         "start": startParams,
         "end": endParams,
+        "extendedProperties": {"private": {HAUNTS_PROPERTY: event_owner(month)}},
     }
+    next_slot = end.strftime("%H:%M") if haveLength else from_time
+    return event_body, next_slot
 
-    def execute_creation():
-        LOGGER.debug(calendar, date, summary, details, length, event_body, from_time)
-        event = service.events().insert(calendarId=calendar, body=event_body).execute()
-        return event
-
-    try:
-        event = execute_creation()
-    except HttpError as err:
-        if err.status_code == 429:
-            click.echo("Too many requests")
-            click.echo(err.error_details)
-            click.echo("haunts will now pause for a while ⏲…")
-            time.sleep(60)
-            click.echo("Retrying…")
-            event = execute_creation()
-        else:
-            raise
 
-    LOGGER.debug(event.items())
+def echo_created(event, summary, length, verb="Created"):
+    """Print a feedback for an event created (or changed) on the calendar."""
+    haveLength = length is not None and type(length) is not str
+    duration = float(length) if haveLength else None
     if duration:
         click.echo(
-            f'Created event "{summary}" from {formatDate(event["start"]["dateTime"], "%H:%M")} '
+            f'{verb} event "{summary}" from {formatDate(event["start"]["dateTime"], "%H:%M")} '
             f'to {formatDate(event["end"]["dateTime"], "%H:%M")} ({duration}h) '
             f'in date {formatDate(event["start"]["dateTime"], "%d/%m")} '
             f'on calendar {event["organizer"]["displayName"]}'
         )
     else:
         click.echo(
-            f'Created event "{summary}" (full day) '
+            f'{verb} event "{summary}" (full day) '
             f'in date {formatDate(event["start"]["date"], "%d/%m")} '
             f'on calendar {event["organizer"]["displayName"]}'
         )
 
-    event_data = {
-        "id": event["id"],
-        "next_slot": end.strftime("%H:%M") if haveLength else from_time,
-        "link": event["htmlLink"],
-    }
-    return event_data
+
+def insert_event(config_dir, calendar, event_body):
+    """Send a new event to the calendar, and return it."""
+    service = get_service(config_dir)
+
+    LOGGER.debug(calendar, event_body)
+    event = execute(
+        service.events().insert(
+            calendarId=calendar, body=event_body, fields=EVENT_FIELDS
+        )
+    )
+    LOGGER.debug(event.items())
+    return event
+
+
+def new_event_id():
+    """A random id for a new event, accepted by Google Calendar (base32hex characters).
+
+    Knowing the id before creating an event allows to check later if it was created.
+    """
+    return uuid.uuid4().hex
+
+
+def find_event(config_dir, calendar, event_id):
+    """Return an event, or None if not found or deleted."""
+    service = get_service(config_dir)
+    try:
+        event = execute(
+            service.events().get(
+                calendarId=calendar, eventId=event_id, fields=f"{EVENT_FIELDS},status"
+            )
+        )
+    except HttpError as err:
+        if err.status_code in (404, 410):
+            return None
+        raise
+    return event if event.get("status") != "cancelled" else None
+
+
+def patch_body(event_body):
+    """Turn the body of a new event into a patch for an existing one.
+
+    Start and end of the event can switch between date and time, so the unused one is cleared.
+    """
+    body = dict(event_body)
+    for key in ("start", "end"):
+        body[key] = {"date": None, "dateTime": None, **body[key]}
+    return body
+
+
+def move_event(config_dir, calendar, event_id, source):
+    """Move an event from the source calendar to another one."""
+    service = get_service(config_dir)
+    return execute(
+        service.events().move(
+            calendarId=source, eventId=event_id, destination=calendar, fields="id"
+        )
+    )
+
+
+def update_event(config_dir, calendar, event_id, event_body, source=None):
+    """Change an existing event, moving it from the source calendar when needed."""
+    service = get_service(config_dir)
+    if source and source != calendar:
+        move_event(config_dir, calendar, event_id, source)
+    return execute(
+        service.events().patch(
+            calendarId=calendar,
+            eventId=event_id,
+            body=patch_body(event_body),
+            fields=EVENT_FIELDS,
+        )
+    )
 
 
 def delete_event(config_dir, calendar, event_id):
-    creds = get_credentials(config_dir, SCOPES, "calendars-token.json")
-    service = build("calendar", "v3", credentials=creds)
+    service = get_service(config_dir)
     if not event_id:
         click.echo(f"Missing id. Skipping…")
         return
     try:
-        service.events().delete(calendarId=calendar, eventId=event_id).execute()
+        execute(service.events().delete(calendarId=calendar, eventId=event_id))
     except HttpError as err:
-        if err.status_code == 410:
-            click.echo(f"Event {event_id} already deleted")
+        if err.status_code != 410:
+            raise
+        click.echo(f"Event {event_id} already deleted")
+
+
+def batch_events(config_dir, operations):
+    """Execute create, update and delete operations using Calendar API batch requests.
+
+    Every operation is a dict with an "action" key ("create", "update" or "delete") and
+    a "calendar" key.
+    Create and update operations also provide the event "body", update and delete operations
+    the "event_id". Update operations can provide the "source" calendar, when the event must
+    be moved to a new calendar.
+
+    Return a list of (operation, result, error) tuples, in the same order of operations.
+    The result is the created or updated event (or None for deletions).
+    """
+    service = get_service(config_dir)
+    results = {}
+
+    # Moving an event must be done before changing it, so it's not part of batches
+    for index, operation in enumerate(operations):
+        source = operation.get("source")
+        if (
+            operation["action"] == "update"
+            and source
+            and source != operation["calendar"]
+        ):
+            try:
+                move_event(
+                    config_dir, operation["calendar"], operation["event_id"], source
+                )
+            except HttpError as err:
+                results[index] = (None, err)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    def execute_batch(indexes):
+        batch = service.new_batch_http_request(callback=callback)
+        for index in indexes:
+            operation = operations[index]
+            if operation["action"] == "create":
+                request = service.events().insert(
+                    calendarId=operation["calendar"],
+                    body=operation["body"],
+                    fields=EVENT_FIELDS,
+                )
+            elif operation["action"] == "update":
+                request = service.events().patch(
+                    calendarId=operation["calendar"],
+                    eventId=operation["event_id"],
+                    body=patch_body(operation["body"]),
+                    fields=EVENT_FIELDS,
+                )
+            else:
+                request = service.events().delete(
+                    calendarId=operation["calendar"], eventId=operation["event_id"]
+                )
+            batch.add(request, request_id=str(index))
+        batch.execute()
+
+    for chunk_start in range(0, len(operations), BATCH_SIZE):
+        indexes = [
+            index
+            for index in range(
+                chunk_start, min(chunk_start + BATCH_SIZE, len(operations))
+            )
+            if index not in results
+        ]
+        deadline = get_deadline()
+        attempt = 1
+        while indexes:
+            call(lambda: execute_batch(indexes), name="calendar.batch")
+            # Only failed calls are sent again
+            failed = [index for index in indexes if is_retryable(results[index][1])]
+            if not failed:
+                break
+            delays = [retry_delay(results[i][1], attempt, deadline) for i in failed]
+            if None in delays:
+                break
+            pause(results[failed[0]][1], max(delays))
+            indexes = failed
+            attempt += 1
+
+    outcome = []
+    for index, operation in enumerate(operations):
+        response, exception = results[index]
+        if (
+            operation["action"] == "delete"
+            and isinstance(exception, HttpError)
+            and exception.status_code == 410
+        ):
+            click.echo(f"Event {operation['event_id']} already deleted")
+            exception = None
+        outcome.append((operation, response, exception))
+    return outcome
+
+
+def run_events(config_dir, operations, batch=False):
+    """Execute create, update and delete operations, one by one or using batch requests.
+
+    Return a list of (operation, result, error) tuples, like batch_events.
+    """
+    if batch:
+        return batch_events(config_dir, operations)
+    outcome = []
+    for operation in operations:
+        try:
+            if operation["action"] == "create":
+                response = insert_event(
+                    config_dir, operation["calendar"], operation["body"]
+                )
+            elif operation["action"] == "update":
+                response = update_event(
+                    config_dir,
+                    operation["calendar"],
+                    operation["event_id"],
+                    operation["body"],
+                    source=operation.get("source"),
+                )
+            else:
+                response = delete_event(
+                    config_dir, operation["calendar"], operation["event_id"]
+                )
+        except HttpError as err:
+            outcome.append((operation, None, err))
+        else:
+            outcome.append((operation, response, None))
+    return outcome
+
+
+def parallel_events(config_dir, operations, workers, batch=False, executor=None):
+    """Execute create, update and delete operations using a pool of workers.
+
+    Operations are partitioned by calendar and every calendar is handled by a single worker.
+    An executor can be provided to reuse the same threads (and their service clients)
+    for multiple calls.
+    Return a list of (operation, result, error) tuples, in the same order of operations.
+    """
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return parallel_events(config_dir, operations, workers, batch, executor)
+
+    partitions = {}
+    for index, operation in enumerate(operations):
+        partitions.setdefault(operation["calendar"], []).append(index)
+
+    outcome = [None] * len(operations)
+    futures = {
+        executor.submit(
+            run_events, config_dir, [operations[i] for i in indexes], batch
+        ): indexes
+        for indexes in partitions.values()
+    }
+    for future in as_completed(futures):
+        for index, result in zip(futures[future], future.result()):
+            outcome[index] = result
+    return outcome
+
+
+class BusyIndex:
+    """Busy time slots of every day, in minutes from midnight.
+
+    Slots of a day are kept sorted and merged, so finding a free slot is a binary search.
+    """
+
+    def __init__(self):
+        self.days = {}
+
+    def add(self, day, start, end):
+        """Mark minutes from start to end of a day as busy."""
+        if end <= start:
+            return
+        starts, ends = self.days.setdefault(day, ([], []))
+        # Merge with all slots overlapping or touching the new one
+        first = bisect.bisect_left(ends, start)
+        last = bisect.bisect_right(starts, end)
+        if first < last:
+            start = min(start, starts[first])
+            end = max(end, ends[last - 1])
+        starts[first:last] = [start]
+        ends[first:last] = [end]
+
+    def add_event(self, start, end):
+        """Mark the time between two local datetimes as busy, also across multiple days."""
+        while start < end:
+            midnight = datetime.datetime.combine(
+                start.date() + datetime.timedelta(days=1), datetime.time(), start.tzinfo
+            )
+            until = min(end, midnight)
+            self.add(
+                start.date(),
+                start.hour * 60 + start.minute,
+                (until - start) // datetime.timedelta(minutes=1)
+                + start.hour * 60
+                + start.minute,
+            )
+            start = until
+
+    def first_free(self, day, start, length):
+        """First minute, from start, of a free slot long length minutes in a day.
+
+        Return None if there's no such slot before the end of the day.
+        """
+        starts, ends = self.days.get(day, ([], []))
+        i = bisect.bisect_right(ends, start)
+        while i < len(starts) and starts[i] < start + length:
+            start = max(start, ends[i])
+            i += 1
+        if start + length > 24 * 60:
+            return None
+        return start
+
+
+def get_busy_index(config_dir, calendar_ids, date_min, date_max):
+    """Read busy times of calendars from date_min to date_max (included).
+
+    A single freebusy query is done for up to FREEBUSY_MAX_CALENDARS calendars.
+    """
+    from dateutil import parser
+
+    service = get_service(config_dir)
+    timezone = origin_time().tzinfo
+    time_min = datetime.datetime.combine(date_min, datetime.time(), timezone)
+    time_max = datetime.datetime.combine(
+        date_max + datetime.timedelta(days=1), datetime.time(), timezone
+    )
+    calendar_ids = list(dict.fromkeys(calendar_ids))
+    index = BusyIndex()
+    for start in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+        result = execute(
+            service.freebusy().query(
+                fields="calendars",
+                body={
+                    "timeMin": time_min.isoformat(),
+                    "timeMax": time_max.isoformat(),
+                    "items": [
+                        {"id": calendar_id}
+                        for calendar_id in calendar_ids[
+                            start : start + FREEBUSY_MAX_CALENDARS
+                        ]
+                    ],
+                },
+            )
+        )
+        for calendar_id, calendar in result.get("calendars", {}).items():
+            for error in calendar.get("errors", []):
+                click.echo(
+                    f"Cannot read busy times of calendar {calendar_id}: {error.get('reason')}"
+                )
+            for busy in calendar.get("busy", []):
+                index.add_event(
+                    parser.isoparse(busy["start"]).astimezone(timezone),
+                    parser.isoparse(busy["end"]).astimezone(timezone),
+                )
+    return index
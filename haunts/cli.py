@@ -9,20 +9,29 @@ from importlib.metadata import version
 import click
 
 from .ini import create_default, init
-from .calendars import init as init_calendars
-from .spreadsheet import sync_report
-from .report import report
 from . import actions
 
 
 @click.command()
-@click.argument("sheet", required=False)
+@click.argument("sheets", nargs=-1)
 @click.option(
     "--day",
     "-d",
     multiple=True,
     help='day filter in format "YYYY-MM-DD". Can be provided multiple times.',
 )
+@click.option(
+    "--from",
+    "date_from",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help='only use days starting from this one, in format "YYYY-MM-DD".',
+)
+@click.option(
+    "--to",
+    "date_to",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help='only use days up to this one (included), in format "YYYY-MM-DD".',
+)
 @click.option(
     "--config",
     "-c",
@@ -35,7 +44,7 @@ from . import actions
 @click.option(
     "--execute",
     "-e",
-    type=click.Choice(["sync", "report"], case_sensitive=False),
+    type=click.Choice(["sync", "report", "reconcile"], case_sensitive=False),
     help="select which action to execute.",
     show_default=True,
     default="sync",
@@ -63,6 +72,108 @@ from . import actions
     show_default=True,
     default=False,
 )
+@click.option(
+    "--year",
+    "-y",
+    type=click.IntRange(min=1900),
+    help="report days of a year, from all sheets when SHEETS are not provided.",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "csv", "jsonl"], case_sensitive=False),
+    help="report output format: a table, or rows written as soon as they are computed. "
+    "With --plan, table or jsonl.",
+    show_default=True,
+    default="table",
+)
+@click.option(
+    "--group-by",
+    "-g",
+    type=click.Choice(["day", "week", "month", "project"], case_sensitive=False),
+    help="report totals by day, week, month or project.",
+)
+@click.option(
+    "--batch",
+    "-b",
+    help="send calendar operations using batch requests, up to 50 operations per request.",
+    is_flag=True,
+    show_default=True,
+    default=False,
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    help="number of calendars to be synced concurrently.",
+    show_default=True,
+    default=1,
+)
+@click.option(
+    "--free-slots",
+    "-f",
+    help="place new events without a start time in the first free slot of the day, "
+    "checking busy times of all calendars.",
+    is_flag=True,
+    show_default=True,
+    default=False,
+)
+@click.option(
+    "--source",
+    "-s",
+    type=click.Path(exists=True, dir_okay=False),
+    help="read sheets from a local CSV, XLSX or ODS file. Sync requires --dry-run or "
+    "--plan.",
+)
+@click.option(
+    "--dry-run",
+    "-n",
+    help="only display calendar events that sync would create, update or delete.",
+    is_flag=True,
+    show_default=True,
+    default=False,
+)
+@click.option(
+    "--plan",
+    "show_plan",
+    help="only display the operations of a sync, with an estimate of needed API "
+    "requests and quota.",
+    is_flag=True,
+    show_default=True,
+    default=False,
+)
+@click.option(
+    "--resume",
+    "-r",
+    help="complete an interrupted sync, using its sheets and options. Results not saved "
+    "to the sheet are written back, then remaining rows are synced.",
+    is_flag=True,
+    show_default=True,
+    default=False,
+)
+@click.option(
+    "--watch",
+    help="keep running, and sync again every time the spreadsheet changes "
+    "(checked every WATCH_INTERVAL seconds). Only changed sheets are synced.",
+    is_flag=True,
+    show_default=True,
+    default=False,
+)
+@click.option(
+    "--stats",
+    "show_stats",
+    help="print timings of every phase and API call, with counters of requests, "
+    "retries and rows.",
+    is_flag=True,
+    show_default=True,
+    default=False,
+)
+@click.option(
+    "--trace",
+    "trace_file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="write timings of every phase and API call to a file, in Chrome trace format.",
+)
 @click.option(
     "--version",
     "-v",
@@ -71,17 +182,38 @@ from . import actions
     is_flag=True,
 )
 def main(
-    sheet=None,
+    sheets=(),
     day=[],
+    date_from=None,
+    date_to=None,
     run_configuration=False,
     execute="sync",
     action=[],
     project=[],
     overtime=False,
+    year=None,
+    output_format="table",
+    group_by=None,
+    batch=False,
+    workers=1,
+    free_slots=False,
+    source=None,
+    dry_run=False,
+    show_plan=False,
+    resume=False,
+    watch=False,
+    show_stats=False,
+    trace_file=None,
     show_version=False,
 ):
     """
     Entry point for haunts.
+
+    SHEETS are names of sheets to be used. Ranges of sheets like "Jan..Mar" (in document
+    order) and patterns like "2023-*" are also accepted. Reports of multiple sheets are
+    merged in a single report.
+    When reading from a local --source file, SHEETS can be omitted to use its first sheet.
+    With --resume, SHEETS are the ones of the interrupted sync.
     """
 
     if show_version:
@@ -114,8 +246,8 @@ def main(
             )
             sys.exit(1)
 
-    if not run_configuration and not sheet:
-        click.echo(f"Argument SHEET is required if no '--config' flag is provided.")
+    if not run_configuration and not sheets and not source and not year and not resume:
+        click.echo(f"Argument SHEETS is required if no '--config' flag is provided.")
         sys.exit(1)
 
     init(config)
@@ -124,17 +256,129 @@ def main(
         click.echo("All done. You can now start using haunts.")
         sys.exit(0)
 
-    init_calendars(config_dir)
+    if execute != "report" and (
+        year or group_by or (output_format != "table" and not show_plan)
+    ):
+        click.echo(
+            "--year, --format and --group-by can only be used with --execute report."
+        )
+        sys.exit(1)
+
+    if show_plan and (execute != "sync" or output_format == "csv"):
+        click.echo("--plan can only be used to sync, with table or jsonl --format.")
+        sys.exit(1)
+
+    if resume and (execute != "sync" or source or dry_run or show_plan):
+        click.echo(
+            "--resume can only be used to sync, without --source, --dry-run and --plan."
+        )
+        sys.exit(1)
+
+    if watch and (execute != "sync" or source or show_plan or resume):
+        click.echo(
+            "--watch can only be used to sync, without --source, --plan and --resume."
+        )
+        sys.exit(1)
+
+    if source and execute == "reconcile":
+        click.echo(
+            "Reconciliation requires the Google Spreadsheet: --source is not supported."
+        )
+        sys.exit(1)
+
+    if source and execute == "sync" and not dry_run and not show_plan:
+        click.echo("Syncing from a local --source file requires --dry-run or --plan.")
+        sys.exit(1)
+
+    import colorama
+
+    colorama.init()
+
+    if show_stats or trace_file:
+        from . import metrics
+
+        def save_metrics():
+            if show_stats:
+                metrics.print_stats()
+            if trace_file:
+                metrics.write_trace(trace_file)
+
+        metrics.enable()
+        # Also done when the run is interrupted by an error
+        click.get_current_context().call_on_close(save_metrics)
+
+    # Modules using Google APIs are only loaded here, so --help and --version are fast
     if execute == "sync":
+        from .spreadsheet import sync_report
+
+        if not source and not dry_run and not show_plan:
+            # Calendar credentials are only needed when events are changed
+            from .calendars import init as init_calendars
+
+            init_calendars(config_dir)
+        if watch:
+            from .watch import watch as watch_sheets
+
+            watch_sheets(
+                config_dir,
+                sheets,
+                days=[datetime.datetime.strptime(d, "%Y-%m-%d") for d in day],
+                projects=project,
+                allowed_actions=action,
+                batch=batch,
+                workers=workers,
+                date_from=date_from,
+                date_to=date_to,
+                dry_run=dry_run,
+                free_slots=free_slots,
+            )
+            return 0
         sync_report(
             config_dir,
-            sheet,
+            sheets,
             days=[datetime.datetime.strptime(d, "%Y-%m-%d") for d in day],
             projects=project,
             allowed_actions=action,
+            batch=batch,
+            workers=workers,
+            date_from=date_from,
+            date_to=date_to,
+            dry_run=dry_run,
+            source=source,
+            free_slots=free_slots,
+            resume=resume,
+            plan=show_plan,
+            output_format=output_format,
+        )
+    elif execute == "reconcile":
+        from .reconcile import reconcile
+
+        reconcile(
+            config_dir,
+            sheets,
+            days=[datetime.datetime.strptime(d, "%Y-%m-%d") for d in day],
+            projects=project,
+            workers=workers,
+            date_from=date_from,
+            date_to=date_to,
+            dry_run=dry_run,
         )
     elif execute == "report":
-        report(config_dir, sheet, days=day, projects=project, overtime=overtime)
+        from .report import report
+
+        report(
+            config_dir,
+            sheets,
+            days=day,
+            projects=project,
+            overtime=overtime,
+            date_from=date_from,
+            date_to=date_to,
+            source=source,
+            year=year,
+            output_format=output_format,
+            group_by=group_by,
+        )
     return 0
 
 
@@ -1,45 +1,158 @@
-"""Credentials for Google Calendar API"""
+"""Credentials for Google APIs"""
 
+import datetime
+import json
+import os
 import sys
+import threading
 
 import click
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 
-credentials_cache = {}
+from . import LOGGER, metrics
+from .ini import get_boolean
 
+# Token file shared by all services when COMBINED_TOKEN is enabled
+COMBINED_TOKEN_FILE = "token.json"
+# Scopes requested at once for the combined token: Google Sheets and Google Calendar
+COMBINED_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/calendar",
+]
+# Credentials are refreshed in background when they expire in less than this
+REFRESH_MARGIN = datetime.timedelta(minutes=10)
 
-def get_credentials(config_dir, scopes, token_file):
-    global credentials_cache
-    creds = credentials_cache.get(token_file)
-    if creds:
-        return creds
-    # The file at token_file stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    token = config_dir / token_file
-    credentials = config_dir / "credentials.json"
-    if not credentials.exists():
-        click.echo(
-            f"Missing credentials file at {credentials.resolve()}. "
-            f"Did you created a Google Cloud project and downloaded the credentials file?"
+managers = {}
+managers_lock = threading.Lock()
+
+
+class CredentialManager:
+    """Credentials stored in a token file, shared by all threads.
+
+    Credentials are refreshed in background before they expire, so a long sync never waits
+    for a refresh, and the token file is saved atomically.
+    """
+
+    def __init__(self, config_dir, token_file, scopes):
+        self.config_dir = config_dir
+        self.token = config_dir / token_file
+        self.scopes = list(scopes)
+        self.lock = threading.RLock()
+        self.credentials = None
+        self.timer = None
+
+    def get(self):
+        """Return valid credentials, loading (or creating) them the first time."""
+        with self.lock:
+            if self.credentials is None:
+                with metrics.span("load credentials", "auth", token=self.token.name):
+                    self.credentials = self.load()
+            elif not self.fresh():
+                self.refresh()
+            return self.credentials
+
+    def require(self, scopes):
+        """Add scopes to the ones of the token: a new authorization is needed."""
+        with self.lock:
+            missing = [scope for scope in scopes if scope not in self.scopes]
+            if missing:
+                self.scopes.extend(missing)
+                self.credentials = None
+
+    def fresh(self):
+        expiry = self.credentials.expiry
+        return self.credentials.valid and (
+            expiry is None or expiry - datetime.datetime.utcnow() > REFRESH_MARGIN
         )
-        sys.exit(1)
-    if token.is_file():
-        creds = Credentials.from_authorized_user_file(token.resolve(), scopes)
-        credentials_cache[token_file] = creds
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                credentials.resolve(), scopes
+
+    def load(self):
+        # The token file stores the user's access and refresh tokens, and is created
+        # automatically when the authorization flow completes for the first time.
+        credentials = self.config_dir / "credentials.json"
+        if not credentials.exists():
+            click.echo(
+                f"Missing credentials file at {credentials.resolve()}. "
+                f"Did you created a Google Cloud project and downloaded the credentials file?"
             )
-            creds = flow.run_local_server(port=0)
-            credentials_cache[token_file] = creds
-        # Save the credentials for the next run
-        with open(token.resolve(), "w") as token:
-            token.write(creds.to_json())
-    return creds
+            sys.exit(1)
+        if self.token.is_file():
+            with open(self.token) as f:
+                info = json.load(f)
+            granted = info.get("scopes") or []
+            if isinstance(granted, str):
+                granted = granted.split(" ")
+            if all(scope in granted for scope in self.scopes):
+                self.credentials = Credentials.from_authorized_user_info(info, granted)
+                if not self.fresh() and self.credentials.refresh_token:
+                    self.refresh()
+                else:
+                    self.schedule()
+                if self.credentials.valid:
+                    return self.credentials
+            else:
+                LOGGER.debug(f"Token at {self.token} is missing some scopes")
+        # If there are no (valid) credentials available, let the user log in.
+        flow = InstalledAppFlow.from_client_secrets_file(
+            credentials.resolve(), self.scopes
+        )
+        self.credentials = flow.run_local_server(port=0)
+        self.save()
+        self.schedule()
+        return self.credentials
+
+    def save(self):
+        """Save the credentials for the next run, replacing the token file atomically."""
+        tmp = self.token.with_name(f".{self.token.name}.tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(self.credentials.to_json())
+        os.replace(tmp, self.token)
+
+    def refresh(self):
+        with self.lock:
+            LOGGER.debug(f"Refreshing credentials of {self.token.name}")
+            with metrics.span("refresh credentials", "auth", token=self.token.name):
+                self.credentials.refresh(Request())
+            self.save()
+            self.schedule()
+
+    def schedule(self):
+        """Schedule a refresh in background, before credentials expire."""
+        if self.timer:
+            self.timer.cancel()
+        expiry = self.credentials.expiry
+        if expiry is None:
+            return
+        delay = expiry - datetime.datetime.utcnow() - REFRESH_MARGIN
+        self.timer = threading.Timer(
+            max(delay.total_seconds(), 0), self.refresh_in_background
+        )
+        self.timer.daemon = True
+        self.timer.start()
+
+    def refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as err:
+            # Credentials are still valid: they will be refreshed when used
+            LOGGER.debug(f"Background refresh of {self.token.name} failed: {err}")
+
+
+def get_credentials(config_dir, scopes, token_file):
+    """Return credentials for the given scopes, stored in token_file.
+
+    When COMBINED_TOKEN is enabled, a single token file is used for all services, so the
+    authorization is requested once for all of them.
+    """
+    if get_boolean("COMBINED_TOKEN"):
+        token_file = COMBINED_TOKEN_FILE
+        scopes = COMBINED_SCOPES + [s for s in scopes if s not in COMBINED_SCOPES]
+    with managers_lock:
+        manager = managers.get(token_file)
+        if manager is None:
+            manager = CredentialManager(config_dir, token_file, scopes)
+            managers[token_file] = manager
+    manager.require(scopes)
+    return manager.get()
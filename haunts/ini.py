@@ -1,6 +1,5 @@
 import configparser
 
-
 DEFAULT_INI = """[haunts]
 # The Google Sheet Document id where you register events
 # Required
@@ -21,6 +20,76 @@ CONTROLLER_SHEET_DOCUMENT_ID=<Google Sheet Document Id here>
 # Overtime start date in HH:MM format
 # Default is empty: no overtime
 # OVERTIME_FROM=20:00
+
+# Seconds after which changes to the sheet are saved during a long sync.
+# All changes are always saved at the end of the run.
+# Default is 30
+# WRITEBACK_INTERVAL=30
+
+# Read sheets in pages of PAGE_SIZE rows, processing rows while following pages are read.
+# Useful to keep memory usage low on very large sheets.
+# Default is empty: every sheet is read with a single request
+# PAGE_SIZE=1000
+
+# Max number of attempts for a request to Google APIs failing with a temporary error
+# (too many requests, quota exceeded, server errors).
+# Default is 5
+# RETRY_MAX_ATTEMPTS=5
+
+# Max seconds spent retrying a single request to Google APIs
+# Default is 300
+# RETRY_DEADLINE=300
+
+# Seconds for which sheets read by reports (and the configuration sheet) are kept in a
+# local cache, in the "cache" folder of the haunts configuration folder.
+# Cached sheets are used only if the spreadsheet was not changed since, which is checked
+# using Google Drive file metadata (a new authorization is requested the first time).
+# Default is 0: cache is disabled
+# CACHE_TTL=3600
+
+# Max size of the local cache in MB: oldest entries are removed first
+# Default is 50
+# CACHE_MAX_SIZE=50
+
+# Seconds after which a request to Google APIs is considered failed
+# Default is 60
+# HTTP_TIMEOUT=60
+
+# Requests per minute allowed by Google APIs quotas for your project and user, used to
+# estimate the time needed to apply a sync plan (see --plan).
+# Defaults are 600 for Google Calendar and 60 (write requests) for Google Sheets
+# CALENDAR_QUOTA=600
+# SHEETS_QUOTA=60
+
+# Seconds between checks for changes of the spreadsheet when running with --watch.
+# Every check is a single Google Drive metadata request (a new authorization is
+# requested the first time).
+# Default is 10
+# WATCH_INTERVAL=10
+
+# Order of day and month in dates of local files read with --source, like "01/05/2023":
+# "DMY" (day first) or "MDY" (month first). Dates like "2023-05-01" are always accepted.
+# Default is DMY
+# LOCAL_DATE_ORDER=DMY
+
+# Use a single token file (token.json) for Google Sheets and Google Calendar, so
+# authorization is requested only once.
+# Default is false: every service has its own token file
+# COMBINED_TOKEN=true
+
+# Where timesheets and events are read and written: "google" for Google Sheets and
+# Google Calendar, "memory" for a local simulation, stored in MEMORY_BACKEND_FILE.
+# Default is google
+# BACKEND=google
+
+# Options of the "memory" backend: the JSON file where data is stored (default is
+# memory-backend.json in the haunts configuration folder), the latency of every request
+# in seconds, the max number of requests per minute (0 means no limit) and the
+# probability of a request failing with a "too many requests" error.
+# MEMORY_BACKEND_FILE=
+# MEMORY_BACKEND_LATENCY=0
+# MEMORY_BACKEND_QUOTA=0
+# MEMORY_BACKEND_ERROR_RATE=0
 """
 
 parser = configparser.RawConfigParser(allow_no_value=True)
@@ -44,3 +113,10 @@ def get(name, default=None):
     if value is None and default is None:
         raise KeyError(f"Not found: {name}")
     return default if value is None else value
+
+
+def get_boolean(name, default=False):
+    value = parser["haunts"].get(name)
+    if value is None:
+        return default
+    return parser.BOOLEAN_STATES.get(value.lower(), default)
@@ -0,0 +1,130 @@
+"""Journal of sync runs, used to resume an interrupted run without creating events twice.
+
+Calendar operations are recorded before being sent ("planned") and when they succeed
+("done"), then every successful write-back to the spreadsheet is recorded ("flushed").
+Records are appended to a JSON Lines file in ~/.haunts/journal, and the file is removed
+when the run completes.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from .ini import get
+
+
+def journal_path(config_dir):
+    document_id = get("CONTROLLER_SHEET_DOCUMENT_ID")
+    key = hashlib.sha1(document_id.encode("utf-8")).hexdigest()
+    return config_dir / "journal" / f"{key}.jsonl"
+
+
+def load_journal(config_dir):
+    """Return records of an interrupted run, or None if there's nothing to resume."""
+    try:
+        with open(journal_path(config_dir)) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return None
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # The last record can be truncated by a crash
+            break
+    if not records or records[0].get("type") != "run":
+        return None
+    return records
+
+
+def pending_operations(records):
+    """Find what an interrupted run did not complete.
+
+    Return operations done but not written back to the spreadsheet, and operations planned
+    without a result, as two dicts of planned records by (month, row). Records of done
+    operations also have the resulting "event".
+    """
+    planned = {}
+    done = {}
+    for record in records:
+        key = (record.get("month"), record.get("row"))
+        if record["type"] == "planned":
+            planned[key] = record
+            done.pop(key, None)
+        elif record["type"] == "done" and key in planned:
+            done[key] = {**planned.pop(key), "event": record["event"]}
+        elif record["type"] == "flushed":
+            done = {}
+    return done, planned
+
+
+class Journal:
+    """Append-only journal of a sync run.
+
+    Records are synced to disk before returning, so an operation is always recorded before
+    being sent. Planned operations can be added without syncing, then synced at once before
+    sending them together (see sync).
+    """
+
+    def __init__(self, config_dir, run=None):
+        self.path = journal_path(config_dir)
+        self.path.parent.mkdir(exist_ok=True)
+        self.lock = threading.Lock()
+        # When resuming, records are added to the ones of the interrupted run
+        self.file = open(self.path, "a" if run is None else "w")
+        if run is not None:
+            self.write({"type": "run", **run})
+
+    def write(self, *records, sync=True):
+        with self.lock:
+            for record in records:
+                self.file.write(json.dumps(record) + "\n")
+            if sync:
+                self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def planned(self, month, operation, check, sync=True):
+        """Record an operation before sending it; check identifies the row content."""
+        self.write(
+            {
+                "type": "planned",
+                "month": month,
+                "row": operation["row"],
+                "action": operation["action"],
+                "calendar": operation["calendar"],
+                "event_id": operation.get("event_id"),
+                "check": check,
+                "fingerprint": operation.get("fingerprint"),
+                "summary": operation.get("summary"),
+                "date": operation["date"].date().isoformat(),
+                "project": operation.get("project"),
+            },
+            sync=sync,
+        )
+
+    def done(self, month, operation, event=None, sync=True):
+        """Record the result of an operation, before writing it back to the sheet."""
+        self.write(
+            {
+                "type": "done",
+                "month": month,
+                "row": operation["row"],
+                "event": event and {"id": event["id"], "link": event["link"]},
+            },
+            sync=sync,
+        )
+
+    def flushed(self):
+        """Record that all done operations have been written back to the sheet."""
+        self.write({"type": "flushed"})
+
+    def close(self, remove=False):
+        with self.lock:
+            self.file.close()
+        if remove:
+            self.path.unlink(missing_ok=True)
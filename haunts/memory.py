@@ -0,0 +1,577 @@
+"""In-memory backend, simulating Google Sheets and Google Calendar APIs (and Google
+Drive file metadata).
+
+Data is loaded from (and saved to) a local JSON file, like the following:
+
+    {
+        "spreadsheets": {"<document id>": {"sheets": {"May": [["Date", ...], ...]}}},
+        "calendars": {"<calendar id>": {"summary": "Project X", "events": {}}}
+    }
+
+Latency, quotas and "too many requests" errors can be simulated, so haunts can be run and
+profiled without any Google service.
+"""
+
+import collections
+import datetime
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from . import LOGGER, metrics
+from .ini import get
+
+lock = threading.RLock()
+# Number of requests done, by API method
+calls = collections.Counter()
+state = None
+state_file = None
+# Modification time of the file when data was loaded or saved
+state_mtime = None
+request_times = collections.deque()
+
+
+def col_index(letters):
+    """Convert A1 notation letters to a 0-based column index."""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def col_letters(index):
+    """Convert a 0-based column index to A1 notation letters."""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def parse_range(a1_range):
+    """Split a range in A1 notation into sheet title, first/last column and first/last row.
+
+    Missing last row or last column means "up to the end of the sheet".
+    """
+    title, _, cells = a1_range.rpartition("!")
+    title = title.strip("'")
+    match = re.match(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$", cells.upper())
+    if not title or not match:
+        raise http_error(400, f"Unable to parse range: {a1_range}")
+    first_col, first_row, last_col, last_row = match.groups()
+    single = ":" not in cells
+    first_col = col_index(first_col) if first_col else 0
+    first_row = int(first_row) - 1 if first_row else 0
+    if single:
+        last_col, last_row = first_col, first_row
+    else:
+        last_col = col_index(last_col) if last_col else None
+        last_row = int(last_row) - 1 if last_row else None
+    return title, first_col, last_col, first_row, last_row
+
+
+def http_error(status, message, headers={}):
+    resp = httplib2.Response({"status": status, **headers})
+    content = json.dumps({"error": {"code": status, "message": message}})
+    return HttpError(resp, content.encode("utf-8"))
+
+
+def load():
+    """Load data of the backend from the local file, if not already done.
+
+    Data is loaded again when the file is changed by another program (see --watch).
+    """
+    global state, state_mtime
+    try:
+        mtime = os.stat(state_file).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if state is None or mtime != state_mtime:
+        try:
+            with open(state_file) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        state_mtime = mtime
+        state.setdefault("spreadsheets", {})
+        state.setdefault("calendars", {})
+    return state
+
+
+def save():
+    """Save data of the backend to the local file."""
+    global state_mtime
+    with open(state_file, "w") as f:
+        json.dump(state, f, indent=1)
+    state_mtime = os.stat(state_file).st_mtime_ns
+    LOGGER.debug(f"Memory backend calls: {dict(calls)}")
+
+
+def simulate(method):
+    """Count a request, wait for the simulated latency and raise simulated errors."""
+    with lock:
+        calls[method] += 1
+    metrics.count("http requests")
+    latency = float(get("MEMORY_BACKEND_LATENCY", 0))
+    if latency:
+        time.sleep(latency)
+    quota = int(get("MEMORY_BACKEND_QUOTA", 0))
+    now = time.monotonic()
+    with lock:
+        while request_times and request_times[0] < now - 60:
+            request_times.popleft()
+        request_times.append(now)
+        over_quota = quota and len(request_times) > quota
+    if over_quota:
+        retry_after = int(request_times[0] + 60 - now) + 1
+        raise http_error(
+            429, "Quota exceeded (simulated)", {"retry-after": str(retry_after)}
+        )
+    if random.random() < float(get("MEMORY_BACKEND_ERROR_RATE", 0)):
+        raise http_error(429, "Too many requests (simulated)")
+
+
+class Request:
+    """A request to the memory backend, executed like a Google API client request."""
+
+    def __init__(self, method, function, write=False):
+        self.method = method
+        self.function = function
+        self.write = write
+
+    def run(self):
+        with lock:
+            result = self.function()
+            if self.write:
+                save()
+        return result
+
+    def execute(self, http=None, num_retries=0):
+        simulate(self.method)
+        return self.run()
+
+
+class BatchRequest:
+    """A batch of requests, counted as a single request."""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id or str(len(self.requests))
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, http=None):
+        simulate("batch")
+        for request_id, request, callback in self.requests:
+            with lock:
+                calls[request.method] += 1
+            try:
+                response, exception = request.run(), None
+            except HttpError as err:
+                response, exception = None, err
+            callback(request_id, response, exception)
+
+
+class Collection:
+    def __init__(self, **methods):
+        for name, method in methods.items():
+            setattr(self, name, method)
+
+
+def get_sheet(document_id, title, create=False):
+    document = load()["spreadsheets"].get(document_id)
+    if document is None:
+        raise http_error(404, f"Requested entity was not found: {document_id}")
+    sheets = document.setdefault("sheets", {})
+    if title not in sheets:
+        if not create:
+            raise http_error(400, f"Unable to parse range: {title}")
+        sheets[title] = []
+    return sheets[title]
+
+
+def read_range(document_id, a1_range):
+    title, first_col, last_col, first_row, last_row = parse_range(a1_range)
+    rows = get_sheet(document_id, title)
+    grid_rows = len(rows)
+    if first_row and first_row >= grid_rows:
+        raise http_error(
+            400, f"Range ({a1_range}) exceeds grid limits. Max rows: {grid_rows}"
+        )
+    if last_row is None or last_row >= grid_rows:
+        last_row = grid_rows - 1
+    values = []
+    for row in rows[first_row : last_row + 1]:
+        end = None if last_col is None else last_col + 1
+        values.append(list(row[first_col:end]))
+    # Like Google Sheets API, trailing empty cells and rows are not returned
+    for row in values:
+        while row and row[-1] in ("", None):
+            row.pop()
+    while values and not values[-1]:
+        values.pop()
+    result = {
+        "range": f"{title}!{col_letters(first_col)}{first_row + 1}:"
+        f"{col_letters(last_col) if last_col is not None else ''}{last_row + 1}",
+        "majorDimension": "ROWS",
+    }
+    if values:
+        result["values"] = values
+    return result
+
+
+def touch(document_id):
+    """Update the revision of a document, like Google Drive does on every change."""
+    document = load()["spreadsheets"][document_id]
+    document["version"] = str(int(document.get("version", 0)) + 1)
+    document["modifiedTime"] = now()
+
+
+def write_range(document_id, a1_range, values):
+    title, first_col, _, first_row, _ = parse_range(a1_range)
+    rows = get_sheet(document_id, title)
+    touch(document_id)
+    for y, row_values in enumerate(values):
+        while len(rows) <= first_row + y:
+            rows.append([])
+        row = rows[first_row + y]
+        for x, value in enumerate(row_values):
+            while len(row) <= first_col + x:
+                row.append("")
+            row[first_col + x] = value
+    return len(values) * max((len(v) for v in values), default=0)
+
+
+def sheets_service():
+    def get_spreadsheet(spreadsheetId, ranges=None, fields=None, **kwargs):
+        def run():
+            document = load()["spreadsheets"].get(spreadsheetId)
+            if document is None:
+                raise http_error(
+                    404, f"Requested entity was not found: {spreadsheetId}"
+                )
+            return {
+                "spreadsheetId": spreadsheetId,
+                "sheets": [
+                    {
+                        "properties": {
+                            "title": title,
+                            "gridProperties": {"rowCount": len(rows)},
+                        }
+                    }
+                    for title, rows in document.get("sheets", {}).items()
+                ],
+            }
+
+        return Request("sheets.spreadsheets.get", run)
+
+    def values_get(spreadsheetId, range, **kwargs):
+        return Request(
+            "sheets.spreadsheets.values.get", lambda: read_range(spreadsheetId, range)
+        )
+
+    def values_batch_get(spreadsheetId, ranges, **kwargs):
+        def run():
+            return {
+                "spreadsheetId": spreadsheetId,
+                "valueRanges": [read_range(spreadsheetId, r) for r in ranges],
+            }
+
+        return Request("sheets.spreadsheets.values.batchGet", run)
+
+    def values_batch_update(spreadsheetId, body, **kwargs):
+        def run():
+            cells = sum(
+                write_range(spreadsheetId, data["range"], data["values"])
+                for data in body.get("data", [])
+            )
+            return {"spreadsheetId": spreadsheetId, "totalUpdatedCells": cells}
+
+        return Request("sheets.spreadsheets.values.batchUpdate", run, write=True)
+
+    def values_batch_clear(spreadsheetId, body, **kwargs):
+        def run():
+            for a1_range in body.get("ranges", []):
+                title, first_col, last_col, first_row, last_row = parse_range(a1_range)
+                last_col = first_col if last_col is None else last_col
+                last_row = first_row if last_row is None else last_row
+                blank = [[""] * (last_col - first_col + 1)] * (last_row - first_row + 1)
+                write_range(spreadsheetId, a1_range, blank)
+            return {"spreadsheetId": spreadsheetId, "clearedRanges": body["ranges"]}
+
+        return Request("sheets.spreadsheets.values.batchClear", run, write=True)
+
+    values = Collection(
+        get=values_get,
+        batchGet=values_batch_get,
+        batchUpdate=values_batch_update,
+        batchClear=values_batch_clear,
+    )
+    spreadsheets = Collection(get=get_spreadsheet, values=lambda: values)
+    return Collection(spreadsheets=lambda: spreadsheets)
+
+
+def get_calendar(calendar_id):
+    calendar = load()["calendars"].get(calendar_id)
+    if calendar is None:
+        raise http_error(404, f"Not Found: {calendar_id}")
+    calendar.setdefault("events", {})
+    return calendar
+
+
+def get_calendar_event(calendar_id, event_id):
+    event = get_calendar(calendar_id)["events"].get(event_id)
+    if event is None:
+        raise http_error(404, "Not Found")
+    if event.get("status") == "cancelled":
+        raise http_error(410, "Resource has been deleted")
+    return event
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def isoparse(value):
+    from dateutil import parser
+
+    return parser.isoparse(value)
+
+
+def event_time(value):
+    """Start or end of an event as a datetime; full day events use the local timezone."""
+    if value.get("dateTime"):
+        return isoparse(value["dateTime"])
+    date = datetime.date.fromisoformat(value["date"])
+    return datetime.datetime.combine(date, datetime.time()).astimezone()
+
+
+def calendar_service():
+    def insert(calendarId, body, **kwargs):
+        def run():
+            calendar = get_calendar(calendarId)
+            event_id = body.get("id") or uuid.uuid4().hex
+            if event_id in calendar["events"]:
+                raise http_error(409, "The requested identifier already exists.")
+            event = {
+                **body,
+                "id": event_id,
+                "status": "confirmed",
+                "htmlLink": f"https://calendar.example/{calendarId}/{event_id}",
+                "organizer": {
+                    "email": calendarId,
+                    "displayName": calendar.get("summary", calendarId),
+                },
+                "updated": now(),
+            }
+            calendar["events"][event_id] = event
+            return event
+
+        return Request("calendar.events.insert", run, write=True)
+
+    def patch(calendarId, eventId, body, **kwargs):
+        def run():
+            event = get_calendar_event(calendarId, eventId)
+            for key, value in body.items():
+                if isinstance(value, dict):
+                    merged = {**event.get(key, {}), **value}
+                    event[key] = {k: v for k, v in merged.items() if v is not None}
+                elif value is None:
+                    event.pop(key, None)
+                else:
+                    event[key] = value
+            event["updated"] = now()
+            return event
+
+        return Request("calendar.events.patch", run, write=True)
+
+    def move(calendarId, eventId, destination, **kwargs):
+        def run():
+            event = get_calendar_event(calendarId, eventId)
+            target = get_calendar(destination)
+            # Like Google Calendar, the event is reported as deleted from the source calendar
+            get_calendar(calendarId)["events"][eventId] = {
+                "id": eventId,
+                "status": "cancelled",
+                "updated": now(),
+            }
+            event["organizer"] = {
+                "email": destination,
+                "displayName": target.get("summary", destination),
+            }
+            event["htmlLink"] = f"https://calendar.example/{destination}/{eventId}"
+            event["updated"] = now()
+            target["events"][eventId] = event
+            return event
+
+        return Request("calendar.events.move", run, write=True)
+
+    def delete(calendarId, eventId, **kwargs):
+        def run():
+            event = get_calendar_event(calendarId, eventId)
+            event["status"] = "cancelled"
+            event["updated"] = now()
+            return ""
+
+        return Request("calendar.events.delete", run, write=True)
+
+    def get_event(calendarId, eventId, **kwargs):
+        return Request(
+            "calendar.events.get", lambda: get_calendar_event(calendarId, eventId)
+        )
+
+    def list_events(
+        calendarId,
+        timeMin=None,
+        timeMax=None,
+        syncToken=None,
+        pageToken=None,
+        maxResults=250,
+        showDeleted=False,
+        **kwargs,
+    ):
+        def run():
+            calendar = get_calendar(calendarId)
+            if syncToken:
+                # Sync tokens are the time of the previous listing: changed events are
+                # returned, including deleted ones
+                try:
+                    since = isoparse(syncToken)
+                except ValueError:
+                    raise http_error(410, "Sync token is no longer valid")
+                events = [
+                    e
+                    for e in calendar["events"].values()
+                    if isoparse(e.get("updated", syncToken)) > since
+                ]
+            else:
+                events = [
+                    e
+                    for e in calendar["events"].values()
+                    if (showDeleted or e.get("status") != "cancelled")
+                    and (
+                        not timeMin
+                        or "end" not in e
+                        or event_time(e["end"]) > isoparse(timeMin)
+                    )
+                    and (
+                        not timeMax
+                        or "start" not in e
+                        or event_time(e["start"]) < isoparse(timeMax)
+                    )
+                ]
+            first = int(pageToken or 0)
+            page = events[first : first + maxResults]
+            result = {"kind": "calendar#events", "items": page}
+            if first + maxResults < len(events):
+                result["nextPageToken"] = str(first + maxResults)
+            else:
+                result["nextSyncToken"] = now()
+            return result
+
+        return Request("calendar.events.list", run)
+
+    def query(body, **kwargs):
+        def run():
+            time_min = isoparse(body["timeMin"])
+            time_max = isoparse(body["timeMax"])
+            result = {}
+            for item in body.get("items", []):
+                calendar = load()["calendars"].get(item["id"])
+                if calendar is None:
+                    result[item["id"]] = {
+                        "errors": [{"domain": "global", "reason": "notFound"}],
+                        "busy": [],
+                    }
+                    continue
+                slots = []
+                for event in calendar.get("events", {}).values():
+                    if (
+                        event.get("status") == "cancelled"
+                        or event.get("transparency") == "transparent"
+                    ):
+                        continue
+                    start, end = event_time(event["start"]), event_time(event["end"])
+                    if start < time_max and end > time_min:
+                        slots.append((max(start, time_min), min(end, time_max)))
+                busy = []
+                for start, end in sorted(slots):
+                    if busy and start <= busy[-1][1]:
+                        busy[-1][1] = max(busy[-1][1], end)
+                    else:
+                        busy.append([start, end])
+                result[item["id"]] = {
+                    "busy": [
+                        {"start": start.isoformat(), "end": end.isoformat()}
+                        for start, end in busy
+                    ]
+                }
+            return {
+                "kind": "calendar#freeBusy",
+                "timeMin": body["timeMin"],
+                "timeMax": body["timeMax"],
+                "calendars": result,
+            }
+
+        return Request("calendar.freebusy.query", run)
+
+    events = Collection(
+        insert=insert,
+        patch=patch,
+        move=move,
+        delete=delete,
+        get=get_event,
+        list=list_events,
+    )
+    freebusy = Collection(query=query)
+    return Collection(
+        events=lambda: events,
+        freebusy=lambda: freebusy,
+        new_batch_http_request=lambda callback=None: BatchRequest(callback),
+    )
+
+
+def drive_service():
+    def get_file(fileId, fields=None, **kwargs):
+        def run():
+            document = load()["spreadsheets"].get(fileId)
+            if document is None:
+                raise http_error(404, f"File not found: {fileId}")
+            return {
+                "id": fileId,
+                "version": document.get("version", "1"),
+                "modifiedTime": document.get("modifiedTime", "1970-01-01T00:00:00Z"),
+            }
+
+        return Request("drive.files.get", run)
+
+    files = Collection(get=get_file)
+    return Collection(files=lambda: files)
+
+
+SERVICES = {
+    "sheets": sheets_service,
+    "calendar": calendar_service,
+    "drive": drive_service,
+}
+
+
+def build(config_dir, name, version):
+    """Return a client for a simulated service.
+
+    Data is stored in the MEMORY_BACKEND_FILE (default is memory-backend.json in the
+    haunts configuration directory).
+    """
+    global state_file
+    state_file = get("MEMORY_BACKEND_FILE", str(config_dir / "memory-backend.json"))
+    return SERVICES[name]()
@@ -0,0 +1,137 @@
+"""Instrumentation: timings of phases and API calls, counters and trace export.
+
+Nothing is recorded unless enabled (see the --stats and --trace options).
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import click
+
+enabled = False
+started = None
+lock = threading.Lock()
+# Counters, like API calls, retries or bytes received
+counters = collections.Counter()
+# Count and total seconds of spans, by (category, name)
+timings = {}
+# Spans in Chrome trace event format
+events = []
+thread_names = {}
+
+
+def enable():
+    """Start recording spans and counters."""
+    global enabled, started
+    enabled = True
+    started = time.perf_counter()
+
+
+@contextmanager
+def span(name, category="phase", **args):
+    """Record the duration of a block of code, with optional arguments for the trace."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, category, start, time.perf_counter(), args)
+
+
+def record(name, category, start, end, args={}):
+    thread = threading.current_thread()
+    with lock:
+        timing = timings.setdefault((category, name), [0, 0.0])
+        timing[0] += 1
+        timing[1] += end - start
+        thread_names[thread.ident] = thread.name
+        events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - started) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": thread.ident,
+                "args": args,
+            }
+        )
+
+
+def count(name, value=1):
+    if enabled:
+        with lock:
+            counters[name] += value
+
+
+def elapsed():
+    return time.perf_counter() - started
+
+
+def print_stats():
+    """Print a summary of timings and counters to stderr."""
+    from tabulate import tabulate
+
+    total = elapsed()
+    rows = [
+        [category, name, calls, round(seconds, 3), round(seconds / calls * 1000, 1)]
+        for (category, name), (calls, seconds) in sorted(timings.items())
+    ]
+    click.echo("", err=True)
+    click.echo(
+        tabulate(
+            rows,
+            headers=["Category", "Name", "Count", "Total (s)", "Avg (ms)"],
+            tablefmt="simple",
+        ),
+        err=True,
+    )
+    rows_count = counters["rows"]
+    click.echo("", err=True)
+    click.echo(
+        f'API calls: {counters["api calls"]}, '
+        f'retries: {counters["retries"]}, '
+        f'sleep: {counters["sleep seconds"]:.1f}s',
+        err=True,
+    )
+    click.echo(
+        f'HTTP requests: {counters["http requests"]}, '
+        f'sent: {counters["bytes sent"] / 1024:.1f} KB, '
+        f'received: {counters["bytes received"] / 1024:.1f} KB',
+        err=True,
+    )
+    click.echo(
+        f"Rows: {rows_count} ({rows_count / total if total else 0:.0f} rows/s), "
+        f"total time: {total:.2f}s",
+        err=True,
+    )
+
+
+def write_trace(path):
+    """Write recorded spans to a file in Chrome trace format (see chrome://tracing)."""
+    pid = os.getpid()
+    with lock:
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": n},
+            }
+            for tid, n in thread_names.items()
+        ]
+        trace = {
+            "traceEvents": metadata + events,
+            "displayTimeUnit": "ms",
+            "otherData": dict(counters),
+        }
+    with open(path, "w") as f:
+        json.dump(trace, f)
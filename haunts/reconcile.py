@@ -0,0 +1,399 @@
+"""Reconcile module: compare sheets with calendar events, and fix differences."""
+
+import datetime
+import hashlib
+import json
+import numbers
+import sys
+
+import click
+from colorama import Back, Fore, Style
+from dateutil import parser
+from googleapiclient.errors import HttpError
+
+from . import LOGGER, actions, metrics
+from .calendars import (
+    HAUNTS_PROPERTY,
+    batch_events,
+    build_event,
+    echo_created,
+    event_owner,
+    get_service,
+    origin_time,
+    parallel_events,
+)
+from .ini import get
+from .retry import execute
+from .spreadsheet import (
+    DateSelection,
+    SheetWriter,
+    echo_planned,
+    expand_sheets,
+    get_calendars,
+    get_col,
+    read_sheets,
+    row_fingerprint,
+    serial_to_date,
+    store_created,
+)
+from .spreadsheet import get_service as get_sheets_service
+
+# Only fields used to compare events with rows are read
+LIST_FIELDS = (
+    "nextPageToken,nextSyncToken,"
+    "items(id,status,summary,description,start,end,extendedProperties)"
+)
+
+
+def snapshot_path(config_dir, calendar):
+    key = hashlib.sha1(calendar.encode("utf-8")).hexdigest()
+    return config_dir / "reconcile" / f"{key}.json"
+
+
+def load_snapshot(config_dir, calendar, date_min, date_max):
+    """Events of a calendar saved by a previous run, if they cover date_min to date_max."""
+    try:
+        with open(snapshot_path(config_dir, calendar)) as f:
+            snapshot = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if (
+        snapshot["date_min"] > date_min.isoformat()
+        or snapshot.get("date_max", "") < date_max.isoformat()
+        or not snapshot["sync_token"]
+    ):
+        return None
+    return snapshot
+
+
+def list_events(config_dir, calendar, date_min, date_max):
+    """Return events of a calendar by id, from date_min to date_max (included).
+
+    The first time all events of those days are read, then only changes are read using
+    the sync token saved by the previous run.
+    """
+    service = get_service(config_dir)
+    snapshot = load_snapshot(config_dir, calendar, date_min, date_max)
+    if snapshot:
+        events = snapshot["events"]
+        params = {"syncToken": snapshot["sync_token"]}
+        date_min = datetime.date.fromisoformat(snapshot["date_min"])
+        date_max = datetime.date.fromisoformat(snapshot["date_max"])
+    else:
+        events = {}
+        timezone = origin_time().tzinfo
+        params = {
+            "timeMin": datetime.datetime.combine(
+                date_min, datetime.time(), timezone
+            ).isoformat(),
+            "timeMax": datetime.datetime.combine(
+                date_max + datetime.timedelta(days=1), datetime.time(), timezone
+            ).isoformat(),
+        }
+    page_token = None
+    while True:
+        try:
+            result = execute(
+                service.events().list(
+                    calendarId=calendar,
+                    fields=LIST_FIELDS,
+                    pageToken=page_token,
+                    **params,
+                )
+            )
+        except HttpError as err:
+            if err.status_code != 410 or "syncToken" not in params:
+                raise
+            LOGGER.debug(
+                f"Sync token of calendar {calendar} expired, reading all events"
+            )
+            snapshot_path(config_dir, calendar).unlink(missing_ok=True)
+            return list_events(config_dir, calendar, date_min, date_max)
+        for event in result.get("items", []):
+            if event.get("status") == "cancelled":
+                events.pop(event["id"], None)
+            else:
+                events[event["id"]] = event
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            break
+
+    path = snapshot_path(config_dir, calendar)
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "calendar": calendar,
+                "date_min": date_min.isoformat(),
+                "date_max": date_max.isoformat(),
+                "sync_token": result.get("nextSyncToken"),
+                "events": events,
+            },
+            f,
+        )
+    return events
+
+
+def event_date(event):
+    start = event.get("start", {})
+    if start.get("dateTime"):
+        return (
+            parser.isoparse(start["dateTime"]).astimezone(origin_time().tzinfo).date()
+        )
+    return datetime.date.fromisoformat(start["date"])
+
+
+def same_time(value, expected):
+    """Compare start or end of an event, also when times use different time zones."""
+    if "dateTime" in expected:
+        return bool(value.get("dateTime")) and parser.isoparse(
+            value["dateTime"]
+        ) == parser.isoparse(expected["dateTime"])
+    return value.get("date") == expected["date"]
+
+
+def differs(event, body):
+    """Tell if an event is different from the one that would be created for a row."""
+    return (
+        (event.get("summary") or "") != (body["summary"] or "")
+        or (event.get("description") or "") != (body["description"] or "")
+        or not same_time(event.get("start", {}), body["start"])
+        or not same_time(event.get("end", {}), body["end"])
+    )
+
+
+def reconcile(
+    config_dir,
+    months,
+    days=[],
+    projects=[],
+    workers=1,
+    date_from=None,
+    date_to=None,
+    dry_run=False,
+):
+    """Compare synced rows of sheets with calendar events, and only apply differences.
+
+    Events deleted by hand are created again, events changed by hand are restored, and
+    events created by haunts for the same sheets that no row refers to (like after an
+    interrupted sync) are deleted. Rows without a start time keep the time of their event.
+    Rows not synced yet are left to sync.
+    """
+    sheet = get_sheets_service(config_dir).spreadsheets()
+    click.echo("Started calendars reconciliation" + (" (dry run)" if dry_run else ""))
+
+    if isinstance(months, str):
+        months = [months]
+    try:
+        with metrics.span("read sheets"):
+            months = expand_sheets(sheet, months)
+            sheets = read_sheets(sheet, months)
+    except (HttpError, ValueError) as err:
+        click.echo(
+            Back.RED
+            + f'Sheet "{", ".join(months)}" not found or not accessible.'
+            + Style.RESET_ALL
+        )
+        click.echo(getattr(err, "error_details", err))
+        sys.exit(1)
+
+    with metrics.span("read calendars"):
+        calendars = get_calendars(sheet, config_dir)
+    selection = DateSelection(days, date_from, date_to)
+
+    # Event ids referenced by the sheets, and days where events are checked
+    referenced = set()
+    dates = set()
+    for schema, data in sheets:
+        data["values"] = list(data["values"])
+        indexes = schema.indexes
+        for row in data["values"]:
+            referenced.add(get_col(row, indexes["Event id"]))
+            current_date = get_col(row, indexes["Date"])
+            if isinstance(current_date, numbers.Number):
+                date = serial_to_date(current_date)
+                if date in selection:
+                    dates.add(date)
+    if not dates:
+        click.echo("No rows to reconcile.")
+        return
+
+    # Events of all calendars are read, so events moved to another calendar are found
+    events = {}
+    found_in = {}
+    for calendar in dict.fromkeys(calendars.values()):
+        with metrics.span("list events", calendar=calendar):
+            calendar_events = list_events(config_dir, calendar, min(dates), max(dates))
+        for event_id, event in calendar_events.items():
+            events[event_id] = event
+            found_in[event_id] = calendar
+
+    operations = []
+    for month, (schema, data) in zip(months, sheets):
+        indexes = schema.indexes
+        last_to_time = None
+        # Where the next event starts following sheet rows only (see plan_events)
+        next_slot = None
+        last_date = None
+        for y, row in enumerate(data["values"]):
+            action = get_col(row, indexes["Action"]) or ""
+            current_date = get_col(row, indexes["Date"])
+            if not current_date or action not in ("", actions.IGNORE):
+                continue
+            if current_date != last_date:
+                last_to_time = None
+                next_slot = None
+            last_date = current_date
+
+            project = get_col(row, indexes["Project"])
+            summary = get_col(row, indexes["Activity"])
+            details = get_col(row, indexes["Details"])
+            length = get_col(row, indexes["Spent"])
+            start_time = (
+                get_col(row, indexes["Start time"])
+                if indexes.get("Start time")
+                else None
+            )
+            event_id = get_col(row, indexes["Event id"])
+            event = events.get(event_id)
+            date = origin_time() + datetime.timedelta(days=current_date)
+            slot = start_time or next_slot or get("START_TIME", "09:00")
+            _, next_slot = build_event(date, summary, details, length, slot, month)
+            from_time = start_time or last_to_time
+            if (
+                event
+                and not start_time
+                and isinstance(length, numbers.Number)
+                and event.get("start", {}).get("dateTime")
+            ):
+                # Rows without a start time keep the time of their event
+                from_time = (
+                    parser.isoparse(event["start"]["dateTime"])
+                    .astimezone(origin_time().tzinfo)
+                    .strftime("%H:%M")
+                )
+            body, last_to_time = build_event(
+                date, summary, details, length, from_time, month
+            )
+
+            if (
+                action != actions.IGNORE
+                or not event_id
+                or date.date() not in selection
+                or (projects and project not in projects)
+            ):
+                continue
+            calendar = calendars.get(project)
+            if not calendar:
+                continue
+            operation = {
+                "row": y,
+                "month": month,
+                "schema": schema,
+                "calendar": calendar,
+                "body": body,
+                "summary": summary,
+                "length": length,
+                "date": date,
+                "project": project,
+                "fingerprint": (
+                    row_fingerprint(indexes, row, slot)
+                    if "Fingerprint" in indexes
+                    else None
+                ),
+            }
+            if not event:
+                operations.append({**operation, "action": "create"})
+            elif found_in[event_id] != calendar or differs(event, body):
+                operations.append(
+                    {
+                        **operation,
+                        "action": "update",
+                        "event_id": event_id,
+                        "source": found_in[event_id],
+                    }
+                )
+
+    # Events created by haunts for these sheets that no row refers to. Events of other
+    # sheets, or of other people sharing the calendar, have a different owner
+    owners = {event_owner(month) for month in months}
+    for event_id, event in events.items():
+        calendar = found_in[event_id]
+        project = next((p for p, c in calendars.items() if c == calendar), calendar)
+        owner = (
+            event.get("extendedProperties", {}).get("private", {}).get(HAUNTS_PROPERTY)
+        )
+        if (
+            event_id in referenced
+            or owner not in owners
+            or (projects and project not in projects)
+            or event_date(event) not in dates
+        ):
+            continue
+        operations.append(
+            {
+                "action": "delete",
+                "row": None,
+                "calendar": calendar,
+                "event_id": event_id,
+                "summary": event.get("summary"),
+                "date": event_date(event),
+                "project": project,
+            }
+        )
+
+    if not operations:
+        click.echo("Calendars are in sync with the sheets.")
+        return
+    if dry_run:
+        for operation in operations:
+            echo_planned(operation)
+        return
+
+    with metrics.span("calendar operations", operations=len(operations)):
+        if workers > 1:
+            results = parallel_events(config_dir, operations, workers, batch=True)
+        else:
+            results = batch_events(config_dir, operations)
+    writer = SheetWriter(sheet)
+    counts = {"create": 0, "update": 0, "delete": 0}
+    try:
+        for operation, response, error in results:
+            if error:
+                click.echo(
+                    Back.RED
+                    + f'Cannot {operation["action"]} event "{operation["summary"]}": {error}'
+                    + Style.RESET_ALL
+                )
+                continue
+            counts[operation["action"]] += 1
+            if operation["action"] == "delete":
+                click.echo(
+                    Back.YELLOW
+                    + Fore.BLACK
+                    + f'Deleted event "{operation["summary"]}" '
+                    f'in date {operation["date"].strftime("%d/%m")} '
+                    f'from calendar {operation["project"]}: not found in sheets'
+                    + Style.RESET_ALL
+                )
+                continue
+            echo_created(
+                response,
+                operation["summary"],
+                operation["length"],
+                verb="Created again" if operation["action"] == "create" else "Restored",
+            )
+            store_created(
+                writer,
+                operation["month"],
+                operation["schema"].letters,
+                operation["row"],
+                {"id": response["id"], "link": response["htmlLink"]},
+                operation["fingerprint"],
+            )
+    finally:
+        writer.flush()
+    click.echo(
+        f'Done! {counts["create"]} events created again, '
+        f'{counts["update"]} restored, {counts["delete"]} deleted'
+    )
@@ -1,34 +1,51 @@
 """Report module."""
 
+import array
+import csv
 import datetime
+import glob
+import json
+import math
 import numbers
 import sys
 
 import click
 from colorama import Back, Fore, Style
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from tabulate import SEPARATING_LINE, tabulate
 
-from . import LOGGER
-from .calendars import LOCAL_TIMEZONE
-from .credentials import get_credentials
+from . import LOGGER, cache, metrics
 from .ini import get
-from .spreadsheet import ORIGIN_TIME, get_col, get_headers
+from .spreadsheet import (
+    DateSelection,
+    as_date,
+    expand_sheets,
+    get_col,
+    get_schema,
+    get_service,
+    read_sheet,
+    read_sheet_cached,
+    read_sheets,
+    read_sheets_by_date,
+    serial_to_date,
+    to_minutes,
+)
 
-# If scopes are modified, delete the sheets-token file
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+# Periods (and project) used to group reports
+GROUP_BY = ["day", "week", "month", "project"]
 
 
-def adjust_full_day(proj_stats):
+def adjust_full_day(proj_stats, working_hours=None):
     """Calculate the value of a full day event, taking into account other events."""
+    if working_hours is None:
+        working_hours = int(get("WORKING_HOURS", 8))
     value = 0
     count = 0
     total_overtime = 0
     for entry_stats in proj_stats["projects"].values():
         count += entry_stats["total"]
         total_overtime += entry_stats["overtime"]
-    value = int(get("WORKING_HOURS", 8)) - count + total_overtime
+    value = working_hours - count + total_overtime
     # now properly adjust the full day value
     for entry_stats in proj_stats["projects"].values():
         if entry_stats["full_day"]:
@@ -36,14 +53,9 @@ def adjust_full_day(proj_stats):
             break
 
 
-def print_report(report, days=[], projects=[], overtime=False):
-    rows = []
-    gran_total = 0
-    # Tranform report to be tabulate compatible
-    headers = ["Date", "Project", "Total"]
+def report_rows(report, selection, projects=[], overtime=False):
+    """Yield (date, project, total) of a report, for selected days and projects."""
     for date, proj_stats in report.items():
-        if proj_stats.get("have_full_day", False):
-            adjust_full_day(proj_stats)
         for project, stat in proj_stats["projects"].items():
             overtime_value = stat["overtime"]
             if overtime and overtime_value:
@@ -56,12 +68,24 @@ def print_report(report, days=[], projects=[], overtime=False):
                 # not filtering by project, or project is in the list
                 (not projects or project in projects)
                 # not filtering by days, or day is in the list
-                and (not days or date in days)
+                and as_date(date) in selection
                 # not filtering by overtime, or this is an overtime entry
                 and (not overtime or overtime_value)
             ):
-                rows.append([date, project, total])
-                gran_total += total
+                yield date, project, total
+
+
+def print_report(
+    report, days=[], projects=[], overtime=False, date_from=None, date_to=None
+):
+    selection = DateSelection(days, date_from, date_to)
+    rows = []
+    gran_total = 0
+    # Tranform report to be tabulate compatible
+    headers = ["Date", "Project", "Total"]
+    for date, project, total in report_rows(report, selection, projects, overtime):
+        rows.append([date, project, total])
+        gran_total += total
 
     if not rows:
         click.echo("No data to display.")
@@ -71,133 +95,526 @@ def print_report(report, days=[], projects=[], overtime=False):
     click.echo(tabulate(rows, headers=headers, tablefmt="simple"))
 
 
-def create_report(sheet, sheet_name, data, overtime=False):
-    """Create a time consumption report from a sheet."""
-    headers_id = get_headers(sheet, sheet_name, indexes=True)
-    overtime_from = get("OVERTIME_FROM", default=False)
+def group_key(group_by, date, project):
+    """Key of a report row, when grouping by day, week (ISO), month or project."""
+    if group_by == "week":
+        year, week, _ = as_date(date).isocalendar()
+        return f"{year}-W{week:02d}"
+    if group_by == "month":
+        return date[:7]
+    if group_by == "project":
+        return project
+    return date
 
-    dates = {}
 
-    if overtime and not get("OVERTIME_FROM"):
-        click.echo(
-            Back.RED
-            + f"Cannot filter by --overtime: OVERTIME_FROM is not set."
-            + Style.RESET_ALL
+def iter_grouped(report, group_by, selection, projects=[], overtime=False):
+    """Yield (key, total) of a report, grouped by day, week, month or project.
+
+    Days are visited in order, so totals by day, week and month are yielded as soon as
+    they are complete. Totals by project are only complete at the end.
+    """
+    rows = report_rows(dict(sorted(report.items())), selection, projects, overtime)
+    if group_by == "project":
+        totals = {}
+        for date, project, total in rows:
+            totals[project] = totals.get(project, 0) + total
+        yield from totals.items()
+        return
+    key = None
+    key_total = 0
+    for date, project, total in rows:
+        current = group_key(group_by, date, project)
+        if current != key:
+            if key is not None:
+                yield key, key_total
+            key = current
+            key_total = 0
+        key_total += total
+    if key is not None:
+        yield key, key_total
+
+
+def print_grouped(
+    report,
+    group_by,
+    days=[],
+    projects=[],
+    overtime=False,
+    date_from=None,
+    date_to=None,
+    with_total=True,
+):
+    """Print totals of a report by day, week, month or project."""
+    selection = DateSelection(days, date_from, date_to)
+    rows = list(iter_grouped(report, group_by, selection, projects, overtime))
+    if not rows:
+        click.echo("No data to display.")
+        return False
+    if with_total:
+        rows.extend([SEPARATING_LINE, ["", sum(total for _, total in rows)]])
+    click.echo(
+        tabulate(rows, headers=[group_by.capitalize(), "Total"], tablefmt="simple")
+    )
+    return True
+
+
+def print_totals(
+    report, days=[], projects=[], overtime=False, date_from=None, date_to=None
+):
+    """Print totals of a report by day, week, month and project."""
+    for group_by in GROUP_BY:
+        printed = print_grouped(
+            report,
+            group_by,
+            days=days,
+            projects=projects,
+            overtime=overtime,
+            date_from=date_from,
+            date_to=date_to,
+            with_total=group_by == GROUP_BY[-1],
         )
-        sys.exit(1)
+        if not printed:
+            return
+        click.echo("")
+
+
+def stream_report(
+    report,
+    output_format,
+    group_by=None,
+    days=[],
+    projects=[],
+    overtime=False,
+    date_from=None,
+    date_to=None,
+):
+    """Write a report as CSV or JSON Lines, one row at a time.
 
-    for y, row in enumerate(data["values"]):
+    The report is already computed (see create_report), so output only starts after all
+    sheets are read. Rows are (date, project, total), or (key, total) when grouping.
+    """
+    selection = DateSelection(days, date_from, date_to)
+    if group_by:
+        columns = [group_by, "total"]
+        rows = iter_grouped(report, group_by, selection, projects, overtime)
+    else:
+        columns = ["date", "project", "total"]
+        rows = report_rows(report, selection, projects, overtime)
+    stdout = click.get_text_stream("stdout")
+    if output_format == "csv":
+        writer = csv.writer(stdout, lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            stdout.write(json.dumps(dict(zip(columns, row))) + "\n")
+    stdout.flush()
+
+
+def output_report(
+    report,
+    output_format="table",
+    group_by=None,
+    totals=False,
+    days=[],
+    projects=[],
+    overtime=False,
+    date_from=None,
+    date_to=None,
+):
+    """Output a report in the given format.
+
+    Tables are printed by date and project, by group_by, or by all periods when totals
+    is True. Other formats are written a row at a time (see stream_report).
+    """
+    filters = dict(
+        days=days,
+        projects=projects,
+        overtime=overtime,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    if output_format != "table":
+        stream_report(report, output_format, group_by, **filters)
+        return
+    click.echo("")
+    if group_by:
+        print_grouped(report, group_by, **filters)
+        click.echo("")
+    elif totals:
+        print_totals(report, **filters)
+    else:
+        print_report(report, **filters)
+        click.echo("")
+
+
+def report_columns(data, headers_id, with_start=True):
+    """Read values used by the report from rows, one row at a time, into typed arrays.
 
-        current_date = get_col(row, headers_id["Date"])
+    Arrays have one item per dated row: values are only converted once, and grouping
+    (see group_columns) doesn't parse them again.
+    Return serial dates, start times (minutes from midnight, -1 when missing or when
+    with_start is False), spent hours (NaN for full day events), project codes, and the
+    list of projects.
+    """
+    date_col = headers_id["Date"]
+    start_col = headers_id.get("Start time") if with_start else None
+    spent_col = headers_id["Spent"]
+    project_col = headers_id["Project"]
+    dates = array.array("l")
+    starts = array.array("l")
+    spent = array.array("d")
+    codes = array.array("l")
+    projects = {}
+
+    for row in data["values"]:
+        current_date = get_col(row, date_col)
         if not current_date:
             LOGGER.debug("No date found, skipping")
             continue
+        dates.append(int(current_date))
+        start_time = get_col(row, start_col) if start_col else None
+        starts.append(to_minutes(start_time) if start_time else -1)
+        value = get_col(row, spent_col)
+        if isinstance(value, numbers.Number):
+            spent.append(value)
+        elif type(value) == str and not value:
+            spent.append(math.nan)
+        else:
+            spent.append(0)
+        codes.append(projects.setdefault(get_col(row, project_col), len(projects)))
+    metrics.count("rows", len(dates))
+    return dates, starts, spent, codes, list(projects)
 
-        date = (ORIGIN_TIME + datetime.timedelta(days=current_date)).date()
-        start_time = (
-            get_col(row, headers_id["Start time"])
-            if headers_id.get("Start time") and get_col(row, headers_id["Start time"])
-            else None
-        )
 
-        in_overtime = False
-        if start_time and overtime_from:
-            start = datetime.datetime.strptime(
-                f"{date.strftime('%Y-%m-%d')}T{start_time}:00{LOCAL_TIMEZONE}",
-                f"%Y-%m-%dT%H:%M:%S%z",
-            )
-            overtime = datetime.datetime.strptime(
-                f"{date.strftime('%Y-%m-%d')}T{overtime_from}:00{LOCAL_TIMEZONE}",
-                f"%Y-%m-%dT%H:%M:%S%z",
-            )
-            if start >= overtime:
-                in_overtime = True
-
-        project = get_col(row, headers_id["Project"])
-        date_stats = dates.get(
-            str(date),
-            {
-                "projects": {},
-                "have_full_day": False,
-            },
-        )
-        prog_stats = date_stats["projects"].get(
-            project,
-            {
-                "total": 0,
-                "overtime": 0,
-                "full_day": False,
-            },
+def check_overtime(overtime):
+    if overtime and not get("OVERTIME_FROM"):
+        click.echo(
+            Back.RED
+            + f"Cannot filter by --overtime: OVERTIME_FROM is not set."
+            + Style.RESET_ALL
         )
-        spent = get_col(row, headers_id["Spent"])
-
-        # We have a value of spent hours in this event
-        if isinstance(spent, numbers.Number):
-            prog_stats["total"] += spent
-            if in_overtime:
-                prog_stats["overtime"] += spent
-        elif type(spent) == str and not spent:
+        sys.exit(1)
+
+
+def group_columns(
+    dates, starts, spent, codes, projects, overtime_start=None, working_hours=8
+):
+    """Compute totals by date and project from report columns (see report_columns)."""
+    # Group by date and project: {date: {project code: [total, overtime, full day]}}
+    groups = {}
+    full_days = set()
+    for date, start, value, code in zip(dates, starts, spent, codes):
+        stats = groups.setdefault(date, {}).setdefault(code, [0, 0, False])
+        if value != value:  # NaN: a full day event
             # Check: we have multiple full days in the same day! haunts is not supporting this
-            if date_stats["have_full_day"]:
+            if date in full_days:
                 click.echo(
                     Back.YELLOW
                     + Fore.BLACK
-                    + f"There are multiple full days in the same day: {str(date)}"
-                    + Style.RESET_ALL
+                    + f"There are multiple full days in the same day: "
+                    f"{serial_to_date(date)}" + Style.RESET_ALL,
+                    err=True,
                 )
             else:
-                date_stats["have_full_day"] = True
-                prog_stats["full_day"] = True
+                full_days.add(date)
+                stats[2] = True
+            continue
+        stats[0] += value
+        if overtime_start is not None and start >= overtime_start:
+            stats[1] += value
 
-        date_stats["projects"][project] = prog_stats
-        dates[str(date)] = date_stats
+    report = {}
+    for date, date_groups in groups.items():
+        date_stats = {
+            "projects": {
+                projects[code]: {
+                    "total": total,
+                    "overtime": overtime_value,
+                    "full_day": full_day,
+                }
+                for code, (total, overtime_value, full_day) in date_groups.items()
+            },
+            "have_full_day": date in full_days,
+        }
+        if date_stats["have_full_day"]:
+            adjust_full_day(date_stats, working_hours)
+        report[str(serial_to_date(date))] = date_stats
+    return report
 
-    return dates
 
+def create_report(sheet, sheet_name, data, overtime=False, schema=None):
+    """Create a time consumption report from a sheet.
 
-def report(config_dir, sheet_name, days=[], projects=[], overtime=False):
-    """Open a sheet, analyze it and extract stats."""
-    # The ID and range of the controller timesheet
-    creds = get_credentials(config_dir, SCOPES, "sheets-token.json")
-    service = build("sheets", "v4", credentials=creds)
+    Values of rows are converted first (see report_columns), then totals are computed by
+    date and project, including overtime and the value of full day events.
+    """
+    schema = schema or get_schema(sheet, sheet_name)
+    overtime_from = get("OVERTIME_FROM", default=False)
+    check_overtime(overtime)
+
+    columns = report_columns(data, schema.indexes, with_start=bool(overtime_from))
+    return group_columns(
+        *columns,
+        overtime_start=to_minutes(overtime_from) if overtime_from else None,
+        working_hours=int(get("WORKING_HOURS", 8)),
+    )
+
+
+def merge_columns(columns):
+    """Concatenate report columns of multiple sheets, with project codes shared by all."""
+    dates = array.array("l")
+    starts = array.array("l")
+    spent = array.array("d")
+    codes = array.array("l")
+    projects = {}
+    for sheet_dates, sheet_starts, sheet_spent, sheet_codes, sheet_projects in columns:
+        mapping = [projects.setdefault(p, len(projects)) for p in sheet_projects]
+        dates.extend(sheet_dates)
+        starts.extend(sheet_starts)
+        spent.extend(sheet_spent)
+        codes.extend(array.array("l", (mapping[code] for code in sheet_codes)))
+    return dates, starts, spent, codes, list(projects)
+
+
+def create_sheets_report(sheets, overtime=False):
+    """Create a single report from multiple sheets, given as (schema, data) tuples.
+
+    Sheets are converted to columns one after the other, then columns are merged and
+    grouped at once, so days found in more than one sheet are counted correctly.
+    """
+    overtime_from = get("OVERTIME_FROM", default=False)
+    check_overtime(overtime)
+
+    sheet_columns = [
+        report_columns(data, schema.indexes, with_start=bool(overtime_from))
+        for schema, data in sheets
+    ]
+    return group_columns(
+        *merge_columns(sheet_columns),
+        overtime_start=to_minutes(overtime_from) if overtime_from else None,
+        working_hours=int(get("WORKING_HOURS", 8)),
+    )
 
-    # Call the Sheets API
-    sheet = service.spreadsheets()
 
-    click.echo("Collecting report…")
+# Columns needed to report a sheet
+REPORT_COLUMNS = ["Date", "Spent", "Project"]
+
+
+def open_spreadsheet(config_dir):
+    """Return the spreadsheets resource of the controller document."""
+    # The ID and range of the controller timesheet
+    # Call the Sheets API
+    sheet = get_service(config_dir).spreadsheets()
 
     try:
-        document_id = get("CONTROLLER_SHEET_DOCUMENT_ID")
+        get("CONTROLLER_SHEET_DOCUMENT_ID")
     except KeyError:
         click.echo(
             "A value for CONTROLLER_SHEET_DOCUMENT_ID is required but "
             "is not specified in your ini file"
         )
         sys.exit(1)
+    return sheet
+
+
+def read_local_sheets(source, months):
+    from . import sources
 
     try:
-        data = (
-            sheet.values()
-            .get(
-                spreadsheetId=document_id,
-                range=f"{sheet_name}!A2:ZZ",
-                valueRenderOption="UNFORMATTED_VALUE",
-            )
-            .execute()
-        )
-    except HttpError as err:
+        return sources.read_local_sheets(source, months)
+    except KeyError as err:
         click.echo(
-            Back.RED
-            + f'Sheet "{sheet_name}" not found or not accessible.'
-            + Style.RESET_ALL
+            Back.RED + f'Sheet "{err.args[0]}" not found in {source}.' + Style.RESET_ALL
         )
-        click.echo(err.error_details)
+        sys.exit(1)
+    except ValueError as err:
+        click.echo(Back.RED + f"Cannot read {source}: {err}" + Style.RESET_ALL)
         sys.exit(1)
 
-    report = create_report(
-        sheet=sheet, sheet_name=sheet_name, data=data, overtime=overtime
-    )
 
-    click.echo("")
-    print_report(report, days=days, projects=projects, overtime=overtime)
-    click.echo("")
+def year_range(year, date_from=None, date_to=None):
+    """Restrict a range of days (both ends optional) to the days of a year."""
+    first, last = datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+    date_from = max(as_date(date_from), first) if date_from else first
+    date_to = min(as_date(date_to), last) if date_to else last
+    return date_from, date_to
+
+
+def report(
+    config_dir,
+    months,
+    days=[],
+    projects=[],
+    overtime=False,
+    date_from=None,
+    date_to=None,
+    source=None,
+    year=None,
+    output_format="table",
+    group_by=None,
+):
+    """Open a sheet, analyze it and extract stats.
+
+    When filtering by days, only rows of selected days are read, unless the local cache
+    is enabled.
+    When a source file is provided, the sheet is read from it and no API call is done.
+    Multiple sheets (also ranges and patterns), or a year, give a single report of all
+    sheets (see report_sheets).
+    Reports are printed as a table, or written as CSV or JSON Lines (see output_report),
+    optionally grouped by day, week, month or project. The whole report is computed
+    before the first row is written.
+    """
+    if months is None or isinstance(months, str):
+        months = [months]
+    months = list(months) or [None]
+    sheet_name = months[0]
+    if (
+        year
+        or len(months) > 1
+        or (sheet_name and (".." in sheet_name or glob.has_magic(sheet_name)))
+    ):
+        return report_sheets(
+            config_dir,
+            months,
+            days=days,
+            projects=projects,
+            overtime=overtime,
+            date_from=date_from,
+            date_to=date_to,
+            source=source,
+            year=year,
+            output_format=output_format,
+            group_by=group_by,
+        )
+
+    # Only the report is written to stdout, when read by other tools
+    click.echo("Collecting report…", err=output_format != "table")
+
+    with metrics.span("read sheets"):
+        if source:
+            sheet = None
+            schema, data = read_local_sheets(source, [sheet_name])[0]
+        else:
+            sheet = open_spreadsheet(config_dir)
+
+            try:
+                selection = DateSelection(days, date_from, date_to)
+                if cache.enabled():
+                    # The whole sheet is cached: rows are filtered by date when printed
+                    schema, data = read_sheet_cached(config_dir, sheet, sheet_name)
+                elif selection:
+                    sheets = read_sheets_by_date(sheet, [sheet_name], selection)
+                    schema, data = sheets[0]
+                else:
+                    schema, data = read_sheet(sheet, sheet_name)
+            except HttpError as err:
+                click.echo(
+                    Back.RED
+                    + f'Sheet "{sheet_name}" not found or not accessible.'
+                    + Style.RESET_ALL
+                )
+                click.echo(err.error_details)
+                sys.exit(1)
+
+    with metrics.span("create report"):
+        report = create_report(
+            sheet=sheet,
+            sheet_name=sheet_name,
+            data=data,
+            overtime=overtime,
+            schema=schema,
+        )
+
+    with metrics.span("output"):
+        output_report(
+            report,
+            output_format,
+            group_by,
+            days=days,
+            projects=projects,
+            overtime=overtime,
+            date_from=date_from,
+            date_to=date_to,
+        )
+
+
+def report_sheets(
+    config_dir,
+    months,
+    days=[],
+    projects=[],
+    overtime=False,
+    date_from=None,
+    date_to=None,
+    source=None,
+    year=None,
+    output_format="table",
+    group_by=None,
+):
+    """Open multiple sheets, and extract stats of all of them in a single report.
+
+    All sheets are read with a single request (unless the local cache is enabled), and
+    totals are printed by day, week, month and project.
+    With a year, only days of that year are reported; if no sheet is given, all sheets of
+    the spreadsheet are used, and sheets without Date, Spent and Project columns are skipped.
+    """
+    # Only the report is written to stdout, when read by other tools
+    click.echo("Collecting report…", err=output_format != "table")
+    months = [month for month in months if month]
+    if year:
+        date_from, date_to = year_range(year, date_from, date_to)
+
+    with metrics.span("read sheets"):
+        if source:
+            sheets = read_local_sheets(source, months or [None])
+        else:
+            sheet = open_spreadsheet(config_dir)
+            try:
+                months = expand_sheets(sheet, months or ["*"])
+                selection = DateSelection(days, date_from, date_to)
+                if cache.enabled():
+                    sheets = [read_sheet_cached(config_dir, sheet, m) for m in months]
+                elif selection and not year:
+                    sheets = read_sheets_by_date(sheet, months, selection)
+                else:
+                    # Most rows of a year are needed: reading whole sheets is cheaper
+                    sheets = read_sheets(sheet, months)
+            except (HttpError, ValueError) as err:
+                click.echo(
+                    Back.RED
+                    + f'Sheet "{", ".join(months)}" not found or not accessible.'
+                    + Style.RESET_ALL
+                )
+                click.echo(getattr(err, "error_details", err))
+                sys.exit(1)
+
+    timesheets = []
+    for month, (schema, data) in zip(months or [None], sheets):
+        missing = [name for name in REPORT_COLUMNS if name not in schema.indexes]
+        if missing:
+            click.echo(
+                Back.YELLOW
+                + Fore.BLACK
+                + f'Sheet "{month}" skipped: missing {", ".join(missing)} columns'
+                + Style.RESET_ALL,
+                err=True,
+            )
+            continue
+        timesheets.append((schema, data))
+
+    with metrics.span("create report"):
+        report = create_sheets_report(timesheets, overtime=overtime)
+
+    with metrics.span("output"):
+        output_report(
+            report,
+            output_format,
+            group_by,
+            totals=True,
+            days=days,
+            projects=projects,
+            overtime=overtime,
+            date_from=date_from,
+            date_to=date_to,
+        )
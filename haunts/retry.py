@@ -0,0 +1,117 @@
+"""Retry policy for calls to Google APIs"""
+
+import email.utils
+import random
+import time
+
+import click
+from googleapiclient.errors import HttpError
+
+from . import metrics
+from .ini import get
+
+# HTTP status codes of temporary errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Reasons used by Google APIs for quota errors returned with a 403 status
+RATE_LIMIT_REASONS = (
+    "rateLimitExceeded",
+    "userRateLimitExceeded",
+    "RATE_LIMIT_EXCEEDED",
+)
+# Initial and max pause between attempts, in seconds
+BACKOFF_BASE = 1
+BACKOFF_MAX = 64
+
+
+def error_reasons(err):
+    """Collect reasons reported in the details of an error."""
+    details = err.error_details if isinstance(err.error_details, list) else []
+    return [detail.get("reason") for detail in details if isinstance(detail, dict)]
+
+
+def is_retryable(err):
+    """Tell if the error is a temporary one, so the call can be retried."""
+    if not isinstance(err, HttpError):
+        return False
+    if err.status_code in RETRY_STATUSES:
+        return True
+    return err.status_code == 403 and any(
+        reason in RATE_LIMIT_REASONS for reason in error_reasons(err)
+    )
+
+
+def retry_after(err):
+    """Seconds to wait as requested by the Retry-After header, if any."""
+    value = err.resp.get("retry-after") if err.resp else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0)
+
+
+def retry_delay(err, attempt, deadline):
+    """Seconds to wait before a new attempt, or None if the call must not be retried.
+
+    The Retry-After header is honored when provided, otherwise an exponential backoff
+    with jitter is used.
+    Retries are limited by RETRY_MAX_ATTEMPTS and by the deadline (a time.monotonic value).
+    """
+    if not is_retryable(err) or attempt >= int(get("RETRY_MAX_ATTEMPTS", 5)):
+        return None
+    delay = retry_after(err)
+    if delay is None:
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+    if time.monotonic() + delay > deadline:
+        return None
+    return delay
+
+
+def get_deadline():
+    """Deadline for retrying a call, based on RETRY_DEADLINE."""
+    return time.monotonic() + float(get("RETRY_DEADLINE", 300))
+
+
+def pause(err, delay):
+    """Wait before a new attempt."""
+    click.echo(
+        f"Request failed ({err.status_code} {err.reason}): "
+        f"haunts will now pause for {delay:.1f}s ⏲…"
+    )
+    metrics.count("retries")
+    metrics.count("sleep seconds", delay)
+    with metrics.span("sleep", "retry", status=err.status_code):
+        time.sleep(delay)
+
+
+def call(function, name="request"):
+    """Call a function doing a request to Google APIs, retrying on temporary errors.
+
+    Every attempt is recorded as an API call with the given name (see metrics).
+    """
+    deadline = get_deadline()
+    attempt = 1
+    while True:
+        try:
+            metrics.count("api calls")
+            with metrics.span(name, "api", attempt=attempt):
+                return function()
+        except HttpError as err:
+            delay = retry_delay(err, attempt, deadline)
+            if delay is None:
+                raise
+            pause(err, delay)
+            attempt += 1
+
+
+def execute(request):
+    """Execute a Google API request, retrying on temporary errors."""
+    # Google API requests have a methodId, like "calendar.events.insert"
+    name = getattr(request, "methodId", None) or getattr(request, "method", "request")
+    return call(request.execute, name=name)
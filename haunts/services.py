@@ -0,0 +1,56 @@
+"""Google API service clients, shared by all haunts modules"""
+
+import threading
+
+from . import metrics
+from .ini import get
+
+# Clients built by every thread, released with the thread
+local = threading.local()
+
+
+def get_service(config_dir, name, version, scopes, token_file):
+    """Return a client for a Google API service.
+
+    Every service is built once per credentials and scopes, and then reused for the whole
+    process. The discovery document bundled with the Google API client library is used,
+    so no additional request is done to build the service.
+
+    HTTP connections used by clients are not thread safe, so every thread gets its own client.
+    Clients of the same thread share their connections (see the transport module).
+    Use a single pool of threads for a whole run, so clients are not built again.
+
+    The BACKEND option selects where data is read and written: "google" (the default)
+    uses Google APIs, "memory" uses a local simulation (see the memory module).
+    """
+    services_cache = getattr(local, "services", None)
+    if services_cache is None:
+        services_cache = local.services = {}
+    key = (name, version, token_file, tuple(scopes))
+    service = services_cache.get(key)
+    if service:
+        return service
+    if get("BACKEND", "google") == "memory":
+        from . import memory
+
+        with metrics.span(f"build {name} {version}", "build"):
+            service = memory.build(config_dir, name, version)
+        services_cache[key] = service
+        return service
+    # Google API client libraries are slow to import: only load them when needed
+    from googleapiclient.discovery import build
+
+    from .credentials import get_credentials
+    from .transport import get_http
+
+    creds = get_credentials(config_dir, scopes, token_file)
+    with metrics.span(f"build {name} {version}", "build"):
+        service = build(
+            name,
+            version,
+            http=get_http(creds),
+            static_discovery=True,
+            cache_discovery=False,
+        )
+    services_cache[key] = service
+    return service
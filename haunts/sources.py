@@ -0,0 +1,314 @@
+"""Read timesheets from local files: CSV, XLSX and ODS exports of the spreadsheet."""
+
+import csv
+import datetime
+import re
+import zipfile
+from pathlib import Path
+from xml.etree import ElementTree
+
+from .ini import get
+from .spreadsheet import SheetSchema, column_letter
+
+# Weird google spreadsheet date management: dates are days since this one
+SERIAL_ORIGIN = datetime.datetime(1899, 12, 30)
+
+# Dates in local formats, like "01/05/2023", "1.5.23" or "2023/05/01"
+LOCAL_DATE = re.compile(r"^(\d{1,4})[/.-](\d{1,2})[/.-](\d{1,4})$")
+
+XLSX_NS = {
+    "main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "rel": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "pkg": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+ODS_NS = {
+    "table": "urn:oasis:names:tc:opendocument:xmlns:table:1.0",
+    "office": "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
+    "text": "urn:oasis:names:tc:opendocument:xmlns:text:1.0",
+}
+
+
+def to_serial(value):
+    """Convert a date or datetime to a Google Sheets serial date."""
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    delta = value - SERIAL_ORIGIN
+    serial = delta.days + delta.seconds / 86400
+    return int(serial) if serial == int(serial) else serial
+
+
+def parse_text(value):
+    """Convert a text cell to the value returned by Google Sheets API: numbers and dates
+    in "YYYY-MM-DD" format become numbers."""
+    if value == "":
+        return value
+    try:
+        number = float(value)
+    except ValueError:
+        pass
+    else:
+        return int(number) if number == int(number) else number
+    if re.match(r"^\d{4}-\d{2}-\d{2}$", value):
+        try:
+            return to_serial(datetime.date.fromisoformat(value))
+        except ValueError:
+            pass
+    return value
+
+
+def parse_date(value):
+    """Convert a date in a local format to a serial date, or return None if not a date.
+
+    Day and month are in the order of the LOCAL_DATE_ORDER option ("DMY", the default, or
+    "MDY"), unless the year comes first. Years with two digits are in the 2000s.
+    """
+    match = LOCAL_DATE.match(value.strip())
+    if not match:
+        return None
+    first, second, third = match.groups()
+    if len(first) == 4:
+        year, month, day = first, second, third
+    elif get("LOCAL_DATE_ORDER", "DMY").upper() == "MDY":
+        month, day, year = first, second, third
+    else:
+        day, month, year = first, second, third
+    year = int(year) + 2000 if len(year) <= 2 else int(year)
+    try:
+        return to_serial(datetime.date(year, int(month), int(day)))
+    except ValueError:
+        return None
+
+
+def normalize_rows(rows):
+    """Make rows look like values read from Google Sheets API.
+
+    Dates in local formats in the "Date" column become serial dates (see parse_date),
+    times stored as fractions of a day in the "Start time" column become "HH:MM" strings,
+    and trailing empty cells are removed.
+    Raise ValueError when a value of the "Date" column is not a date.
+    """
+    headers = rows[0] if rows else []
+    date = headers.index("Date") if "Date" in headers else None
+    start_time = headers.index("Start time") if "Start time" in headers else None
+    for y, row in enumerate(rows):
+        if (
+            date is not None
+            and date < len(row)
+            and isinstance(row[date], str)
+            and row[date].strip()
+            and row is not headers
+        ):
+            serial = parse_date(row[date])
+            if serial is None:
+                raise ValueError(
+                    f'Invalid date "{row[date]}" in cell {column_letter(date)}{y + 1}'
+                )
+            row[date] = serial
+        if start_time is not None and start_time < len(row):
+            value = row[start_time]
+            if (
+                isinstance(value, (int, float))
+                and 0 <= value < 1
+                and row is not headers
+            ):
+                minutes = round(value * 24 * 60)
+                row[start_time] = f"{minutes // 60:02d}:{minutes % 60:02d}"
+        while row and row[-1] in ("", None):
+            row.pop()
+    return rows
+
+
+def read_csv(path, sheet_name=None):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return [[parse_text(value) for value in row] for row in csv.reader(f)]
+
+
+def xlsx_sheets(archive):
+    """Map sheet names of a XLSX file to the path of their XML document."""
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    relations = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {
+        rel.get("Id"): rel.get("Target")
+        for rel in relations.findall("pkg:Relationship", XLSX_NS)
+    }
+    sheets = {}
+    for sheet in workbook.findall("main:sheets/main:sheet", XLSX_NS):
+        target = targets[sheet.get(f"{{{XLSX_NS['rel']}}}id")]
+        target = target.lstrip("/")
+        sheets[sheet.get("name")] = (
+            target if target.startswith("xl/") else f"xl/{target}"
+        )
+    return sheets
+
+
+def read_xlsx(path, sheet_name=None):
+    with zipfile.ZipFile(path) as archive:
+        sheets = xlsx_sheets(archive)
+        sheet_name = sheet_name or next(iter(sheets))
+        if sheet_name not in sheets:
+            raise KeyError(sheet_name)
+        shared = []
+        if "xl/sharedStrings.xml" in archive.namelist():
+            strings = ElementTree.fromstring(archive.read("xl/sharedStrings.xml"))
+            for item in strings.findall("main:si", XLSX_NS):
+                shared.append(
+                    "".join(t.text or "" for t in item.iter(f"{{{XLSX_NS['main']}}}t"))
+                )
+        document = ElementTree.fromstring(archive.read(sheets[sheet_name]))
+
+    rows = []
+    for row in document.findall("main:sheetData/main:row", XLSX_NS):
+        # References of rows and cells are optional: without them, they follow the
+        # previous one
+        y = int(row.get("r")) - 1 if row.get("r") else len(rows)
+        while len(rows) <= y:
+            rows.append([])
+        values = rows[y]
+        x = -1
+        for cell in row.findall("main:c", XLSX_NS):
+            if cell.get("r"):
+                letters = re.match(r"[A-Z]+", cell.get("r")).group(0)
+                x = 0
+                for letter in letters:
+                    x = x * 26 + ord(letter) - ord("A") + 1
+                x -= 1
+            else:
+                x += 1
+            kind = cell.get("t", "n")
+            raw = cell.findtext("main:v", default="", namespaces=XLSX_NS)
+            if kind == "s":
+                value = shared[int(raw)]
+            elif kind == "inlineStr":
+                value = "".join(
+                    t.text or "" for t in cell.iter(f"{{{XLSX_NS['main']}}}t")
+                )
+            elif kind == "b":
+                value = raw == "1"
+            elif kind in ("str", "e"):
+                value = raw
+            else:
+                value = parse_text(raw)
+            while len(values) <= x:
+                values.append("")
+            values[x] = value
+    return rows
+
+
+def ods_value(cell):
+    """Value of an ODS cell, as returned by Google Sheets API."""
+    kind = cell.get(f"{{{ODS_NS['office']}}}value-type")
+    if kind in ("float", "percentage", "currency"):
+        return parse_text(cell.get(f"{{{ODS_NS['office']}}}value"))
+    if kind == "date":
+        return to_serial(
+            datetime.datetime.fromisoformat(
+                cell.get(f"{{{ODS_NS['office']}}}date-value")
+            )
+        )
+    if kind == "time":
+        match = re.match(
+            r"PT(\d+)H(\d+)M", cell.get(f"{{{ODS_NS['office']}}}time-value")
+        )
+        return f"{int(match.group(1)):02d}:{int(match.group(2)):02d}"
+    if kind == "boolean":
+        return cell.get(f"{{{ODS_NS['office']}}}boolean-value") == "true"
+    paragraphs = cell.findall("text:p", ODS_NS)
+    return "\n".join("".join(p.itertext()) for p in paragraphs)
+
+
+def read_ods(path, sheet_name=None):
+    with zipfile.ZipFile(path) as archive:
+        document = ElementTree.fromstring(archive.read("content.xml"))
+    tables = document.findall("office:body/office:spreadsheet/table:table", ODS_NS)
+    names = [table.get(f"{{{ODS_NS['table']}}}name") for table in tables]
+    sheet_name = sheet_name or names[0]
+    if sheet_name not in names:
+        raise KeyError(sheet_name)
+    table = tables[names.index(sheet_name)]
+
+    repeat_rows = f"{{{ODS_NS['table']}}}number-rows-repeated"
+    repeat_cols = f"{{{ODS_NS['table']}}}number-columns-repeated"
+    rows = []
+    # Empty rows and cells are often repeated up to the sheet size: they are only
+    # added when followed by something else
+    empty_rows = 0
+    for row in table.iter(f"{{{ODS_NS['table']}}}table-row"):
+        values = []
+        empty_cells = 0
+        for cell in row:
+            if cell.tag not in (
+                f"{{{ODS_NS['table']}}}table-cell",
+                f"{{{ODS_NS['table']}}}covered-table-cell",
+            ):
+                continue
+            value = ods_value(cell)
+            repeat = int(cell.get(repeat_cols, 1))
+            if value == "":
+                empty_cells += repeat
+                continue
+            values.extend([""] * empty_cells + [value] * repeat)
+            empty_cells = 0
+        repeat = int(row.get(repeat_rows, 1))
+        if not values:
+            empty_rows += repeat
+            continue
+        rows.extend([[] for _ in range(empty_rows)])
+        rows.extend([list(values) for _ in range(repeat)])
+        empty_rows = 0
+    return rows
+
+
+READERS = {
+    ".csv": read_csv,
+    ".xlsx": read_xlsx,
+    ".ods": read_ods,
+}
+
+
+def read_rows(path, sheet_name=None):
+    """Read all rows of a sheet (the first one if not provided) from a local file."""
+    path = Path(path)
+    try:
+        reader = READERS[path.suffix.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unsupported file type: {path.suffix}. Use one of {', '.join(READERS)}"
+        )
+    return normalize_rows(reader(path, sheet_name))
+
+
+def read_local(path, sheet_name=None):
+    """Read a sheet from a local file.
+
+    Return the sheet schema and a dict where "values" are the data rows, like read_sheet.
+    """
+    values = read_rows(path, sheet_name)
+    schema = SheetSchema(values[0] if values else [])
+    return schema, {"values": values[1:]}
+
+
+def read_local_sheets(path, sheet_names):
+    """Read sheets from a local file, returning a (schema, data) tuple per sheet name.
+
+    A CSV file holds a single sheet, so it can't be read for more than one sheet name.
+    Raise KeyError when a sheet is not found, ValueError when the file can't be read.
+    """
+    if Path(path).suffix.lower() == ".csv" and len(sheet_names) > 1:
+        raise ValueError(
+            f"a CSV file holds a single sheet, cannot read {', '.join(sheet_names)}"
+        )
+    return [read_local(path, sheet_name) for sheet_name in sheet_names]
+
+
+def read_local_calendars(path):
+    """Read projects/calendars associations from the configuration sheet of a local file.
+
+    Return None if the file has no configuration sheet.
+    """
+    if Path(path).suffix.lower() == ".csv":
+        return None
+    try:
+        values = read_rows(path, get("CONTROLLER_SHEET_NAME", "config"))
+    except KeyError:
+        return None
+    return {row[1]: row[0] for row in values[1:] if len(row) >= 2}
@@ -1,20 +1,52 @@
 import datetime
+import fnmatch
+import glob
+import hashlib
+import itertools
+import json
+import math
+import numbers
+import re
 import string
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+
 import click
 from colorama import Back, Fore, Style
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 from . import LOGGER
-from . import actions
-from .credentials import get_credentials
-from .calendars import ORIGIN_TIME, create_event, delete_event, formatDate
+from . import actions, cache, metrics
+from .services import get_service as get_api_service
+from .calendars import (
+    BATCH_SIZE,
+    build_event,
+    echo_created,
+    find_event,
+    formatDate,
+    get_busy_index,
+    new_event_id,
+    origin_time,
+    parallel_events,
+    run_events,
+)
 from .ini import get
+from .journal import Journal, journal_path, load_journal, pending_operations
+from .retry import execute
 
 # If scopes are modified, delete the sheets-token file
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+# Max number of ranges sent in a single batchUpdate/batchClear call
+WRITEBACK_BATCH_SIZE = 500
+# Planned operations are applied, and written back, in chunks of this size
+APPLY_CHUNK_SIZE = 200
+# Columns used to detect changes in already synced rows
+FINGERPRINT_COLUMNS = ["Date", "Start time", "Spent", "Activity", "Details", "Project"]
+
+
+def get_service(config_dir):
+    return get_api_service(config_dir, "sheets", "v4", SCOPES, "sheets-token.json")
 
 
 def get_col(row, index):
@@ -24,28 +56,585 @@ def get_col(row, index):
         return None
 
 
-def get_headers(sheet, month, indexes=False):
-    """Scan headers of a month and returns a structure that assign headers names to indexes"""
-    selected_month = (
-        sheet.values()
-        .get(spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"), range=f"{month}!A1:ZZ1")
-        .execute()
+def column_letter(index):
+    """Convert a 0-based column index to its A1 notation letters (0 is A, 26 is AA)."""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = string.ascii_uppercase[remainder] + letters
+    return letters
+
+
+class SheetSchema:
+    """Headers of a sheet, giving both column indexes and A1 column letters by name."""
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.indexes = {}
+        for index, name in enumerate(headers):
+            self.indexes.setdefault(name, index)
+        self.letters = {name: column_letter(i) for name, i in self.indexes.items()}
+
+
+def range_last_row(a1_range):
+    """Last row number of a range in A1 notation, like 42 for "May!A1:ZZ42"."""
+    match = re.search(r"(\d+)$", a1_range or "")
+    return int(match.group(1)) if match else None
+
+
+def iter_pages(sheet, month, first_page, page_size):
+    """Yield rows of a month, starting from an already fetched first page of a given size.
+
+    Following pages are fetched only when rows of the previous one have been consumed.
+    Reading stops at the end of the sheet grid: empty pages are skipped, and their rows are
+    yielded as empty rows only when followed by other rows.
+    """
+    values, last_row = first_page
+    start = 1
+    # Empty rows not yielded yet, as trailing empty rows are not returned by the API
+    blanks = 0
+    while True:
+        end = start + page_size - 1
+        if values:
+            yield from [[]] * blanks
+            yield from values
+            blanks = page_size - len(values)
+        else:
+            blanks += page_size
+        if last_row is not None and last_row < end:
+            return
+        start = end + 1
+        try:
+            page = execute(
+                sheet.values().get(
+                    spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"),
+                    range=f"{month}!A{start}:ZZ{start + page_size - 1}",
+                    valueRenderOption="UNFORMATTED_VALUE",
+                    fields="range,values",
+                )
+            )
+        except HttpError as err:
+            if err.status_code == 400:
+                # Page is beyond the sheet grid
+                return
+            raise
+        values = page.get("values", [])
+        last_row = range_last_row(page.get("range"))
+
+
+def read_sheets(sheet, months, page_size=None):
+    """Read headers and data of multiple months with a single request.
+
+    Return a list of (schema, data) tuples, one for every month, where "values" of data are
+    the rows of the month.
+    When a page size is provided (default is the PAGE_SIZE option), only the first page of
+    every month is read in advance: rows are then an iterator and following pages are
+    fetched while rows are consumed.
+    """
+    if page_size is None:
+        page_size = int(get("PAGE_SIZE", 0) or 0)
+    end = page_size or ""
+    result = execute(
+        sheet.values().batchGet(
+            spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"),
+            ranges=[f"{month}!A1:ZZ{end}" for month in months],
+            valueRenderOption="UNFORMATTED_VALUE",
+            fields="valueRanges(range,values)",
+        )
+    )
+    sheets = []
+    for month, value_range in zip(months, result.get("valueRanges", [])):
+        values = value_range.get("values", [])
+        schema = SheetSchema(values[0] if values else [])
+        if page_size:
+            first_page = (values, range_last_row(value_range.get("range")))
+            rows = itertools.islice(
+                iter_pages(sheet, month, first_page, page_size), 1, None
+            )
+        else:
+            rows = values[1:]
+        sheets.append((schema, {"values": rows}))
+    return sheets
+
+
+def read_sheet(sheet, month, page_size=None):
+    """Read headers and data of a month with a single request.
+
+    Return the sheet schema and a dict where "values" are the data rows (see read_sheets).
+    """
+    return read_sheets(sheet, [month], page_size=page_size)[0]
+
+
+def read_sheet_cached(config_dir, sheet, month):
+    """Read headers and data of a month, from the local cache when enabled (see cache)."""
+
+    def read():
+        schema, data = read_sheet(sheet, month)
+        return {"headers": schema.headers, "values": list(data["values"])}
+
+    value = cache.cached(config_dir, month, read)
+    return SheetSchema(value["headers"]), {"values": value["values"]}
+
+
+def get_sheet_titles(sheet):
+    """Titles of all sheets in the spreadsheet, in document order."""
+    document = execute(
+        sheet.get(
+            spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"),
+            fields="sheets.properties.title",
+        )
+    )
+    return [s["properties"]["title"] for s in document.get("sheets", [])]
+
+
+def expand_sheets(sheet, names):
+    """Expand sheet names, ranges like "Jan..Mar" and patterns like "202?-*".
+
+    Titles of sheets are read from the spreadsheet only when ranges or patterns are used.
+    """
+    if not any(".." in name or glob.has_magic(name) for name in names):
+        return list(names)
+    titles = get_sheet_titles(sheet)
+    candidates = [t for t in titles if t != get("CONTROLLER_SHEET_NAME", "config")]
+    months = []
+    for name in names:
+        if ".." in name:
+            first, last = name.split("..", 1)
+            try:
+                start, end = titles.index(first), titles.index(last)
+            except ValueError:
+                raise ValueError(f'Sheet "{first}" or "{last}" not found')
+            matches = [t for t in titles[start : end + 1] if t in candidates]
+        elif glob.has_magic(name):
+            matches = [t for t in candidates if fnmatch.fnmatchcase(t, name)]
+        else:
+            matches = [name]
+        months.extend(m for m in matches if m not in months)
+    return months
+
+
+class DateSelection:
+    """Days selected by a list of days and an optional range of days (both ends included).
+
+    An empty selection contains every day.
+    """
+
+    def __init__(self, days=[], date_from=None, date_to=None):
+        self.days = {as_date(d) for d in days}
+        self.date_from = as_date(date_from) if date_from else None
+        self.date_to = as_date(date_to) if date_to else None
+        self.have_range = bool(self.date_from or self.date_to)
+
+    def __bool__(self):
+        return bool(self.days) or self.have_range
+
+    def __contains__(self, date):
+        if not self:
+            return True
+        if date in self.days:
+            return True
+        return (
+            self.have_range
+            and (not self.date_from or date >= self.date_from)
+            and (not self.date_to or date <= self.date_to)
+        )
+
+
+def as_date(value):
+    """Convert a datetime, or a string in "YYYY-MM-DD" format, to a date."""
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def serial_to_date(serial):
+    """Convert a Google Sheets serial date to a date."""
+    return (origin_time() + datetime.timedelta(days=serial)).date()
+
+
+def date_index(dates):
+    """Map every date found in a Date column to spans of contiguous rows (first, last)."""
+    index = {}
+    for y, value in enumerate(dates):
+        value = value[0] if value else None
+        if not isinstance(value, numbers.Number) or not value:
+            continue
+        spans = index.setdefault(serial_to_date(value), [])
+        if spans and spans[-1][1] == y - 1:
+            spans[-1] = (spans[-1][0], y)
+        else:
+            spans.append((y, y))
+    return index
+
+
+def read_date_indexes(sheet, months):
+    """Read headers and Date column of months, returning a (schema, date index) per month.
+
+    Headers and the first column are read together, so only one request is needed when
+    Date is the first column of every month.
+    """
+    document_id = get("CONTROLLER_SHEET_DOCUMENT_ID")
+    ranges = []
+    for month in months:
+        ranges.extend([f"{month}!A1:ZZ1", f"{month}!A2:A"])
+    result = execute(
+        sheet.values().batchGet(
+            spreadsheetId=document_id,
+            ranges=ranges,
+            valueRenderOption="UNFORMATTED_VALUE",
+            fields="valueRanges(range,values)",
+        )
     )
-    values = selected_month["values"][0]
-    if indexes:
-        return {k: values.index(k) for k in values}
-    return {k: string.ascii_lowercase.upper()[values.index(k)] for k in values}
+    value_ranges = result.get("valueRanges", [])
+    schemas = []
+    columns = []
+    for headers_range, column_range in zip(value_ranges[::2], value_ranges[1::2]):
+        headers = headers_range.get("values", [[]])
+        schemas.append(SheetSchema(headers[0] if headers else []))
+        columns.append(column_range.get("values", []))
+
+    others = [
+        i for i, schema in enumerate(schemas) if schema.indexes.get("Date", 0) != 0
+    ]
+    if others:
+        result = execute(
+            sheet.values().batchGet(
+                spreadsheetId=document_id,
+                ranges=[
+                    f"{months[i]}!{schemas[i].letters['Date']}2:{schemas[i].letters['Date']}"
+                    for i in others
+                ],
+                valueRenderOption="UNFORMATTED_VALUE",
+                fields="valueRanges(range,values)",
+            )
+        )
+        for i, value_range in zip(others, result.get("valueRanges", [])):
+            columns[i] = value_range.get("values", [])
+    return [(schema, date_index(column)) for schema, column in zip(schemas, columns)]
+
+
+def iter_spans(spans, values):
+    """Yield rows of a sheet, where only rows in spans are provided (others are empty)."""
+    y = 0
+    for (first, last), rows in zip(spans, values):
+        yield from [[]] * (first - y)
+        yield from rows
+        yield from [[]] * (last - first + 1 - len(rows))
+        y = last + 1
+
 
+def read_sheets_by_date(sheet, months, selection):
+    """Read only rows of months with a date in the selection.
 
-def sync_events(
-    config_dir, sheet, data, calendars, days, month, projects=[], allowed_actions=[]
+    A date index is read first, then rows of selected dates are read with a single request.
+    Every selected date is read from its first row to its last one, also when rows of other
+    dates are in between: events of a day are placed like when reading the whole sheet.
+    Return a list of (schema, data) tuples like read_sheets, where rows not selected are empty.
+    """
+    indexes = read_date_indexes(sheet, months)
+    month_spans = []
+    for schema, index in indexes:
+        spans = sorted(
+            (date_spans[0][0], date_spans[-1][1])
+            for date, date_spans in index.items()
+            if date in selection
+        )
+        merged = []
+        for first, last in spans:
+            if merged and merged[-1][1] >= first - 1:
+                merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+            else:
+                merged.append((first, last))
+        month_spans.append(merged)
+
+    ranges = [
+        f"{month}!A{first + 2}:ZZ{last + 2}"
+        for month, spans in zip(months, month_spans)
+        for first, last in spans
+    ]
+    value_ranges = []
+    if ranges:
+        result = execute(
+            sheet.values().batchGet(
+                spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"),
+                ranges=ranges,
+                valueRenderOption="UNFORMATTED_VALUE",
+                fields="valueRanges(range,values)",
+            )
+        )
+        value_ranges = [r.get("values", []) for r in result.get("valueRanges", [])]
+
+    sheets = []
+    for (schema, index), spans in zip(indexes, month_spans):
+        values, value_ranges = value_ranges[: len(spans)], value_ranges[len(spans) :]
+        sheets.append((schema, {"values": iter_spans(spans, values)}))
+    return sheets
+
+
+def get_schema(sheet, month):
+    """Read the headers row of a month."""
+    selected_month = execute(
+        sheet.values().get(
+            spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"),
+            range=f"{month}!A1:ZZ1",
+            fields="values",
+        )
+    )
+    return SheetSchema(selected_month["values"][0])
+
+
+class SheetWriter:
+    """Buffer values to be written back to the spreadsheet.
+
+    Pending values are sent using few batchUpdate/batchClear calls when flushing.
+    A flush is also done automatically when WRITEBACK_INTERVAL seconds are passed since
+    the last one, so long runs are periodically saved.
+    Successful flushes are recorded in the journal, when provided.
+    """
+
+    def __init__(self, sheet, dry_run=False, journal=None):
+        self.sheet = sheet
+        self.dry_run = dry_run
+        self.journal = journal
+        self.updates = {}
+        self.clears = {}
+        self.interval = float(get("WRITEBACK_INTERVAL", 30))
+        self.last_flush = time.monotonic()
+
+    def update(self, range, value):
+        self.clears.pop(range, None)
+        self.updates[range] = value
+
+    def clear(self, range):
+        self.updates.pop(range, None)
+        self.clears[range] = True
+
+    def checkpoint(self):
+        """Flush pending values if enough time is passed since last flush."""
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Send all pending values to the spreadsheet."""
+        clears = list(self.clears)
+        updates = [
+            {"range": range, "values": [[value]]}
+            for range, value in self.updates.items()
+        ]
+        self.clears = {}
+        self.updates = {}
+        if self.dry_run or not (clears or updates):
+            return
+        with metrics.span("write back", clears=len(clears), updates=len(updates)):
+            self.write(clears, updates)
+        if self.journal:
+            self.journal.flushed()
+        self.last_flush = time.monotonic()
+
+    def write(self, clears, updates):
+        document_id = get("CONTROLLER_SHEET_DOCUMENT_ID")
+        for start in range(0, len(clears), WRITEBACK_BATCH_SIZE):
+            execute(
+                self.sheet.values().batchClear(
+                    spreadsheetId=document_id,
+                    fields="spreadsheetId",
+                    body={"ranges": clears[start : start + WRITEBACK_BATCH_SIZE]},
+                )
+            )
+        for start in range(0, len(updates), WRITEBACK_BATCH_SIZE):
+            execute(
+                self.sheet.values().batchUpdate(
+                    spreadsheetId=document_id,
+                    fields="totalUpdatedCells",
+                    body={
+                        "valueInputOption": "USER_ENTERED",
+                        "data": updates[start : start + WRITEBACK_BATCH_SIZE],
+                    },
+                )
+            )
+
+
+def row_fingerprint(headers_id, row, from_time=None):
+    """Compact fingerprint of the row columns used to generate an event.
+
+    When provided, from_time is where the event starts (see plan_events): events moved
+    by changes to previous rows of the day get a different fingerprint.
+    The project name is kept readable, so the calendar where the event has been created
+    is known when the project changes.
+    """
+    # Empty cells at the end of the row are not returned by the API, until something is
+    # written after them
+    values = [
+        (get_col(row, headers_id[name]) or "") if name in headers_id else None
+        for name in FINGERPRINT_COLUMNS
+    ]
+    if from_time and isinstance(get_col(row, headers_id["Spent"]), numbers.Number):
+        # Full-day events don't move
+        values.append(from_time)
+    digest = hashlib.sha1(json.dumps(values, default=str).encode("utf-8"))
+    return f"{digest.hexdigest()[:10]}:{get_col(row, headers_id['Project'])}"
+
+
+def store_created(writer, month, headers, y, event, fingerprint=None):
+    """Save references to a created event in the sheet row."""
+    # Put the action to actions.IGNORE, in this way it will not be processed again
+    writer.update(f"{month}!{headers['Action']}{y + 2}", actions.IGNORE)
+    # Save the event id, required to interact with the event in future
+    writer.update(f"{month}!{headers['Event id']}{y + 2}", event["id"])
+    # Quick link to the event on the calendar
+    writer.update(
+        f"{month}!{headers['Link']}{y + 2}",
+        f"=HYPERLINK(\"{event['link']}\";\"open\")",
+    )
+    # Fingerprint of the row, used to detect changes
+    if fingerprint and "Fingerprint" in headers:
+        writer.update(f"{month}!{headers['Fingerprint']}{y + 2}", fingerprint)
+    writer.checkpoint()
+
+
+def store_fingerprint(writer, month, headers, y, fingerprint):
+    """Save the fingerprint of a row synced before the Fingerprint column was added."""
+    writer.update(f"{month}!{headers['Fingerprint']}{y + 2}", fingerprint)
+    writer.checkpoint()
+
+
+def clear_deleted(writer, month, headers, operation):
+    """Clear references to a deleted event from the sheet row."""
+    y = operation["row"]
+    click.echo(
+        f'Deleted event "{operation["summary"]}" in date {operation["date"].strftime("%d/%m")} '
+        f'from calendar {operation["project"]}'
+    )
+    writer.clear(f"{month}!{headers['Event id']}{y + 2}")
+    writer.clear(f"{month}!{headers['Link']}{y + 2}")
+    writer.clear(f"{month}!{headers['Action']}{y + 2}")
+    if "Fingerprint" in headers:
+        writer.clear(f"{month}!{headers['Fingerprint']}{y + 2}")
+    writer.checkpoint()
+
+
+def to_minutes(value):
+    """Convert a "HH:MM" time to minutes from midnight."""
+    hours, _, minutes = value.partition(":")
+    return int(hours) * 60 + int(minutes or 0)
+
+
+def busy_index(config_dir, sheets, calendars, selection):
+    """Read busy times of all calendars, for days where new events can be created.
+
+    New events with a start time are also added, so other events are not placed there.
+    Sheets are (schema, data) tuples; rows of data are loaded in memory.
+    Return None if there are no new events.
+    """
+    days = set()
+    fixed = []
+    for schema, data in sheets:
+        data["values"] = list(data["values"])
+        indexes = schema.indexes
+        for row in data["values"]:
+            current_date = get_col(row, indexes.get("Date"))
+            if not isinstance(current_date, numbers.Number) or (
+                "Action" in indexes and get_col(row, indexes["Action"])
+            ):
+                continue
+            date = serial_to_date(current_date)
+            if date not in selection:
+                continue
+            days.add(date)
+            start_time = (
+                get_col(row, indexes["Start time"]) if "Start time" in indexes else None
+            )
+            length = get_col(row, indexes["Spent"])
+            if start_time and isinstance(length, numbers.Number):
+                start = to_minutes(start_time)
+                fixed.append((date, start, min(start + round(length * 60), 24 * 60)))
+    if not days:
+        return None
+    busy = get_busy_index(config_dir, calendars.values(), min(days), max(days))
+    for slot in fixed:
+        busy.add(*slot)
+    return busy
+
+
+def echo_planned(operation):
+    """Print what an operation would do, without executing it."""
+    when = operation["date"].strftime("%d/%m")
+    if operation["action"] == "fingerprint":
+        click.echo(
+            f'Would save the fingerprint of event "{operation["summary"]}" '
+            f'in date {when} on calendar {operation["project"]}'
+        )
+        return
+    if operation["action"] == "delete":
+        click.echo(
+            f'Would delete event "{operation["summary"]}" in date {when} '
+            f'from calendar {operation["project"]}'
+        )
+        return
+    start, end = operation["body"]["start"], operation["body"]["end"]
+    if "dateTime" in start:
+        slot = (
+            f'from {formatDate(start["dateTime"], "%H:%M")} '
+            f'to {formatDate(end["dateTime"], "%H:%M")} ({float(operation["length"])}h)'
+        )
+    else:
+        slot = "(full day)"
+    click.echo(
+        f'Would {operation["action"]} event "{operation["summary"]}" {slot} '
+        f'in date {when} on calendar {operation["project"]}'
+    )
+
+
+def plan_events(
+    data,
+    calendars,
+    schema,
+    month=None,
+    days=[],
+    projects=[],
+    allowed_actions=[],
+    date_from=None,
+    date_to=None,
+    busy=None,
+    journaled=False,
+    skip=(),
 ):
-    """Create an event when action column is empty."""
-    headers = get_headers(sheet, month)
-    headers_id = get_headers(sheet, month, indexes=True)
+    """Decide which calendar operations are needed to sync rows of a sheet, without requests.
+
+    Return the list of operations and the list of rows with warnings (0-based indexes of
+    data rows). Operations are dicts with "action" ("create", "update", "delete" or
+    "fingerprint"), "month", "row" and "calendar" keys. Create and update operations have the event "body", where
+    start and end times are already computed: events of a day follow each other, and
+    already synced rows keep their place.
+    Deletions of rows without an event id have None as "event_id": only the row is cleared.
+    If the sheet has a "Fingerprint" column, already synced rows are checked for changes
+    and related events are updated, together with following events of the day whose start
+    time is changed. Synced rows without a fingerprint only get one ("fingerprint" action).
+    Only rows in the provided days, or in the range from date_from to date_to, are used.
+    Rows excluded by allowed_actions or projects are not synced, but keep their place in
+    the day, so following events start at the same time as in a full sync.
+    When a busy index is provided (see get_busy_index), new events without a start time are
+    placed in the first free slot, and new events are added to the index. New full-day events
+    are then created as free (transparent).
+    When journaled is True, new events get an id and operations have a "check" of the row
+    content (see journal). Rows in skip (0-based indexes of data rows) are not processed.
+    """
+    headers_id = schema.indexes
+    selection = DateSelection(days, date_from, date_to)
     last_to_time = None
     last_date = None
     warn_lines = []
+    operations = []
+    fingerprints = "Fingerprint" in headers_id
+    y = -1
+
+    def plan(operation, row):
+        if journaled:
+            operation["check"] = row_fingerprint(headers_id, row)
+        operations.append(operation)
 
     for y, row in enumerate(data["values"]):
         action = ""
@@ -57,9 +646,28 @@ def sync_events(
 
         project = get_col(row, headers_id["Project"])
 
-        if action == actions.IGNORE:
+        current_date = get_col(row, headers_id["Date"])
+        if not current_date:
+            LOGGER.debug(f"No date found at line {y+1}, skipping")
+            continue
+
+        date = origin_time() + datetime.timedelta(days=current_date)
+        default_start_time = (
+            get_col(row, headers_id["Start time"])
+            if headers_id.get("Start time") and get_col(row, headers_id["Start time"])
+            else None
+        )
+
+        # In case we changed day, let's restart from START_TIME
+        if current_date != last_date:
+            last_to_time = None
+        last_date = current_date
+
+        # short circuit for date filters
+        if date.date() not in selection:
             continue
 
+        filtered = False
         if (
             # We want to filter by Action value and current action is not in the provided set
             (
@@ -74,35 +682,92 @@ def sync_events(
             LOGGER.debug(
                 f"Action {action} at line {y+1}, not in allowed actions {allowed_actions}"
             )
-            continue
-
-        current_date = get_col(row, headers_id["Date"])
-        if not current_date:
-            LOGGER.debug(f"No date found at line {y+1}, skipping")
-            continue
-
-        if projects and project not in projects:
-            continue
+            filtered = True
+        elif projects and project not in projects:
+            filtered = True
 
-        date = ORIGIN_TIME + datetime.timedelta(days=current_date)
-        default_start_time = (
-            get_col(row, headers_id["Start time"])
-            if headers_id.get("Start time") and get_col(row, headers_id["Start time"])
+        summary = get_col(row, headers_id["Activity"])
+        details = get_col(row, headers_id["Details"])
+        length = get_col(row, headers_id["Spent"])
+        from_time = default_start_time or last_to_time
+        # Also for events placed in free slots, the start time following the previous
+        # event is used: they are not moved back by next syncs
+        fingerprint = (
+            row_fingerprint(headers_id, row, from_time or get("START_TIME", "09:00"))
+            if fingerprints
             else None
         )
 
-        # In case we changed day, let's restart from START_TIME
-        if current_date != last_date:
-            last_to_time = None
-        last_date = current_date
+        if y in skip:
+            # Done by an interrupted run: its event keeps its place in the day
+            if action != actions.DELETE:
+                body, last_to_time = build_event(
+                    date, summary, details, length, from_time, month
+                )
+            continue
 
-        # short circuit for date filters
-        skip = len(days) > 0
-        for d in days:
-            if date.date() == d.date():
-                skip = False
-                break
-        if skip:
+        if filtered:
+            # Not synced now, but events of the day are placed as in a full sync
+            if not action or action == actions.IGNORE:
+                body, last_to_time = build_event(
+                    date, summary, details, length, from_time, month
+                )
+            continue
+
+        if action == actions.IGNORE:
+            # Already synced: events keep their place when computing next start time
+            body, last_to_time = build_event(
+                date, summary, details, length, from_time, month
+            )
+            stored = get_col(row, headers_id["Fingerprint"]) if fingerprints else None
+            event_id = get_col(row, headers_id["Event id"])
+            if not event_id or stored == fingerprint:
+                continue
+            if not stored:
+                # Synced before the Fingerprint column was added: changes from now on
+                # will be detected
+                plan(
+                    {
+                        "action": "fingerprint",
+                        "month": month,
+                        "row": y,
+                        "calendar": None,
+                        "event_id": event_id,
+                        "summary": summary,
+                        "fingerprint": fingerprint,
+                        "date": date,
+                        "project": project,
+                    },
+                    row,
+                )
+                continue
+            calendar = calendars.get(project)
+            if not calendar:
+                click.echo(
+                    Back.YELLOW
+                    + Fore.BLACK
+                    + f'Cannot find a calendar id associated to project "{project}" at line {y+2}'
+                    + Style.RESET_ALL
+                )
+                warn_lines.append(y)
+                continue
+            plan(
+                {
+                    "action": "update",
+                    "month": month,
+                    "row": y,
+                    "calendar": calendar,
+                    "source": calendars.get((stored or "").partition(":")[2], calendar),
+                    "event_id": event_id,
+                    "body": body,
+                    "summary": summary,
+                    "length": length,
+                    "fingerprint": fingerprint,
+                    "date": date,
+                    "project": project,
+                },
+                row,
+            )
             continue
 
         calendar = None
@@ -120,38 +785,19 @@ def sync_events(
             continue
 
         if action == actions.DELETE:
-            delete_event(
-                config_dir=config_dir,
-                calendar=calendar,
-                event_id=get_col(row, headers_id["Event id"]),
-            )
-            click.echo(
-                f'Deleted event "{get_col(row, headers_id["Activity"])}" in date {date.strftime("%d/%m")} from calendar {project}'
-            )
-            request = sheet.values().batchClear(
-                spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"),
-                body={
-                    "ranges": [
-                        f"{month}!{headers['Event id']}{y + 2}",
-                        f"{month}!{headers['Link']}{y + 2}",
-                        f"{month}!{headers['Action']}{y + 2}",
-                    ],
+            plan(
+                {
+                    "action": "delete",
+                    "month": month,
+                    "row": y,
+                    "calendar": calendar,
+                    "event_id": get_col(row, headers_id["Event id"]) or None,
+                    "summary": get_col(row, headers_id["Activity"]),
+                    "date": date,
+                    "project": project,
                 },
+                row,
             )
-
-            try:
-                request.execute()
-            except HttpError as err:
-                if err.status_code == 429:
-                    click.echo("Too many requests")
-                    click.echo(err.error_details)
-                    click.echo("haunts will now pause for a while ⏲…")
-                    time.sleep(60)
-                    click.echo("Retrying…")
-                    request.execute()
-                else:
-                    raise
-
             continue
 
         if action:
@@ -165,53 +811,268 @@ def sync_events(
             warn_lines.append(y)
             continue
 
-        event = create_event(
-            config_dir=config_dir,
-            calendar=calendar,
-            date=date,
-            summary=get_col(row, headers_id["Activity"]),
-            details=get_col(row, headers_id["Details"]),
-            length=get_col(row, headers_id["Spent"]),
-            from_time=default_start_time or last_to_time,
+        if busy is not None and isinstance(length, numbers.Number):
+            from_time = from_time or get("START_TIME", "09:00")
+            start = to_minutes(from_time)
+            if not default_start_time:
+                start = busy.first_free(date.date(), start, round(length * 60))
+                if start is None:
+                    click.echo(
+                        Back.YELLOW
+                        + Fore.BLACK
+                        + f"No free slot found for the event at line {y + 2}"
+                        + Style.RESET_ALL
+                    )
+                    warn_lines.append(y)
+                    start = to_minutes(from_time)
+                from_time = f"{start // 60:02d}:{start % 60:02d}"
+            busy.add(date.date(), start, min(start + round(length * 60), 24 * 60))
+
+        # Start and end times only depend on sheet data, so the next slot is known
+        # before the event is actually created
+        body, last_to_time = build_event(
+            date, summary, details, length, from_time, month
         )
-        last_to_time = event["next_slot"]
+        if busy is not None and "date" in body["start"]:
+            # Created as free, otherwise the whole day would be busy for next syncs
+            # using free slots
+            body["transparency"] = "transparent"
+        operation = {
+            "action": "create",
+            "month": month,
+            "row": y,
+            "calendar": calendar,
+            "body": body,
+            "summary": summary,
+            "length": length,
+            "fingerprint": fingerprint,
+            "date": date,
+            "project": project,
+        }
+        if journaled:
+            body["id"] = operation["event_id"] = new_event_id()
+        plan(operation, row)
+    metrics.count("rows", y + 1)
+    return operations, warn_lines
 
-        request = sheet.values().batchUpdate(
-            spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"),
-            body={
-                "valueInputOption": "USER_ENTERED",
-                "data": [
-                    # Put the action to actions.IGNORE, in this way it will not be processed again
-                    {
-                        "range": f"{month}!{headers['Action']}{y + 2}",
-                        "values": [[actions.IGNORE]],
-                    },
-                    # Save the event id, required to interact with the event in future
-                    {
-                        "range": f"{month}!{headers['Event id']}{y + 2}",
-                        "values": [[event["id"]]],
-                    },
-                    # Quick link to the event on the calendar
-                    {
-                        "range": f"{month}!{headers['Link']}{y + 2}",
-                        "values": [[f"=HYPERLINK(\"{event['link']}\";\"open\")"]],
-                    },
-                ],
-            },
+
+def apply_plan(
+    config_dir, operations, schemas, writer, batch=False, workers=1, journal=None
+):
+    """Execute planned operations, and write results back to the sheets.
+
+    Operations are executed in chunks of APPLY_CHUNK_SIZE, using batch requests when batch
+    is True and concurrently (one calendar per worker) when more than one worker is used.
+    Results of every chunk are written back (see SheetWriter), so long runs are
+    periodically saved. schemas are the SheetSchema of every month of the operations.
+    When a journal is provided, operations are recorded before being sent, together with
+    their results.
+    Return rows with errors, as (month, row) tuples.
+    """
+    errors = []
+    # Threads (and their service clients) are kept for the whole plan
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for start in range(0, len(operations), APPLY_CHUNK_SIZE):
+            chunk = []
+            for operation in operations[start : start + APPLY_CHUNK_SIZE]:
+                letters = schemas[operation["month"]].letters
+                if operation["action"] == "fingerprint":
+                    store_fingerprint(
+                        writer,
+                        operation["month"],
+                        letters,
+                        operation["row"],
+                        operation["fingerprint"],
+                    )
+                    continue
+                if operation["action"] == "delete" and not operation["event_id"]:
+                    click.echo("Missing id. Skipping…")
+                    clear_deleted(writer, operation["month"], letters, operation)
+                    continue
+                if journal:
+                    journal.planned(
+                        operation["month"],
+                        operation,
+                        operation.get("check"),
+                        sync=False,
+                    )
+                chunk.append(operation)
+            if not chunk:
+                continue
+            if journal:
+                journal.sync()
+            with metrics.span("calendar operations", operations=len(chunk)):
+                if workers > 1:
+                    results = parallel_events(
+                        config_dir, chunk, workers, batch=batch, executor=executor
+                    )
+                else:
+                    results = run_events(config_dir, chunk, batch=batch)
+            for operation, response, error in results:
+                month = operation["month"]
+                y = operation["row"]
+                letters = schemas[month].letters
+                if (
+                    getattr(error, "status_code", None) == 409
+                    and operation["action"] == "create"
+                    and operation.get("event_id")
+                ):
+                    # The event id is already used: the event was created by a
+                    # previous attempt, whose response was lost
+                    event = find_event(
+                        config_dir, operation["calendar"], operation["event_id"]
+                    )
+                    if event:
+                        response, error = event, None
+                if error:
+                    click.echo(
+                        Back.RED
+                        + f"Cannot {operation['action']} event at line {y + 2}: {error}"
+                        + Style.RESET_ALL
+                    )
+                    errors.append((month, y))
+                    continue
+                if journal:
+                    event = response and {
+                        "id": response["id"],
+                        "link": response["htmlLink"],
+                    }
+                    journal.done(month, operation, event, sync=False)
+                if operation["action"] == "delete":
+                    clear_deleted(writer, month, letters, operation)
+                    continue
+                echo_created(
+                    response,
+                    operation["summary"],
+                    operation["length"],
+                    verb="Updated" if operation["action"] == "update" else "Created",
+                )
+                store_created(
+                    writer,
+                    month,
+                    letters,
+                    y,
+                    {"id": response["id"], "link": response["htmlLink"]},
+                    operation["fingerprint"],
+                )
+    finally:
+        if executor:
+            executor.shutdown()
+    return errors
+
+
+def estimate_plan(operations, schemas, batch=False, workers=1):
+    """Estimate requests needed to apply a plan.
+
+    Return a dict with the number of operations by action, calendar API calls (every
+    operation of a batch counts against the quota), HTTP requests to the Calendar API, and
+    cells and requests to write back to the sheets.
+    """
+    counts = {"create": 0, "update": 0, "delete": 0, "fingerprint": 0}
+    cleared_only = 0
+    moves = 0
+    sent = []
+    updates = 0
+    clears = 0
+    for operation in operations:
+        counts[operation["action"]] += 1
+        extra = "Fingerprint" in schemas[operation["month"]].indexes
+        if operation["action"] == "fingerprint":
+            updates += 1
+            continue
+        if operation["action"] == "delete":
+            clears += 3 + extra
+            if not operation["event_id"]:
+                cleared_only += 1
+                continue
+        else:
+            updates += 3 + extra
+        if operation.get("source") and operation["source"] != operation["calendar"]:
+            moves += 1
+        sent.append(operation)
+
+    if batch:
+        # Batches are sent by chunk, and by calendar when using more than one worker
+        requests = 0
+        for start in range(0, len(sent), APPLY_CHUNK_SIZE):
+            chunk = sent[start : start + APPLY_CHUNK_SIZE]
+            groups = {}
+            for operation in chunk:
+                key = operation["calendar"] if workers > 1 else None
+                groups[key] = groups.get(key, 0) + 1
+            requests += sum(math.ceil(n / BATCH_SIZE) for n in groups.values())
+        requests += moves
+    else:
+        requests = len(sent) + moves
+    return {
+        **counts,
+        "cleared_only": cleared_only,
+        "calendar_calls": len(sent) + moves,
+        "calendar_requests": requests,
+        "sheet_cells": updates + clears,
+        "sheet_requests": math.ceil(updates / WRITEBACK_BATCH_SIZE)
+        + math.ceil(clears / WRITEBACK_BATCH_SIZE),
+    }
+
+
+def serialize_operation(operation):
+    """Convert an operation to a JSON serializable dict."""
+    return {
+        **operation,
+        "date": operation["date"].date().isoformat(),
+    }
+
+
+def print_plan(operations, schemas, batch=False, workers=1, output_format="table"):
+    """Print planned operations, with an estimate of the requests needed to apply them.
+
+    With the "jsonl" format, every operation is printed as a JSON object, on its own line.
+    """
+    if output_format == "jsonl":
+        for operation in operations:
+            click.echo(json.dumps(serialize_operation(operation)))
+        return
+    for operation in operations:
+        echo_planned(operation)
+    estimate = estimate_plan(operations, schemas, batch=batch, workers=workers)
+    calendar_quota = int(get("CALENDAR_QUOTA", 600))
+    sheets_quota = int(get("SHEETS_QUOTA", 60))
+    minutes = max(
+        estimate["calendar_calls"] / calendar_quota,
+        estimate["sheet_requests"] / sheets_quota,
+    )
+    click.echo("")
+    click.echo(
+        f'Plan: {estimate["create"]} events to create, {estimate["update"]} to update, '
+        f'{estimate["delete"]} to delete'
+        + (
+            f', {estimate["cleared_only"]} without event (only cleared)'
+            if estimate["cleared_only"]
+            else ""
         )
+        + (
+            f', {estimate["fingerprint"]} fingerprints to save'
+            if estimate["fingerprint"]
+            else ""
+        )
+    )
+    click.echo(
+        f'Calendar API: {estimate["calendar_calls"]} calls '
+        f'in {estimate["calendar_requests"]} HTTP requests'
+        + (" using batch requests" if batch else "")
+    )
+    click.echo(
+        f'Sheets API: {estimate["sheet_cells"]} cells written back '
+        f'in {estimate["sheet_requests"]} requests (at least)'
+    )
+    click.echo(
+        f"Quota: {minutes:.0%} of the quota of a minute "
+        f"({calendar_quota} calendar calls, {sheets_quota} sheets requests)"
+    )
 
-        try:
-            request.execute()
-        except HttpError as err:
-            if err.status_code == 429:
-                click.echo("Too many requests")
-                click.echo(err.error_details)
-                click.echo("haunts will now pause for a while ⏲…")
-                time.sleep(60)
-                click.echo("Retrying…")
-                request.execute()
-            else:
-                raise
+
+def echo_done(warn_lines):
     click.echo("Done!")
 
     if warn_lines:
@@ -224,30 +1085,159 @@ def sync_events(
         )
 
 
-def get_calendars(sheet):
-    RANGE = f"{get('CONTROLLER_SHEET_NAME', 'config')}!A2:B"
-    calendars = (
-        sheet.values()
-        .get(spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"), range=RANGE)
-        .execute()
+def get_calendars(sheet, config_dir=None):
+    """Map project names to calendar ids, as defined in the configuration sheet.
+
+    When config_dir is provided, the local cache is used when enabled (see cache).
+    """
+    name = get("CONTROLLER_SHEET_NAME", "config")
+    if config_dir:
+        return cache.cached(
+            config_dir, f"{name}:calendars", lambda: get_calendars(sheet)
+        )
+    RANGE = f"{name}!A2:B"
+    calendars = execute(
+        sheet.values().get(
+            spreadsheetId=get("CONTROLLER_SHEET_DOCUMENT_ID"),
+            range=RANGE,
+            fields="values",
+        )
     )
     values = calendars.get("values", [])
     return {alias: id for [id, alias] in values}
 
 
-def sync_report(config_dir, month, days=[], projects=[], allowed_actions=[]):
-    """Open a sheet, analyze it and populate calendars with new events."""
-    # The ID and range of the controller timesheet
-    creds = get_credentials(config_dir, SCOPES, "sheets-token.json")
-    service = build("sheets", "v4", credentials=creds)
+def replay_journal(config_dir, records, months, sheets, writer):
+    """Write back results of operations done by an interrupted run (see journal).
+
+    Events planned to be created, but without a result, are searched on calendars by id:
+    when found they are written back too.
+    Return rows to be skipped for every month, as sets of 0-based indexes of data rows.
+    Rows changed since the interrupted run (or moved) are not written back, and are processed
+    again.
+    """
+    done, planned = pending_operations(records)
+    for key, record in planned.items():
+        if record["action"] != "create" or not record["event_id"]:
+            continue
+        event = find_event(config_dir, record["calendar"], record["event_id"])
+        if event:
+            done[key] = {
+                **record,
+                "event": {"id": event["id"], "link": event["htmlLink"]},
+            }
+
+    skip = {month: set() for month in months}
+    for month, (schema, data) in zip(months, sheets):
+        data["values"] = list(data["values"])
+        for (record_month, y), record in sorted(done.items()):
+            if record_month != month:
+                continue
+            row = get_col(data["values"], y)
+            if row is None or row_fingerprint(schema.indexes, row) != record["check"]:
+                event = record["event"]
+                click.echo(
+                    Back.YELLOW
+                    + Fore.BLACK
+                    + f'Row at line {y + 2} of "{month}" changed since the interrupted run'
+                    + (f': event {event["id"]} must be checked' if event else "")
+                    + Style.RESET_ALL
+                )
+                continue
+            if record["action"] == "delete":
+                operation = {
+                    **record,
+                    "date": datetime.date.fromisoformat(record["date"]),
+                }
+                clear_deleted(writer, month, schema.letters, operation)
+            else:
+                click.echo(
+                    f'Saved event "{record["summary"]}" at line {y + 2} of "{month}"'
+                )
+                store_created(
+                    writer,
+                    month,
+                    schema.letters,
+                    y,
+                    record["event"],
+                    record["fingerprint"],
+                )
+            skip[month].add(y)
+    writer.flush()
+    return skip
+
+
+def exit_if_interrupted(config_dir):
+    """Stop when an interrupted sync must be completed first (see journal)."""
+    if journal_path(config_dir).exists():
+        click.echo(
+            Back.RED
+            + "An interrupted synchronization was found: use --resume to complete it."
+            + Style.RESET_ALL
+        )
+        sys.exit(1)
+
+
+def sync_report(
+    config_dir,
+    months,
+    days=[],
+    projects=[],
+    allowed_actions=[],
+    batch=False,
+    workers=1,
+    date_from=None,
+    date_to=None,
+    dry_run=False,
+    source=None,
+    free_slots=False,
+    resume=False,
+    plan=False,
+    output_format="table",
+):
+    """Open one or more sheets, analyze them and populate calendars with new events.
+
+    All sheets are read with a single request, and changes are saved to the spreadsheet
+    together at the end.
+    When filtering by days, only rows of selected days are read.
+    Operations of all sheets are planned first, then applied at once (see plan_events and
+    apply_plan).
+    When dry_run is True, nothing is changed: operations are just displayed. When plan is
+    True, nothing is changed either, and the plan is printed with an estimate of needed
+    requests (see print_plan).
+    Sheets can be read from a local file (source), but only for a dry run or a plan.
+    When free_slots is True, busy times of all calendars are read with a single query, and
+    new events are placed in free slots.
+    Operations are recorded in a journal, removed when the sync completes. An interrupted
+    sync must be completed with resume=True, using sheets and filters of that run: results
+    not saved to the spreadsheet are written back, then remaining rows are synced.
+    """
+    if source:
+        return sync_local(
+            config_dir,
+            source,
+            months,
+            days=days,
+            projects=projects,
+            allowed_actions=allowed_actions,
+            date_from=date_from,
+            date_to=date_to,
+            free_slots=free_slots,
+            plan=plan,
+            output_format=output_format,
+        )
 
     # Call the Sheets API
-    sheet = service.spreadsheets()
+    dry_run = dry_run or plan
+    sheet = get_service(config_dir).spreadsheets()
 
-    click.echo("Started calendars synchronization")
+    if dry_run:
+        click.echo("Started calendars synchronization (dry run)", err=plan)
+    else:
+        click.echo("Started calendars synchronization")
 
     try:
-        document_id = get("CONTROLLER_SHEET_DOCUMENT_ID")
+        get("CONTROLLER_SHEET_DOCUMENT_ID")
     except KeyError:
         click.echo(
             "A value for CONTROLLER_SHEET_DOCUMENT_ID is required but "
@@ -255,31 +1245,235 @@ def sync_report(config_dir, month, days=[], projects=[], allowed_actions=[]):
         )
         sys.exit(1)
 
+    records = None
+    if resume:
+        records = load_journal(config_dir)
+        if records is None:
+            click.echo("No interrupted synchronization to resume.")
+            return
+        run = records[0]
+        months = run["months"]
+        days = run["days"]
+        projects = run["projects"]
+        allowed_actions = run["allowed_actions"]
+        batch = run["batch"]
+        workers = run["workers"]
+        date_from = run["date_from"]
+        date_to = run["date_to"]
+        free_slots = run["free_slots"]
+        click.echo(f'Resuming synchronization of {", ".join(months)}')
+    elif not dry_run:
+        exit_if_interrupted(config_dir)
+
+    if isinstance(months, str):
+        months = [months]
     try:
-        data = (
-            sheet.values()
-            .get(
-                spreadsheetId=document_id,
-                range=f"{month}!A2:ZZ",
-                valueRenderOption="UNFORMATTED_VALUE",
-            )
-            .execute()
-        )
-    except HttpError as err:
+        with metrics.span("read sheets"):
+            months = expand_sheets(sheet, months)
+            selection = DateSelection(days, date_from, date_to)
+            if selection:
+                sheets = read_sheets_by_date(sheet, months, selection)
+            else:
+                sheets = read_sheets(sheet, months)
+    except (HttpError, ValueError) as err:
         click.echo(
-            Back.RED + f'Sheet "{month}" not found or not accessible.' + Style.RESET_ALL
+            Back.RED
+            + f'Sheet "{", ".join(months)}" not found or not accessible.'
+            + Style.RESET_ALL
         )
-        click.echo(err.error_details)
+        click.echo(getattr(err, "error_details", err))
         sys.exit(1)
 
-    calendars = get_calendars(sheet)
-    sync_events(
+    sync_sheets(
         config_dir,
         sheet,
-        data,
-        calendars,
+        months,
+        sheets,
         days=days,
-        month=month,
         projects=projects,
         allowed_actions=allowed_actions,
+        batch=batch,
+        workers=workers,
+        date_from=date_from,
+        date_to=date_to,
+        dry_run=dry_run,
+        free_slots=free_slots,
+        records=records,
+        plan=plan,
+        output_format=output_format,
     )
+
+
+def sync_sheets(
+    config_dir,
+    sheet,
+    months,
+    sheets,
+    days=[],
+    projects=[],
+    allowed_actions=[],
+    batch=False,
+    workers=1,
+    date_from=None,
+    date_to=None,
+    dry_run=False,
+    free_slots=False,
+    records=None,
+    plan=False,
+    output_format="table",
+):
+    """Sync sheets already read (see sync_report).
+
+    When records of an interrupted run are provided (see journal), its results are written
+    back first, and the journal is kept until all rows are synced.
+    Return rows with errors, as (month, row) tuples (see apply_plan).
+    """
+    selection = DateSelection(days, date_from, date_to)
+    with metrics.span("read calendars"):
+        calendars = get_calendars(sheet, config_dir)
+    busy = None
+    if free_slots:
+        with metrics.span("free/busy"):
+            busy = busy_index(config_dir, sheets, calendars, selection)
+    journal = None
+    if not dry_run:
+        journal = Journal(
+            config_dir,
+            run=None
+            if records
+            else {
+                "months": months,
+                "days": [as_date(d).isoformat() for d in days],
+                "projects": list(projects),
+                "allowed_actions": list(allowed_actions),
+                "batch": batch,
+                "workers": workers,
+                "date_from": date_from and as_date(date_from).isoformat(),
+                "date_to": date_to and as_date(date_to).isoformat(),
+                "free_slots": free_slots,
+            },
+        )
+    # Kept on disk when the sync doesn't complete, to resume it
+    completed = False
+    try:
+        writer = SheetWriter(sheet, dry_run=dry_run, journal=journal)
+        skip = {}
+        if records:
+            skip = replay_journal(config_dir, records, months, sheets, writer)
+        errors = []
+        try:
+            operations = []
+            warn_lines = []
+            schemas = {}
+            for month, (schema, data) in zip(months, sheets):
+                schemas[month] = schema
+                with metrics.span(f"plan {month}"):
+                    planned, warnings = plan_events(
+                        data,
+                        calendars,
+                        schema,
+                        month=month,
+                        days=days,
+                        projects=projects,
+                        allowed_actions=allowed_actions,
+                        date_from=date_from,
+                        date_to=date_to,
+                        busy=busy,
+                        journaled=journal is not None,
+                        skip=skip.get(month, ()),
+                    )
+                operations.extend(planned)
+                warn_lines.extend(warnings)
+            if plan:
+                print_plan(operations, schemas, batch, workers, output_format)
+                return errors
+            if dry_run:
+                for operation in operations:
+                    echo_planned(operation)
+            else:
+                errors = apply_plan(
+                    config_dir,
+                    operations,
+                    schemas,
+                    writer,
+                    batch=batch,
+                    workers=workers,
+                    journal=journal,
+                )
+                warn_lines.extend(errors)
+        finally:
+            writer.flush()
+        # Everything is saved: nothing to resume
+        completed = True
+    finally:
+        if journal:
+            journal.close(remove=completed)
+    echo_done(warn_lines)
+    return errors
+
+
+def sync_local(
+    config_dir,
+    source,
+    months,
+    days=[],
+    projects=[],
+    allowed_actions=[],
+    date_from=None,
+    date_to=None,
+    free_slots=False,
+    plan=False,
+    output_format="table",
+):
+    """Dry run of a sync, reading sheets from a local file.
+
+    When plan is True, the plan is printed with an estimate of needed requests (see
+    print_plan).
+    Projects are read from the configuration sheet of the file; when not available (like
+    for CSV files) they are read from the spreadsheet.
+    """
+    from .sources import read_local_calendars, read_local_sheets
+
+    click.echo("Started calendars synchronization (dry run)", err=plan)
+    calendars = read_local_calendars(source)
+    if calendars is None:
+        calendars = get_calendars(get_service(config_dir).spreadsheets(), config_dir)
+    try:
+        sheets = read_local_sheets(source, months or [None])
+    except KeyError as err:
+        click.echo(
+            Back.RED + f'Sheet "{err.args[0]}" not found in {source}.' + Style.RESET_ALL
+        )
+        sys.exit(1)
+    except ValueError as err:
+        click.echo(Back.RED + f"Cannot read {source}: {err}" + Style.RESET_ALL)
+        sys.exit(1)
+    busy = None
+    if free_slots:
+        selection = DateSelection(days, date_from, date_to)
+        busy = busy_index(config_dir, sheets, calendars, selection)
+    operations = []
+    warn_lines = []
+    schemas = {}
+    for month, (schema, data) in zip(months or [None], sheets):
+        schemas[month] = schema
+        planned, warnings = plan_events(
+            data,
+            calendars,
+            schema,
+            month=month,
+            days=days,
+            projects=projects,
+            allowed_actions=allowed_actions,
+            date_from=date_from,
+            date_to=date_to,
+            busy=busy,
+        )
+        operations.extend(planned)
+        warn_lines.extend(warnings)
+    if plan:
+        print_plan(operations, schemas, output_format=output_format)
+        return
+    for operation in operations:
+        echo_planned(operation)
+    echo_done(warn_lines)
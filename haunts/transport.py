@@ -0,0 +1,52 @@
+"""HTTP transport shared by Google API clients"""
+
+import threading
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+
+from . import metrics
+from .ini import get
+
+# Google APIs only compress responses when the user agent contains "gzip"
+USER_AGENT = "haunts (gzip)"
+
+local = threading.local()
+
+
+def gzip_requests(http):
+    """Ask for gzip compressed responses on every request, batch requests included.
+
+    Requests and bytes sent and received (after decompression) are counted (see metrics).
+    """
+    request = http.request
+
+    def gzip_request(uri, method="GET", body=None, headers=None, **kwargs):
+        headers = dict(headers or {})
+        agent = headers.get("user-agent", "")
+        if "gzip" not in agent:
+            headers["user-agent"] = f"{USER_AGENT} {agent}".strip()
+        headers.setdefault("accept-encoding", "gzip, deflate")
+        response, content = request(uri, method, body=body, headers=headers, **kwargs)
+        metrics.count("http requests")
+        metrics.count("bytes sent", len(body or ""))
+        metrics.count("bytes received", len(content or b""))
+        return response, content
+
+    http.request = gzip_request
+    return http
+
+
+def get_http(credentials):
+    """Return an authorized HTTP client, for the current thread.
+
+    All clients of a thread share the same connections, which are kept alive between
+    requests to every Google API. HTTP connections are not thread safe, so every thread
+    has its own.
+    Requests time out after HTTP_TIMEOUT seconds.
+    """
+    http = getattr(local, "http", None)
+    if http is None:
+        http = gzip_requests(httplib2.Http(timeout=float(get("HTTP_TIMEOUT", 60))))
+        local.http = http
+    return AuthorizedHttp(credentials, http=http)
@@ -0,0 +1,200 @@
+"""Watch mode: sync sheets again every time the spreadsheet changes."""
+
+import datetime
+import hashlib
+import json
+import sys
+import time
+
+import click
+import httplib2
+from colorama import Back, Style
+from google.auth.exceptions import GoogleAuthError
+from googleapiclient.errors import HttpError
+
+from . import metrics
+from .cache import get_revision
+from .ini import get
+from .journal import load_journal
+from .retry import BACKOFF_MAX
+from .spreadsheet import (
+    DateSelection,
+    exit_if_interrupted,
+    expand_sheets,
+    get_service,
+    read_sheets,
+    read_sheets_by_date,
+    sync_sheets,
+)
+
+
+def sheet_digest(data):
+    return hashlib.sha1(json.dumps(data["values"]).encode("utf-8")).hexdigest()
+
+
+def read_changed(sheet, months, selection, digests, resume=False):
+    """Read sheets, and find the ones changed since digests were taken.
+
+    Return changed sheets as (month, (schema, data)) tuples, and digests of all sheets.
+    When resuming an interrupted sync, all sheets are returned.
+    """
+    with metrics.span("read sheets"):
+        if selection:
+            sheets = read_sheets_by_date(sheet, months, selection)
+        else:
+            sheets = read_sheets(sheet, months)
+    changed = []
+    current_digests = {}
+    for month, (schema, data) in zip(months, sheets):
+        data["values"] = list(data["values"])
+        current_digests[month] = sheet_digest(data)
+        if resume or digests.get(month) != current_digests[month]:
+            changed.append((month, (schema, data)))
+    return changed, current_digests
+
+
+def read_after_sync(config_dir, sheet, months, selection, revision, digests):
+    """Take revision and digests again after a sync wrote its results to the sheets.
+
+    Return them, or the ones before the sync when the spreadsheet was changed while
+    reading, so those changes are checked at the next poll.
+    """
+    document_id = get("CONTROLLER_SHEET_DOCUMENT_ID")
+    synced_revision = get_revision(config_dir, document_id, refresh=True)
+    if synced_revision == revision:
+        # Nothing written back
+        return revision, digests
+    _, synced_digests = read_changed(sheet, months, selection, {})
+    if get_revision(config_dir, document_id, refresh=True) != synced_revision:
+        return revision, digests
+    return synced_revision, synced_digests
+
+
+def poll_delay(interval, failures):
+    """Seconds to wait before the next poll, doubled after every consecutive failure."""
+    return min(interval * 2 ** min(failures, 16), max(interval, BACKOFF_MAX))
+
+
+def echo_status(message):
+    click.echo(f"[{datetime.datetime.now():%H:%M:%S}] {message}")
+
+
+def watch(
+    config_dir,
+    months,
+    days=[],
+    projects=[],
+    allowed_actions=[],
+    batch=False,
+    workers=1,
+    date_from=None,
+    date_to=None,
+    dry_run=False,
+    free_slots=False,
+):
+    """Sync sheets, then sync them again every time the spreadsheet changes, until stopped.
+
+    Every WATCH_INTERVAL seconds the revision of the spreadsheet is read with a single
+    Google Drive metadata request: sheets are read again only when it changes, and only
+    sheets with changed values are synced. Credentials and service clients are kept for
+    the whole run.
+    When a sync fails, it's tried again at the next poll, resuming it (see journal); rows
+    that failed are synced again at the next poll too. After failures, polls are less
+    frequent (see poll_delay).
+    """
+    interval = float(get("WATCH_INTERVAL", 10))
+    document_id = get("CONTROLLER_SHEET_DOCUMENT_ID")
+    sheet = get_service(config_dir).spreadsheets()
+    if not dry_run:
+        exit_if_interrupted(config_dir)
+
+    if isinstance(months, str):
+        months = [months]
+    try:
+        months = expand_sheets(sheet, months)
+    except (HttpError, ValueError) as err:
+        click.echo(
+            Back.RED
+            + f'Sheet "{", ".join(months)}" not found or not accessible.'
+            + Style.RESET_ALL
+        )
+        click.echo(getattr(err, "error_details", err))
+        sys.exit(1)
+    selection = DateSelection(days, date_from, date_to)
+
+    click.echo(
+        f'Watching {", ".join(months)} every {interval:g} seconds'
+        + (" (dry run)" if dry_run else "")
+        + ". Press CTRL+C to stop."
+    )
+    revision = None
+    # Digest of the values of every sheet, when last synced
+    digests = {}
+    # Consecutive polls that failed
+    failures = 0
+    try:
+        while True:
+            errors = []
+            try:
+                with metrics.span("poll"):
+                    current = get_revision(config_dir, document_id, refresh=True)
+                if current != revision:
+                    records = None if dry_run else load_journal(config_dir)
+                    changed, current_digests = read_changed(
+                        sheet, months, selection, digests, resume=bool(records)
+                    )
+                    if changed:
+                        echo_status(
+                            f'Syncing {", ".join(month for month, _ in changed)}'
+                        )
+                        errors = sync_sheets(
+                            config_dir,
+                            sheet,
+                            [month for month, _ in changed],
+                            [sheet_data for _, sheet_data in changed],
+                            days=days,
+                            projects=projects,
+                            allowed_actions=allowed_actions,
+                            batch=batch,
+                            workers=workers,
+                            date_from=date_from,
+                            date_to=date_to,
+                            dry_run=dry_run,
+                            free_slots=free_slots,
+                            records=records,
+                        )
+                        if not dry_run:
+                            current, current_digests = read_after_sync(
+                                config_dir,
+                                sheet,
+                                months,
+                                selection,
+                                current,
+                                current_digests,
+                            )
+                        if errors:
+                            echo_status(
+                                Back.RED
+                                + f"{len(errors)} rows failed, they will be synced again"
+                                + Style.RESET_ALL
+                            )
+                            # Sheets with failed rows are read and synced again
+                            for month, _ in errors:
+                                current_digests.pop(month, None)
+                            current = None
+                    digests = current_digests
+                    revision = current
+                failures = failures + 1 if errors else 0
+            except (HttpError, OSError, httplib2.HttpLib2Error, GoogleAuthError) as err:
+                # Network and authorization errors can be temporary: the sync is tried
+                # again at the next poll, also when the spreadsheet is not changed
+                revision = None
+                failures += 1
+                echo_status(
+                    Back.RED
+                    + f"Sync failed: {getattr(err, 'error_details', None) or err}"
+                    + Style.RESET_ALL
+                )
+            time.sleep(poll_delay(interval, failures))
+    except KeyboardInterrupt:
+        click.echo("Stopped watching.")
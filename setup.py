@@ -13,7 +13,7 @@ requirements = [
     "Click>=7.0",
     "colorama",
     "python-dateutil",
-    "google-api-python-client",
+    "google-api-python-client>=2.0",
     "google-auth-httplib2",
     "google-auth-oauthlib",
     "google-auth<2dev",
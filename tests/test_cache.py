@@ -0,0 +1,84 @@
+"""Tests for `haunts.cache`."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from haunts import cache, ini
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.config_dir = Path(tempfile.mkdtemp())
+        ini.parser.read_dict(
+            {
+                "haunts": {
+                    "CONTROLLER_SHEET_DOCUMENT_ID": "doc",
+                    "CACHE_TTL": "60",
+                    "CACHE_MAX_SIZE": "50",
+                }
+            }
+        )
+        # Revision of the spreadsheet for this run, without asking Google Drive
+        cache.revisions["doc"] = "1"
+        self.reads = 0
+
+    def tearDown(self):
+        cache.revisions.pop("doc", None)
+        ini.parser.set("haunts", "CACHE_TTL", "0")
+        shutil.rmtree(self.config_dir)
+
+    def read(self):
+        self.reads += 1
+        return {"values": [[44682, 2, "P"]], "read": self.reads}
+
+    def test_cached_until_revision_changes(self):
+        self.assertEqual(cache.cached(self.config_dir, "May", self.read)["read"], 1)
+        self.assertEqual(cache.cached(self.config_dir, "May", self.read)["read"], 1)
+        self.assertEqual(cache.cached(self.config_dir, "June", self.read)["read"], 2)
+        cache.revisions["doc"] = "2"
+        self.assertEqual(cache.cached(self.config_dir, "May", self.read)["read"], 3)
+        self.assertEqual(cache.cached(self.config_dir, "May", self.read)["read"], 3)
+
+    def test_expired(self):
+        cache.cached(self.config_dir, "May", self.read)
+        later = time.time() + 120
+        with mock.patch.object(cache.time, "time", return_value=later):
+            self.assertIsNone(cache.load(self.config_dir, "May"))
+            self.assertEqual(cache.cached(self.config_dir, "May", self.read)["read"], 2)
+
+    def test_disabled(self):
+        ini.parser.set("haunts", "CACHE_TTL", "0")
+        cache.cached(self.config_dir, "May", self.read)
+        cache.cached(self.config_dir, "May", self.read)
+        self.assertEqual(self.reads, 2)
+        self.assertFalse((self.config_dir / "cache").exists())
+
+    def test_evict_oldest(self):
+        # About 2 KB for each entry, and up to 5 KB of cache
+        ini.parser.set("haunts", "CACHE_MAX_SIZE", str(5 / 1024))
+        for n, month in enumerate(["Jan", "Feb", "Mar"]):
+            cache.store(self.config_dir, month, "x" * 2000)
+            path = cache.entry_path(self.config_dir, "doc", month)
+            # Older entries were written before
+            os.utime(path, (time.time() - 30 + n, time.time() - 30 + n))
+        cache.store(self.config_dir, "Apr", "x" * 2000)
+        self.assertEqual(
+            [
+                cache.entry_path(self.config_dir, "doc", month).exists()
+                for month in ["Jan", "Feb", "Mar", "Apr"]
+            ],
+            [False, False, True, True],
+        )
+
+    def test_evict_expired(self):
+        cache.store(self.config_dir, "Jan", "x")
+        path = cache.entry_path(self.config_dir, "doc", "Jan")
+        os.utime(path, (time.time() - 120, time.time() - 120))
+        cache.store(self.config_dir, "Feb", "x")
+        self.assertFalse(path.exists())
+        self.assertTrue(cache.entry_path(self.config_dir, "doc", "Feb").exists())
@@ -0,0 +1,47 @@
+"""Tests for busy times of `haunts.calendars`."""
+
+import datetime
+import unittest
+
+from haunts.calendars import BusyIndex
+
+DAY = datetime.date(2022, 5, 2)
+
+
+class TestBusyIndex(unittest.TestCase):
+    def test_merge(self):
+        index = BusyIndex()
+        index.add(DAY, 600, 660)
+        index.add(DAY, 540, 570)
+        index.add(DAY, 720, 780)
+        self.assertEqual(index.days[DAY], ([540, 600, 720], [570, 660, 780]))
+        # Touching slots are merged, and a slot covering others replaces them
+        index.add(DAY, 570, 600)
+        self.assertEqual(index.days[DAY], ([540, 720], [660, 780]))
+        index.add(DAY, 500, 800)
+        self.assertEqual(index.days[DAY], ([500], [800]))
+        index.add(DAY, 900, 900)
+        self.assertEqual(index.days[DAY], ([500], [800]))
+
+    def test_add_event_across_midnight(self):
+        timezone = datetime.timezone.utc
+        index = BusyIndex()
+        index.add_event(
+            datetime.datetime(2022, 5, 1, 22, 0, tzinfo=timezone),
+            datetime.datetime(2022, 5, 2, 1, 30, tzinfo=timezone),
+        )
+        self.assertEqual(index.days[DAY - datetime.timedelta(days=1)], ([1320], [1440]))
+        self.assertEqual(index.days[DAY], ([0], [90]))
+
+    def test_first_free(self):
+        index = BusyIndex()
+        index.add(DAY, 540, 600)
+        index.add(DAY, 630, 720)
+        self.assertEqual(index.first_free(DAY, 540, 30), 600)
+        self.assertEqual(index.first_free(DAY, 540, 60), 720)
+        self.assertEqual(index.first_free(DAY, 480, 60), 480)
+        self.assertEqual(index.first_free(DAY, 480, 90), 720)
+        self.assertEqual(
+            index.first_free(DAY + datetime.timedelta(days=1), 540, 60), 540
+        )
+        self.assertIsNone(index.first_free(DAY, 1400, 60))
@@ -0,0 +1,96 @@
+"""Tests for `haunts.credentials`."""
+
+import datetime
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from haunts import credentials
+
+SCOPES = ["https://www.googleapis.com/auth/calendar"]
+
+
+def fake_credentials(expires_in):
+    """Credentials expiring in expires_in minutes; refreshing adds one hour."""
+    creds = mock.Mock(valid=True, refresh_token="refresh")
+    creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(minutes=expires_in)
+
+    def refresh(request):
+        creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+    creds.refresh.side_effect = refresh
+    creds.to_json.side_effect = lambda: json.dumps(
+        {"token": "access", "expiry": creds.expiry.isoformat(), "scopes": SCOPES}
+    )
+    return creds
+
+
+class TestCredentialManager(unittest.TestCase):
+    def setUp(self):
+        self.config_dir = Path(tempfile.mkdtemp())
+        (self.config_dir / "credentials.json").write_text("{}")
+        self.token = self.config_dir / "calendar-token.json"
+        self.token.write_text(json.dumps({"token": "old", "scopes": SCOPES}))
+        self.manager = credentials.CredentialManager(
+            self.config_dir, self.token.name, SCOPES
+        )
+        # Background refreshes are not run by tests
+        patch = mock.patch.object(credentials.threading, "Timer")
+        self.timer = patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+
+    def load(self, creds):
+        with mock.patch.object(
+            credentials.Credentials, "from_authorized_user_info", return_value=creds
+        ), mock.patch.object(credentials, "Request"):
+            return self.manager.get()
+
+    def test_valid_token(self):
+        creds = fake_credentials(60)
+        self.assertIs(self.load(creds), creds)
+        creds.refresh.assert_not_called()
+        # The refresh is scheduled ten minutes before expiry
+        delay = self.timer.call_args[0][0]
+        self.assertAlmostEqual(delay, 50 * 60, delta=5)
+        self.assertEqual(json.loads(self.token.read_text())["token"], "old")
+
+    def test_refreshed_when_expiring(self):
+        creds = fake_credentials(5)
+        self.assertIs(self.load(creds), creds)
+        creds.refresh.assert_called_once()
+        self.assertEqual(json.loads(self.token.read_text())["token"], "access")
+        self.assertEqual(self.token.stat().st_mode & 0o777, 0o600)
+        self.assertEqual(
+            sorted(path.name for path in self.config_dir.iterdir()),
+            sorted(["credentials.json", self.token.name]),
+        )
+
+    def test_refreshed_when_used(self):
+        creds = fake_credentials(60)
+        self.load(creds)
+        creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        with mock.patch.object(credentials, "Request"):
+            self.manager.get()
+        creds.refresh.assert_called_once()
+        self.assertEqual(self.timer.return_value.cancel.call_count, 1)
+
+    def test_missing_scope(self):
+        creds = fake_credentials(60)
+        self.load(creds)
+        self.manager.require(["https://www.googleapis.com/auth/spreadsheets"])
+        flow = mock.Mock()
+        flow.run_local_server.return_value = fake_credentials(60)
+        with mock.patch.object(
+            credentials.InstalledAppFlow,
+            "from_client_secrets_file",
+            return_value=flow,
+        ) as from_file:
+            self.assertIs(self.manager.get(), flow.run_local_server.return_value)
+        self.assertEqual(len(from_file.call_args[0][1]), 2)
+        self.assertEqual(json.loads(self.token.read_text())["token"], "access")
@@ -0,0 +1,55 @@
+"""Tests for `haunts.journal`."""
+
+import unittest
+
+from haunts.journal import pending_operations
+
+
+def planned(row, action="create"):
+    return {"type": "planned", "month": "May", "row": row, "action": action}
+
+
+def done(row, event_id):
+    return {
+        "type": "done",
+        "month": "May",
+        "row": row,
+        "event": {"id": event_id, "link": f"https://calendar/{event_id}"},
+    }
+
+
+class TestPendingOperations(unittest.TestCase):
+    def test_nothing_done(self):
+        records = [{"type": "run"}, planned(0), planned(1)]
+        self.assertEqual(
+            pending_operations(records),
+            ({}, {("May", 0): planned(0), ("May", 1): planned(1)}),
+        )
+
+    def test_done_and_flushed(self):
+        records = [
+            {"type": "run"},
+            planned(0),
+            planned(1),
+            planned(2, "delete"),
+            done(0, "ev0"),
+            {"type": "flushed"},
+            done(1, "ev1"),
+        ]
+        done_operations, planned_operations = pending_operations(records)
+        # Row 0 has already been written back to the sheet
+        self.assertEqual(list(done_operations), [("May", 1)])
+        self.assertEqual(done_operations[("May", 1)]["event"]["id"], "ev1")
+        self.assertEqual(done_operations[("May", 1)]["action"], "create")
+        self.assertEqual(planned_operations, {("May", 2): planned(2, "delete")})
+
+    def test_planned_again(self):
+        # A resumed run plans again operations of the interrupted one
+        records = [{"type": "run"}, planned(0), done(0, "ev0"), planned(0, "update")]
+        self.assertEqual(
+            pending_operations(records), ({}, {("May", 0): planned(0, "update")})
+        )
+
+    def test_done_without_plan(self):
+        records = [{"type": "run"}, done(3, "ev3")]
+        self.assertEqual(pending_operations(records), ({}, {}))
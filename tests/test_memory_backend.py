@@ -0,0 +1,219 @@
+"""End-to-end tests using the memory backend."""
+
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import httplib2
+
+from haunts import ini, memory
+from haunts.journal import Journal
+from haunts.reconcile import reconcile
+from haunts.spreadsheet import SheetWriter, get_service, read_sheets, sync_report
+
+HEADERS = ["Date", "Start time", "Spent", "Project", "Activity", "Details"]
+HEADERS += ["Event id", "Link", "Action", "Fingerprint"]
+# 2022-05-02
+MAY_2 = 44683
+
+
+class TestMemoryBackend(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Services are built once per process, so all tests use the same directory
+        cls.config_dir = Path(tempfile.mkdtemp())
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.config_dir)
+
+    def setUp(self):
+        for name in ("journal", "reconcile"):
+            shutil.rmtree(self.config_dir / name, ignore_errors=True)
+        config = self.config_dir / "haunts.ini"
+        config.write_text(
+            "[haunts]\n"
+            "CONTROLLER_SHEET_DOCUMENT_ID=doc\n"
+            "BACKEND=memory\n"
+            "START_TIME=09:00\n"
+            "PAGE_SIZE=\n"
+            "CACHE_TTL=0\n"
+        )
+        ini.init(config)
+        rows = [HEADERS]
+        for day in range(3):
+            for n, project in enumerate(["P1", "P2", "P1"]):
+                rows.append([MAY_2 + day, "", 1 + n, project, f"task {day}-{n}", ""])
+        self.write_state(
+            {
+                "spreadsheets": {
+                    "doc": {
+                        "sheets": {
+                            "May": rows,
+                            "config": [["id", "name"], ["c1", "P1"], ["c2", "P2"]],
+                        }
+                    }
+                },
+                "calendars": {
+                    "c1": {"summary": "P1", "events": {}},
+                    "c2": {"summary": "P2", "events": {}},
+                },
+            }
+        )
+
+    def state_file(self):
+        return self.config_dir / "memory-backend.json"
+
+    def write_state(self, state):
+        with open(self.state_file(), "w") as f:
+            json.dump(state, f)
+        # Data is loaded again from the new file
+        memory.state = None
+
+    def read_state(self):
+        with open(self.state_file()) as f:
+            return json.load(f)
+
+    def run_quietly(self, function, *args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            function(self.config_dir, *args, **kwargs)
+        return output.getvalue()
+
+    def rows(self, state):
+        return state["spreadsheets"]["doc"]["sheets"]["May"][1:]
+
+    def events(self, state):
+        return {
+            event_id: event
+            for calendar in state["calendars"].values()
+            for event_id, event in calendar["events"].items()
+            if event.get("status") != "cancelled"
+        }
+
+    def assertSynced(self, state):
+        rows = self.rows(state)
+        events = self.events(state)
+        self.assertEqual([row[8] for row in rows], ["I"] * 9)
+        for row in rows:
+            event = events[row[6]]
+            self.assertEqual(event["summary"], row[4])
+            self.assertEqual(
+                event["extendedProperties"]["private"]["haunts"], "doc:May"
+            )
+
+    def test_sync(self):
+        self.run_quietly(sync_report, ["May"])
+        state = self.read_state()
+        self.assertSynced(state)
+        events = self.events(state)
+        self.assertEqual(len(events), 9)
+        starts = [
+            events[row[6]]["start"]["dateTime"][11:16] for row in self.rows(state)
+        ]
+        self.assertEqual(starts, ["09:00", "10:00", "12:00"] * 3)
+        # Nothing to do when run again
+        self.run_quietly(sync_report, ["May"])
+        self.assertEqual(self.read_state(), state)
+
+    def test_pages_with_blank_rows(self):
+        state = self.read_state()
+        rows = state["spreadsheets"]["doc"]["sheets"]["May"]
+        # Blank rows filling whole pages, then trailing blank rows of the grid
+        rows[4:4] = [[] for _ in range(7)]
+        rows.extend([[""] * 6 for _ in range(5)])
+        self.write_state(state)
+        sheet = get_service(self.config_dir).spreadsheets()
+        schema, data = read_sheets(sheet, ["May"])[0]
+        self.assertEqual(len(data["values"]), 16)
+        for page_size in (1, 2, 3, 5, 100):
+            paged_schema, paged = read_sheets(sheet, ["May"], page_size)[0]
+            self.assertEqual(paged_schema.headers, HEADERS)
+            self.assertEqual(list(paged["values"]), data["values"], page_size)
+
+        ini.parser.read_dict({"haunts": {"PAGE_SIZE": "3"}})
+        self.run_quietly(sync_report, ["May"])
+        rows = self.read_state()["spreadsheets"]["doc"]["sheets"]["May"]
+        # Results are written back to the rows of their events
+        self.assertEqual([row[8:9] for row in rows[4:11]], [[]] * 7)
+        synced = [row for row in rows[1:] if len(row) > 8]
+        self.assertEqual(
+            [row[4] for row in synced], [row[4] for row in data["values"] if row]
+        )
+        self.assertEqual({row[8] for row in synced}, {"I"})
+
+    def test_days_with_rows_of_other_days_in_between(self):
+        state = self.read_state()
+        rows = state["spreadsheets"]["doc"]["sheets"]["May"]
+        # The first day continues after a row of the next day
+        rows[4:4] = [rows.pop(1)]
+        self.write_state(state)
+        self.run_quietly(sync_report, ["May"], days=["2022-05-02"])
+        state = self.read_state()
+        events = self.events(state)
+        starts = [
+            events[row[6]]["start"]["dateTime"][11:16]
+            for row in self.rows(state)
+            if len(row) > 6 and row[6]
+        ]
+        # Like when reading the whole sheet, rows after the other day start again
+        self.assertEqual(starts, ["09:00", "11:00", "09:00"])
+
+    def test_resume(self):
+        with mock.patch.object(SheetWriter, "write", side_effect=SystemExit("crash")):
+            with self.assertRaises(SystemExit):
+                self.run_quietly(sync_report, ["May"], batch=True)
+        state = self.read_state()
+        self.assertEqual(len(self.events(state)), 9)
+        self.assertEqual([len(row) for row in self.rows(state)], [6] * 9)
+
+        # An interrupted sync must be resumed
+        with self.assertRaises(SystemExit):
+            self.run_quietly(sync_report, ["May"])
+        self.run_quietly(sync_report, [], resume=True)
+        state = self.read_state()
+        self.assertSynced(state)
+        self.assertEqual(len(self.events(state)), 9)
+
+    def test_journal_closed_after_errors(self):
+        with mock.patch.object(
+            Journal, "close", autospec=True, side_effect=Journal.close
+        ) as close, mock.patch(
+            "haunts.spreadsheet.run_events",
+            side_effect=httplib2.ServerNotFoundError("offline"),
+        ):
+            with self.assertRaises(httplib2.ServerNotFoundError):
+                self.run_quietly(sync_report, ["May"])
+        # The journal is kept, to resume the sync
+        close.assert_called_once_with(mock.ANY, remove=False)
+        self.run_quietly(sync_report, [], resume=True)
+        self.assertSynced(self.read_state())
+
+    def test_reconcile(self):
+        self.run_quietly(sync_report, ["May"])
+        state = self.read_state()
+        rows = self.rows(state)
+        c1 = state["calendars"]["c1"]["events"]
+        deleted = c1.pop(rows[0][6])
+        c1[rows[2][6]]["summary"] = "changed by hand"
+        for owner in ["doc:May", "doc:June", "other:May"]:
+            c1[owner] = {**deleted, "id": owner, "summary": owner}
+            c1[owner]["extendedProperties"] = {"private": {"haunts": owner}}
+        self.write_state(state)
+
+        output = self.run_quietly(reconcile, ["May"])
+        self.assertIn("1 events created again, 1 restored, 1 deleted", output)
+        state = self.read_state()
+        self.assertSynced(state)
+        self.assertNotEqual(self.rows(state)[0][6], rows[0][6])
+        # Events of other sheets and of other people are kept
+        self.assertEqual(
+            set(self.events(state)) - {row[6] for row in self.rows(state)},
+            {"doc:June", "other:May"},
+        )
+        output = self.run_quietly(reconcile, ["May"])
+        self.assertIn("Calendars are in sync with the sheets.", output)
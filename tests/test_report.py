@@ -0,0 +1,131 @@
+"""Tests for `haunts.report`."""
+
+import io
+import json
+import math
+import unittest
+from unittest import mock
+
+from haunts import ini
+from haunts.report import (
+    create_sheets_report,
+    group_columns,
+    report_columns,
+    stream_report,
+)
+from haunts.spreadsheet import SheetSchema
+
+HEADERS = ["Date", "Start time", "Spent", "Project"]
+# 2022-05-01
+MAY_1 = 44682
+
+
+class TestColumns(unittest.TestCase):
+    def test_report_columns(self):
+        data = {
+            "values": [
+                [MAY_1, "09:30", 2, "P"],
+                [],
+                [MAY_1, "", "", "Q"],
+                [MAY_1 + 1, "18:00", "x", "P"],
+            ]
+        }
+        dates, starts, spent, codes, projects = report_columns(
+            data, SheetSchema(HEADERS).indexes
+        )
+        self.assertEqual(list(dates), [MAY_1, MAY_1, MAY_1 + 1])
+        self.assertEqual(list(starts), [570, -1, 1080])
+        self.assertEqual(spent[0], 2)
+        self.assertTrue(math.isnan(spent[1]))
+        self.assertEqual(spent[2], 0)
+        self.assertEqual(list(codes), [0, 1, 0])
+        self.assertEqual(projects, ["P", "Q"])
+
+        _, starts, *_ = report_columns(
+            data, SheetSchema(HEADERS).indexes, with_start=False
+        )
+        self.assertEqual(list(starts), [-1, -1, -1])
+
+    def test_group_columns(self):
+        report = group_columns(
+            [MAY_1, MAY_1, MAY_1, MAY_1 + 1],
+            [540, 1080, -1, 600],
+            [2, 1, math.nan, 3],
+            [0, 0, 1, 0],
+            ["P", "Q"],
+            overtime_start=17 * 60,
+            working_hours=8,
+        )
+        may_1 = report["2022-05-01"]
+        self.assertTrue(may_1["have_full_day"])
+        self.assertEqual(
+            may_1["projects"]["P"], {"total": 3, "overtime": 1, "full_day": False}
+        )
+        # The full day event fills the rest of the working day, overtime excluded
+        self.assertEqual(
+            may_1["projects"]["Q"], {"total": 6, "overtime": 0, "full_day": True}
+        )
+        self.assertEqual(report["2022-05-02"]["projects"]["P"]["total"], 3)
+
+
+class TestSheetsReport(unittest.TestCase):
+    def setUp(self):
+        ini.parser.read_dict({"haunts": {"OVERTIME_FROM": "", "WORKING_HOURS": "8"}})
+
+    def test_merge_sheets(self):
+        schema = SheetSchema(HEADERS)
+        april = {"values": [[MAY_1 - 1, "", 2, "P"], [MAY_1, "", 1, "Q"]]}
+        # Rows can be generators, like sheets read in pages
+        may = {"values": iter([[MAY_1, "", 3, "P"], [MAY_1, "", 1, "Q"]])}
+        report = create_sheets_report([(schema, april), (schema, may)])
+        self.assertEqual(list(report), ["2022-04-30", "2022-05-01"])
+        totals = {
+            project: stats["total"]
+            for project, stats in report["2022-05-01"]["projects"].items()
+        }
+        self.assertEqual(totals, {"Q": 2, "P": 3})
+
+
+class TestStreamReport(unittest.TestCase):
+    report = {
+        "2022-05-02": {
+            "projects": {
+                "P": {"total": 2, "overtime": 0, "full_day": False},
+                "Q": {"total": 6, "overtime": 1, "full_day": False},
+            },
+            "have_full_day": False,
+        },
+        "2022-05-09": {
+            "projects": {"P": {"total": 8, "overtime": 0, "full_day": True}},
+            "have_full_day": True,
+        },
+    }
+
+    def output(self, *args, **kwargs):
+        stdout = io.StringIO()
+        with mock.patch("click.get_text_stream", return_value=stdout):
+            stream_report(self.report, *args, **kwargs)
+        return stdout.getvalue()
+
+    def test_csv(self):
+        self.assertEqual(
+            self.output("csv"),
+            "date,project,total\n2022-05-02,P,2\n2022-05-02,Q,6\n2022-05-09,P,8\n",
+        )
+
+    def test_jsonl_grouped(self):
+        lines = self.output("jsonl", group_by="week").splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [{"week": "2022-W18", "total": 8}, {"week": "2022-W19", "total": 8}],
+        )
+
+    def test_filters(self):
+        self.assertEqual(
+            self.output("csv", group_by="project", projects=["Q"]),
+            "project,total\nQ,6\n",
+        )
+        self.assertEqual(
+            self.output("csv", overtime=True, date_to="2022-05-08"),
+            "date,project,total\n2022-05-02,Q,1\n",
+        )
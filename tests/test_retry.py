@@ -0,0 +1,83 @@
+"""Tests for `haunts.retry`."""
+
+import email.utils
+import io
+import json
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from haunts import ini, retry
+
+
+def http_error(status, reason=None, headers={}):
+    content = {"error": {"code": status, "message": "error"}}
+    if reason:
+        content["error"]["errors"] = [{"reason": reason, "message": "error"}]
+    resp = httplib2.Response({"status": status, **headers})
+    return HttpError(resp, json.dumps(content).encode("utf-8"))
+
+
+class TestRetryDelay(unittest.TestCase):
+    def setUp(self):
+        ini.parser.read_dict({"haunts": {"RETRY_MAX_ATTEMPTS": "5"}})
+        self.deadline = time.monotonic() + 300
+
+    def test_retryable(self):
+        self.assertTrue(retry.is_retryable(http_error(429)))
+        self.assertTrue(retry.is_retryable(http_error(503)))
+        self.assertTrue(retry.is_retryable(http_error(403, "userRateLimitExceeded")))
+        self.assertFalse(retry.is_retryable(http_error(403, "forbidden")))
+        self.assertFalse(retry.is_retryable(http_error(404)))
+        self.assertFalse(retry.is_retryable(ValueError()))
+
+    def test_backoff(self):
+        with mock.patch("random.uniform", side_effect=lambda a, b: b):
+            delays = [
+                retry.retry_delay(http_error(500), attempt, self.deadline)
+                for attempt in (1, 2, 3, 4)
+            ]
+        self.assertEqual(delays, [2, 4, 8, 16])
+        self.assertIsNone(retry.retry_delay(http_error(500), 5, self.deadline))
+        self.assertIsNone(retry.retry_delay(http_error(400), 1, self.deadline))
+
+    def test_retry_after(self):
+        err = http_error(429, headers={"retry-after": "7"})
+        self.assertEqual(retry.retry_delay(err, 1, self.deadline), 7)
+        date = email.utils.formatdate(time.time() + 30, usegmt=True)
+        err = http_error(503, headers={"retry-after": date})
+        self.assertAlmostEqual(retry.retry_after(err), 30, delta=2)
+        err = http_error(503, headers={"retry-after": "soon"})
+        self.assertIsNone(retry.retry_after(err))
+
+    def test_deadline(self):
+        err = http_error(429, headers={"retry-after": "60"})
+        self.assertIsNone(retry.retry_delay(err, 1, time.monotonic() + 30))
+        self.assertEqual(retry.retry_delay(err, 1, time.monotonic() + 90), 60)
+
+
+class TestCall(unittest.TestCase):
+    def setUp(self):
+        ini.parser.read_dict(
+            {"haunts": {"RETRY_MAX_ATTEMPTS": "3", "RETRY_DEADLINE": "300"}}
+        )
+
+    def test_retried_until_success(self):
+        function = mock.Mock(side_effect=[http_error(503), http_error(429), "ok"])
+        with mock.patch.object(retry.time, "sleep") as sleep, redirect_stdout(
+            io.StringIO()
+        ):
+            self.assertEqual(retry.call(function), "ok")
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_attempts_exhausted(self):
+        function = mock.Mock(side_effect=http_error(503))
+        with mock.patch.object(retry.time, "sleep"), redirect_stdout(io.StringIO()):
+            with self.assertRaises(HttpError):
+                retry.call(function)
+        self.assertEqual(function.call_count, 3)
@@ -0,0 +1,150 @@
+"""Tests for `haunts.sources`."""
+
+import shutil
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from haunts import ini
+from haunts.sources import parse_date, read_local_sheets, read_ods, read_xlsx
+
+# 2022-05-01
+MAY_1 = 44682
+
+XLSX_WORKBOOK = """<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+  xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+  <sheets><sheet name="May" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+XLSX_RELS = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+  <Relationship Id="rId1" Target="worksheets/sheet1.xml"
+    Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>
+</Relationships>"""
+
+XLSX_STRINGS = """<?xml version="1.0" encoding="UTF-8"?>
+<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+  <si><t>Date</t></si><si><t>Spent</t></si><si><t>Project</t></si><si><t>P</t></si>
+</sst>"""
+
+ODS_CONTENT = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-content
+  xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+  xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+  xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">
+  <office:body><office:spreadsheet><table:table table:name="May">
+    <table:table-row>
+      <table:table-cell office:value-type="string"><text:p>Date</text:p></table:table-cell>
+      <table:table-cell office:value-type="string"><text:p>Start time</text:p></table:table-cell>
+      <table:table-cell office:value-type="string"><text:p>Spent</text:p></table:table-cell>
+    </table:table-row>
+    <table:table-row table:number-rows-repeated="2"><table:table-cell/></table:table-row>
+    <table:table-row>
+      <table:table-cell office:value-type="date" office:date-value="2022-05-01"/>
+      <table:table-cell office:value-type="time" office:time-value="PT09H30M00S"/>
+      <table:table-cell office:value-type="float" office:value="1.5"/>
+      <table:table-cell table:number-columns-repeated="1000"/>
+    </table:table-row>
+    <table:table-row table:number-rows-repeated="1000"><table:table-cell/></table:table-row>
+  </table:table></office:spreadsheet></office:body>
+</office:document-content>"""
+
+
+class TestLocalSheets(unittest.TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_csv_holds_a_single_sheet(self):
+        path = self.directory / "may.csv"
+        path.write_text("Date,Spent,Project\n2022-05-01,2,P\n")
+        [(schema, data)] = read_local_sheets(path, ["May"])
+        self.assertEqual(schema.indexes["Project"], 2)
+        self.assertEqual(data["values"], [[44682, 2, "P"]])
+        with self.assertRaises(ValueError):
+            read_local_sheets(path, ["Jan", "Feb"])
+
+
+class TestParseDate(unittest.TestCase):
+    def tearDown(self):
+        ini.parser.remove_option("haunts", "LOCAL_DATE_ORDER")
+
+    def test_formats(self):
+        ini.parser.read_dict({"haunts": {"LOCAL_DATE_ORDER": "DMY"}})
+        self.assertEqual(parse_date("01/05/2022"), MAY_1)
+        self.assertEqual(parse_date("1.5.22"), MAY_1)
+        self.assertEqual(parse_date("2022/05/01"), MAY_1)
+        self.assertEqual(parse_date(" 2022-5-1 "), MAY_1)
+
+    def test_month_first(self):
+        ini.parser.read_dict({"haunts": {"LOCAL_DATE_ORDER": "MDY"}})
+        self.assertEqual(parse_date("05/01/2022"), MAY_1)
+        self.assertEqual(parse_date("2022/05/01"), MAY_1)
+
+    def test_not_a_date(self):
+        ini.parser.read_dict({"haunts": {"LOCAL_DATE_ORDER": "DMY"}})
+        self.assertIsNone(parse_date("31/02/2022"))
+        self.assertIsNone(parse_date("total"))
+        self.assertIsNone(parse_date("1/5"))
+
+
+class TestLocalFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_xlsx(self, rows):
+        path = self.directory / "timesheet.xlsx"
+        sheet = (
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            f"<sheetData>{rows}</sheetData></worksheet>"
+        )
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("xl/workbook.xml", XLSX_WORKBOOK)
+            archive.writestr("xl/_rels/workbook.xml.rels", XLSX_RELS)
+            archive.writestr("xl/sharedStrings.xml", XLSX_STRINGS)
+            archive.writestr("xl/worksheets/sheet1.xml", sheet)
+        return path
+
+    def test_xlsx(self):
+        path = self.write_xlsx(
+            '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c>'
+            '<c r="C1" t="s"><v>2</v></c></row>'
+            f'<row r="3"><c r="A3"><v>{MAY_1}</v></c><c r="C3" t="s"><v>3</v></c>'
+            '<c r="AA3" t="inlineStr"><is><t>far</t></is></c></row>'
+        )
+        rows = read_xlsx(path, "May")
+        self.assertEqual(rows[0], ["Date", "Spent", "Project"])
+        self.assertEqual(rows[1], [])
+        self.assertEqual(rows[2][:3], [MAY_1, "", "P"])
+        self.assertEqual(rows[2][26], "far")
+        with self.assertRaises(KeyError):
+            read_xlsx(path, "June")
+
+    def test_xlsx_without_references(self):
+        path = self.write_xlsx(
+            '<row><c t="s"><v>0</v></c><c t="s"><v>1</v></c><c t="s"><v>2</v></c></row>'
+            f'<row><c><v>{MAY_1}</v></c><c><v>2.5</v></c><c r="D2" t="str"><v>x</v></c>'
+            '<c t="s"><v>3</v></c></row>'
+        )
+        self.assertEqual(
+            read_xlsx(path),
+            [["Date", "Spent", "Project"], [MAY_1, 2.5, "", "x", "P"]],
+        )
+
+    def test_ods(self):
+        path = self.directory / "timesheet.ods"
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("content.xml", ODS_CONTENT)
+        self.assertEqual(
+            read_ods(path, "May"),
+            [["Date", "Start time", "Spent"], [], [], [MAY_1, "09:30", 1.5]],
+        )
+        with self.assertRaises(KeyError):
+            read_ods(path, "June")
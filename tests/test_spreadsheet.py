@@ -0,0 +1,218 @@
+"""Tests for `haunts.spreadsheet`."""
+
+import datetime
+import unittest
+
+from haunts import ini
+from haunts.calendars import BusyIndex
+from haunts.spreadsheet import (
+    DateSelection,
+    SheetSchema,
+    column_letter,
+    date_index,
+    estimate_plan,
+    iter_spans,
+    plan_events,
+)
+
+HEADERS = ["Date", "Start time", "Spent", "Project", "Activity", "Details"]
+HEADERS += ["Event id", "Link", "Action"]
+# 2022-05-01
+MAY_1 = 44682
+
+
+class TestColumns(unittest.TestCase):
+    def test_column_letter(self):
+        self.assertEqual(column_letter(0), "A")
+        self.assertEqual(column_letter(25), "Z")
+        self.assertEqual(column_letter(26), "AA")
+        self.assertEqual(column_letter(51), "AZ")
+        self.assertEqual(column_letter(52), "BA")
+        self.assertEqual(column_letter(701), "ZZ")
+        self.assertEqual(column_letter(702), "AAA")
+
+    def test_sheet_schema(self):
+        schema = SheetSchema(["Date"] + [""] * 25 + ["Action", "Date"])
+        self.assertEqual(schema.indexes["Date"], 0)
+        self.assertEqual(schema.indexes["Action"], 26)
+        self.assertEqual(schema.letters["Date"], "A")
+        self.assertEqual(schema.letters["Action"], "AA")
+
+
+class TestDateSelection(unittest.TestCase):
+    def test_empty(self):
+        selection = DateSelection()
+        self.assertFalse(selection)
+        self.assertIn(datetime.date(2022, 5, 1), selection)
+
+    def test_days_and_range(self):
+        selection = DateSelection(
+            ["2022-05-01"], date_from="2022-05-10", date_to="2022-05-12"
+        )
+        self.assertTrue(selection)
+        self.assertIn(datetime.date(2022, 5, 1), selection)
+        self.assertNotIn(datetime.date(2022, 5, 2), selection)
+        self.assertIn(datetime.date(2022, 5, 10), selection)
+        self.assertIn(datetime.date(2022, 5, 12), selection)
+        self.assertNotIn(datetime.date(2022, 5, 13), selection)
+
+    def test_open_range(self):
+        selection = DateSelection(date_from="2022-05-10")
+        self.assertNotIn(datetime.date(2022, 5, 9), selection)
+        self.assertIn(datetime.date(2023, 1, 1), selection)
+
+
+class TestDateIndex(unittest.TestCase):
+    def test_date_index(self):
+        dates = [[MAY_1], [MAY_1], [], [MAY_1], [MAY_1 + 1], ["total"], [MAY_1 + 1]]
+        self.assertEqual(
+            date_index(dates),
+            {
+                datetime.date(2022, 5, 1): [(0, 1), (3, 3)],
+                datetime.date(2022, 5, 2): [(4, 4), (6, 6)],
+            },
+        )
+
+    def test_iter_spans(self):
+        # Trailing empty rows of a span are not returned by the API
+        rows = list(iter_spans([(1, 2), (5, 7)], [[["a"], ["b"]], [["c"]]]))
+        self.assertEqual(rows, [[], ["a"], ["b"], [], [], ["c"], [], []])
+
+
+class TestPlanEvents(unittest.TestCase):
+    def setUp(self):
+        ini.parser.read_dict(
+            {"haunts": {"CONTROLLER_SHEET_DOCUMENT_ID": "doc", "START_TIME": "09:00"}}
+        )
+
+    def start_times(self, operations):
+        return [
+            operation["body"]["start"]["dateTime"][11:16] for operation in operations
+        ]
+
+    def test_chain_after_synced_rows(self):
+        data = {
+            "values": [
+                [MAY_1, "", 2, "P", "synced", "", "ev1", "", "I"],
+                [MAY_1, "", 1, "P", "new", "", "", "", ""],
+                [MAY_1 + 1, "", 1, "P", "next day", "", "", "", ""],
+            ]
+        }
+        operations, warnings = plan_events(
+            data, {"P": "cal"}, SheetSchema(HEADERS), month="May"
+        )
+        self.assertEqual(warnings, [])
+        self.assertEqual([o["action"] for o in operations], ["create", "create"])
+        self.assertEqual(self.start_times(operations), ["11:00", "09:00"])
+        self.assertEqual(
+            operations[0]["body"]["extendedProperties"]["private"]["haunts"], "doc:May"
+        )
+
+    def test_filters_keep_start_times(self):
+        data = {
+            "values": [
+                [MAY_1, "", 2, "P", "synced", "", "ev1", "", "I"],
+                [MAY_1, "", 1, "Q", "other project", "", "", "", ""],
+                [MAY_1, "", 1, "P", "new", "", "", "", ""],
+            ]
+        }
+        calendars = {"P": "cal", "Q": "cal2"}
+        operations, _ = plan_events(data, calendars, SheetSchema(HEADERS))
+        self.assertEqual(self.start_times(operations), ["11:00", "12:00"])
+        operations, _ = plan_events(
+            data, calendars, SheetSchema(HEADERS), allowed_actions=["empty"]
+        )
+        self.assertEqual(self.start_times(operations), ["11:00", "12:00"])
+        operations, _ = plan_events(
+            data, calendars, SheetSchema(HEADERS), projects=["P"]
+        )
+        self.assertEqual(self.start_times(operations), ["12:00"])
+
+    def synced_rows(self, schema, rows):
+        """Save fingerprints of synced rows, as done by the first sync."""
+        rows = [row + [""] for row in rows]
+        operations, _ = plan_events({"values": rows}, {"P": "cal", "Q": "cal2"}, schema)
+        self.assertEqual({o["action"] for o in operations}, {"fingerprint"})
+        for operation in operations:
+            rows[operation["row"]][-1] = operation["fingerprint"]
+        return rows
+
+    def test_changed_row_moves_following_events(self):
+        schema = SheetSchema(HEADERS + ["Fingerprint"])
+        rows = self.synced_rows(
+            schema,
+            [
+                [MAY_1, "", 2, "P", "first", "", "ev1", "", "I"],
+                [MAY_1, "", 1, "P", "second", "", "ev2", "", "I"],
+                [MAY_1, "15:00", 1, "P", "fixed", "", "ev3", "", "I"],
+                [MAY_1, "", 1, "P", "after fixed", "", "ev4", "", "I"],
+            ],
+        )
+        calendars = {"P": "cal", "Q": "cal2"}
+        operations, _ = plan_events({"values": rows}, calendars, schema)
+        self.assertEqual(operations, [])
+
+        rows[0][2] = 3
+        operations, _ = plan_events({"values": rows}, calendars, schema)
+        self.assertEqual([o["event_id"] for o in operations], ["ev1", "ev2"])
+        self.assertEqual(self.start_times(operations), ["09:00", "12:00"])
+
+    def test_project_change_does_not_move_following_events(self):
+        schema = SheetSchema(HEADERS + ["Fingerprint"])
+        rows = self.synced_rows(
+            schema,
+            [
+                [MAY_1, "", 2, "P", "first", "", "ev1", "", "I"],
+                [MAY_1, "", 1, "P", "second", "", "ev2", "", "I"],
+            ],
+        )
+        rows[0][3] = "Q"
+        operations, _ = plan_events({"values": rows}, {"P": "cal", "Q": "cal2"}, schema)
+        self.assertEqual([o["event_id"] for o in operations], ["ev1"])
+        self.assertEqual(operations[0]["calendar"], "cal2")
+        self.assertEqual(operations[0]["source"], "cal")
+
+    def test_full_day_events_are_free_only_with_free_slots(self):
+        data = {"values": [[MAY_1, "", "", "P", "holiday", "", "", "", ""]]}
+        operations, _ = plan_events(data, {"P": "cal"}, SheetSchema(HEADERS))
+        self.assertNotIn("transparency", operations[0]["body"])
+        operations, _ = plan_events(
+            data, {"P": "cal"}, SheetSchema(HEADERS), busy=BusyIndex()
+        )
+        self.assertEqual(operations[0]["body"]["transparency"], "transparent")
+
+
+class TestEstimatePlan(unittest.TestCase):
+    def operation(self, action, calendar, event_id="ev", source=None):
+        return {
+            "action": action,
+            "month": "May",
+            "calendar": calendar,
+            "event_id": event_id,
+            "source": source,
+        }
+
+    def test_estimate(self):
+        schemas = {"May": SheetSchema(HEADERS + ["Fingerprint"])}
+        operations = [self.operation("create", "a") for _ in range(60)]
+        operations += [
+            self.operation("update", "b", source="a"),
+            self.operation("delete", "b"),
+            self.operation("delete", "b", event_id=None),
+            self.operation("fingerprint", None),
+        ]
+        estimate = estimate_plan(operations, schemas)
+        self.assertEqual(estimate["create"], 60)
+        self.assertEqual(estimate["update"], 1)
+        self.assertEqual(estimate["delete"], 2)
+        self.assertEqual(estimate["cleared_only"], 1)
+        self.assertEqual(estimate["fingerprint"], 1)
+        # The moved event is also deleted from its source calendar
+        self.assertEqual(estimate["calendar_calls"], 63)
+        self.assertEqual(estimate["calendar_requests"], 63)
+        self.assertEqual(estimate["sheet_cells"], 61 * 4 + 2 * 4 + 1)
+
+        estimate = estimate_plan(operations, schemas, batch=True)
+        self.assertEqual(estimate["calendar_requests"], 2 + 1)
+        estimate = estimate_plan(operations, schemas, batch=True, workers=2)
+        self.assertEqual(estimate["calendar_requests"], 2 + 1 + 1)
@@ -0,0 +1,119 @@
+"""Tests for `haunts.watch`."""
+
+import contextlib
+import io
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import httplib2
+
+from haunts import ini, watch
+from haunts.spreadsheet import SheetSchema
+
+HEADERS = ["Date", "Spent", "Project"]
+
+
+def sheets(*months):
+    """Sheets as returned by read_sheets, with rows read in pages."""
+    return [
+        (SheetSchema(HEADERS), {"values": iter([[44682, hours, "P"]])})
+        for hours in months
+    ]
+
+
+class TestReadChanged(unittest.TestCase):
+    def read_changed(self, months, digests, resume=False):
+        with mock.patch.object(watch, "read_sheets", return_value=sheets(*months)):
+            return watch.read_changed(
+                None, ["May", "June"], watch.DateSelection(), digests, resume
+            )
+
+    def test_changed_sheets(self):
+        changed, digests = self.read_changed([1, 2], {})
+        self.assertEqual([month for month, _ in changed], ["May", "June"])
+        # Rows are loaded, so they can be read again when syncing
+        self.assertEqual(changed[0][1][1]["values"], [[44682, 1, "P"]])
+        self.assertEqual(list(digests), ["May", "June"])
+
+        changed, same_digests = self.read_changed([1, 3], digests)
+        self.assertEqual([month for month, _ in changed], ["June"])
+        self.assertEqual(same_digests["May"], digests["May"])
+        self.assertNotEqual(same_digests["June"], digests["June"])
+
+        changed, _ = self.read_changed([1, 2], digests)
+        self.assertEqual(changed, [])
+
+    def test_resume(self):
+        _, digests = self.read_changed([1, 2], {})
+        changed, _ = self.read_changed([1, 2], digests, resume=True)
+        self.assertEqual([month for month, _ in changed], ["May", "June"])
+
+    def test_date_selection(self):
+        selection = watch.DateSelection(["2022-05-01"])
+        with mock.patch.object(
+            watch, "read_sheets_by_date", return_value=sheets(1)
+        ) as read:
+            changed, _ = watch.read_changed(None, ["May"], selection, {})
+        read.assert_called_once_with(None, ["May"], selection)
+        self.assertEqual(len(changed), 1)
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        ini.parser.read_dict(
+            {"haunts": {"CONTROLLER_SHEET_DOCUMENT_ID": "doc", "WATCH_INTERVAL": "10"}}
+        )
+
+    def test_poll_delay(self):
+        self.assertEqual(watch.poll_delay(10, 0), 10)
+        self.assertEqual(watch.poll_delay(10, 2), 40)
+        self.assertEqual(watch.poll_delay(10, 100), 64)
+        self.assertEqual(watch.poll_delay(100, 3), 100)
+
+    def run_watch(self, sync_results, polls):
+        """Run watch for some polls, with sync_sheets returning (or raising) results.
+
+        The revision of the spreadsheet never changes. Return calls to sync_sheets and
+        delays between polls.
+        """
+        delays = []
+
+        def sleep(delay):
+            delays.append(delay)
+            if len(delays) == polls:
+                raise KeyboardInterrupt()
+
+        patches = [
+            mock.patch.object(watch, "get_service"),
+            mock.patch.object(watch, "exit_if_interrupted"),
+            mock.patch.object(watch, "expand_sheets", return_value=["May"]),
+            mock.patch.object(watch, "get_revision", return_value="1"),
+            mock.patch.object(watch, "load_journal", return_value=None),
+            mock.patch.object(watch, "read_sheets", side_effect=lambda *_: sheets(1)),
+            mock.patch.object(
+                watch, "read_after_sync", side_effect=lambda *args: args[-2:]
+            ),
+            mock.patch.object(watch, "sync_sheets", side_effect=sync_results),
+            mock.patch.object(watch.time, "sleep", side_effect=sleep),
+        ]
+        with contextlib.ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            watch.watch(Path("."), ["May"])
+            return watch.sync_sheets.call_count, delays
+
+    def test_synced_once(self):
+        self.assertEqual(self.run_watch([[]], 3), (1, [10, 10, 10]))
+
+    def test_failed_rows_synced_again(self):
+        calls, delays = self.run_watch([[("May", 0)], [("May", 0)], []], 4)
+        self.assertEqual(calls, 3)
+        self.assertEqual(delays, [20, 40, 10, 10])
+
+    def test_temporary_errors(self):
+        results = [httplib2.ServerNotFoundError("offline"), OSError("timeout"), []]
+        calls, delays = self.run_watch(results, 4)
+        self.assertEqual(calls, 3)
+        self.assertEqual(delays, [20, 40, 10, 10])